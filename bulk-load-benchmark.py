@@ -0,0 +1,129 @@
+import argparse
+from datetime import datetime, timedelta
+from time import monotonic
+
+import db.db_utils as db_utils
+from db.db_utils import initialize_database, database, insert_repositories, insert_repository_users, \
+    flush_write_buffers, bulk_load, get_upsert_stats, reset_upsert_stats
+from db.models import VCSInstance, Repository, RepositoryUser
+from settings.config import DEBUG_ENABLED
+from settings.logger import logger
+
+BENCHMARK_URL = "https://bulk-load-benchmark.invalid"
+
+
+def generate_rows(instance_id: int, count: int, users_per_repo: int, revision: int) -> tuple[dict, dict]:
+    """
+    Generate repositories and repository users looking like the ones written by the GitLab parser.
+
+    @param instance_id: ID of the benchmark instance.
+    @param count: Number of repositories.
+    @param users_per_repo: Number of users of each repository.
+    @param revision: Revision of the rows, rows of different revisions differ by their activity time.
+
+    @return: Repositories and repository users.
+    """
+    now = datetime.now()
+    last_activity = now - timedelta(days=1) + timedelta(seconds=revision)
+    repositories = {}
+    repository_users = {}
+    for vcs_id in range(1, count + 1):
+        repositories[vcs_id] = {
+            "vcs_instance_id": instance_id,
+            "vcs_id": vcs_id,
+            "path": f"group-{vcs_id % 100}/project-{vcs_id}",
+            "group_id": vcs_id % 100,
+            "parents": [vcs_id % 100, vcs_id % 10],
+            "web_url": f"{BENCHMARK_URL}/group-{vcs_id % 100}/project-{vcs_id}",
+            "git_url": f"{BENCHMARK_URL}/group-{vcs_id % 100}/project-{vcs_id}.git",
+            "forks_count": 0,
+            "created": now - timedelta(days=365),
+            "default_branch": "main",
+            "last_time_checked": now,
+            "visibility": "private",
+            "last_activity_repo": last_activity,
+            "last_commit_at": last_activity,
+            "is_archived": False
+        }
+        for user_id in range(users_per_repo):
+            repository_users[(vcs_id, user_id)] = {
+                "vcs_instance_id": instance_id,
+                "repo_id": vcs_id,
+                "user_id": user_id,
+                "access_level": "Developer"
+            }
+    return repositories, repository_users
+
+
+def write_rows(repositories: dict, repository_users: dict, batch_size: int) -> None:
+    """
+    Write the rows in batches, as the project workers of the parsers do, then flush the write buffers.
+
+    @param repositories: Repositories to write.
+    @param repository_users: Users of the repositories, in the order of the repositories.
+    @param batch_size: Number of repositories written at a time.
+
+    @return: None.
+    """
+    repository_items = list(repositories.items())
+    user_items = list(repository_users.items())
+    users_per_repo = len(user_items) // len(repository_items) if repository_items else 0
+    for start in range(0, len(repository_items), batch_size):
+        insert_repositories(dict(repository_items[start:start + batch_size]))
+        insert_repository_users(
+            dict(user_items[start * users_per_repo:(start + batch_size) * users_per_repo]))
+    flush_write_buffers(log_stats=False)
+
+
+def delete_rows(instance_id: int) -> None:
+    with database:
+        RepositoryUser.delete().where(RepositoryUser.vcs_instance_id == instance_id).execute()
+        Repository.delete().where(Repository.vcs_instance_id == instance_id).execute()
+
+
+def run_pass(name: str, instance_id: int, is_bulk: bool, rows: tuple[dict, dict], batch_size: int) -> None:
+    reset_upsert_stats()
+    started = monotonic()
+    with bulk_load(instance_id, is_bulk):
+        write_rows(*rows, batch_size)
+    elapsed = monotonic() - started
+    row_count = len(rows[0]) + len(rows[1])
+    logger.info(f"{name:<8} {'copy' if is_bulk else 'upsert':<6} {elapsed:8.3f}s {row_count / elapsed:10.0f} rows/s "
+                f"{get_upsert_stats()}")
+
+
+def benchmark(args: argparse.Namespace) -> None:
+    with database:
+        instance, _ = VCSInstance.get_or_create(url=BENCHMARK_URL, type='benchmark', mnemonic='bulk-load-benchmark')
+    initial = generate_rows(instance.id, args.repositories, args.users, revision=0)
+    changed = generate_rows(instance.id, args.repositories, args.users, revision=1)
+
+    logger.info(f"Writing {args.repositories} repositories with {args.users} users each, "
+                f"in batches of {args.batch_size} repositories...")
+    try:
+        for is_bulk in (False, True):
+            delete_rows(instance.id)
+            run_pass("insert", instance.id, is_bulk, initial, args.batch_size)
+            run_pass("same", instance.id, is_bulk, initial, args.batch_size)
+            run_pass("changed", instance.id, is_bulk, changed, args.batch_size)
+    finally:
+        delete_rows(instance.id)
+        with database:
+            instance.delete_instance()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Compare the upsert and the COPY (BULK_LOAD_ENABLED) paths of writing inventory rows")
+
+    parser.add_argument('-r', '--repositories', type=int, default=100000, help="Number of repositories")
+    parser.add_argument('-u', '--users', type=int, default=5, help="Number of users of each repository")
+    parser.add_argument('-b', '--batch-size', type=int, default=100, help="Repositories written at a time")
+    args = parser.parse_args()
+
+    if DEBUG_ENABLED or db_utils.staging_loader is None:
+        logger.critical("Bulk load requires PostgreSQL and BULK_LOAD_ENABLED=True! Exitting...")
+        exit(-1)
+
+    initialize_database([VCSInstance, Repository, RepositoryUser])
+    benchmark(args)
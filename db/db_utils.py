@@ -1,17 +1,39 @@
+import operator
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import reduce
 from sys import exit
-from typing import Any
+from typing import Any, Callable, Optional
 
 import peewee
 from gitlab.v4.objects import ProjectRegistryRepository
+from playhouse.migrate import SchemaMigrator, migrate
 
 from db.models import VCSInstance, Repository, Group, Registry, Image, User, Contributor, RepositoryUser, Repository, database_proxy
-from db.models import Finding, ScanRepo
+from db.models import Finding, ScanRepo, InventoryRun, InventoryCheckpoint, InventoryTask, ContributorsState
+from db.pool import InstrumentedPooledPostgresqlDatabase
+from db.staging import StagingLoader
+from db.write_buffer import WriteBehindBuffer
 from settings.config import *
 from settings.logger import logger
+from utils.metrics import Metrics
 
 if DEBUG_ENABLED:
     logger.info(f"DEBUG_ENABLED specified, using sqlite3.db...")
     database = peewee.SqliteDatabase("sqlite3.db")
+elif DB_POOL_ENABLED:
+    logger.info(
+        f"Connecting to database: '{POSTGRES_USER}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}?currentSchema={POSTGRES_SCHEMA}' "
+        f"using pool of {DB_POOL_MAX_CONNECTIONS} connections...")
+    database = InstrumentedPooledPostgresqlDatabase(POSTGRES_DB,
+                                                    max_connections=DB_POOL_MAX_CONNECTIONS,
+                                                    stale_timeout=DB_POOL_STALE_TIMEOUT,
+                                                    timeout=DB_POOL_WAIT_TIMEOUT,
+                                                    user=POSTGRES_USER,
+                                                    password=POSTGRES_PASSWORD,
+                                                    host=POSTGRES_HOST,
+                                                    port=POSTGRES_PORT, autoconnect=False)
 else:
     logger.info(
         f"Connecting to database: '{POSTGRES_USER}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}?currentSchema={POSTGRES_SCHEMA}'...")
@@ -21,12 +43,50 @@ else:
                                          host=POSTGRES_HOST,
                                          port=POSTGRES_PORT, autoconnect=False)
 
+if BULK_LOAD_ENABLED and DEBUG_ENABLED:
+    logger.warning("BULK_LOAD_ENABLED specified, but bulk load is supported by PostgreSQL only, ignoring it...")
+staging_loader = StagingLoader(database, RESUME_MAX_AGE_HOURS) if BULK_LOAD_ENABLED and not DEBUG_ENABLED else None
+
+write_buffers = {}
+write_buffers_lock = threading.Lock()
+
+# fingerprints of the users written during the current run, by instance ID and user ID
+users_caches = {}
+users_cache_lock = threading.Lock()
+users_cache_metrics = Metrics("users_cache")
+
+upsert_metrics = {}
+upsert_metrics_lock = threading.Lock()
+
+# Stages of a distributed run claimed only once the other tasks of the run are finished
+FINAL_INVENTORY_STAGES = ['sweep']
+
+
+def ensure_columns(db: peewee.Database, models: Any) -> None:
+    """
+    Add the nullable or defaulted columns of the models missing from their existing tables.
+
+    @param db: Database to migrate.
+    @param models: Models whose tables are migrated.
+
+    @return: None.
+    """
+    migrator = SchemaMigrator.from_database(db)
+    for model in models:
+        table = model._meta.table_name
+        columns = {column.name for column in db.get_columns(table)}
+        for field in model._meta.sorted_fields:
+            if field.column_name not in columns and (field.null or field.default is not None):
+                logger.info(f"Adding column '{field.column_name}' to table '{table}'...")
+                migrate(migrator.add_column(table, field.column_name, field))
+
 
 def init_db(db: peewee.Database, models: Any) -> None:
     database_proxy.initialize(db)
     try:
-        db.connect()
-        db.create_tables(models)
+        with db:
+            db.create_tables(models)
+            ensure_columns(db, models)
     except Exception as err:
         logger.fatal(str(err))
         exit(-1)
@@ -38,22 +98,290 @@ def initialize_database(models: list, vcs_instances=None) -> None:
     if vcs_instances:
         for key in vcs_instances:
             instance = vcs_instances[key]
-            with database.atomic():
+            with database:
                 instance_obj, created = VCSInstance.get_or_create(url=instance['URL'], type=instance['TYPE'], mnemonic=key)
                 if created:
                     logger.info(f"Instance '{instance_obj.url}' added into database...")
     logger.info("Database initialized!")
 
 
-def insert_data_to_db(model, data, conflict_target, update) -> None:
+def get_seen_before() -> datetime:
+    """
+    Return the time before which a row is refreshed as seen by the current run, rows checked after it are left as is
+    unless their content changed.
+
+    @return: Time of the oldest check not refreshed by upserts and touches.
+    """
+    return datetime.now() - timedelta(hours=LAST_SEEN_RESOLUTION_HOURS)
+
+
+def _is_distinct_from(lhs: Any, rhs: Any) -> peewee.Expression:
+    return peewee.Expression(lhs, 'IS NOT' if isinstance(database, peewee.SqliteDatabase) else 'IS DISTINCT FROM', rhs)
+
+
+def _changed_rows_condition(update: dict) -> Optional[peewee.Expression]:
+    """
+    Build the condition of the upsert updating only the rows whose content differs from the inserted row, or whose
+    `last_time_checked` or `last_time_seen` is older than LAST_SEEN_RESOLUTION_HOURS.
+
+    @param update: Fields to update on conflict.
+
+    @return: Condition of the update, or None if every row has to be updated.
+    """
+    conditions = []
+    for field, value in update.items():
+        if field.name in ('last_time_checked', 'last_time_seen'):
+            conditions.append(field.is_null() | (field < get_seen_before()))
+        else:
+            conditions.append(_is_distinct_from(field, value))
+    return reduce(operator.or_, conditions) if conditions else None
+
+
+def _get_upsert_metrics(model) -> Metrics:
+    with upsert_metrics_lock:
+        metrics = upsert_metrics.get(model)
+        if metrics is None:
+            metrics = upsert_metrics[model] = Metrics(f"upserts.{model.__name__}")
+        return metrics
+
+
+def _upsert_chunk(model, chunk: list, conflict_target: list, update: dict, where: Optional[peewee.Expression],
+                  metrics: Metrics) -> None:
+    query = model.insert_many(chunk).on_conflict(conflict_target=conflict_target, update=update, where=where)
+    if isinstance(database, peewee.SqliteDatabase):
+        written = query.as_rowcount().execute()
+        metrics.incr("written", written)
+    else:
+        inserted = [row[0] for row in query.returning(peewee.SQL('xmax = 0')).tuples().execute()]
+        written = len(inserted)
+        metrics.incr("inserted", sum(inserted))
+        metrics.incr("updated", written - sum(inserted))
+    metrics.incr("unchanged", len(chunk) - written)
+
+
+def _log_dropped_rows(model, rows: list, conflict_target: list, err: Exception) -> None:
+    keys = [tuple(row.get(field.name) for field in conflict_target) for row in rows]
+    _get_upsert_metrics(model).incr("dropped", len(rows))
+    logger.error(f"Error on inserting {model.__name__}, dropped {len(rows)} rows {keys}: {err}")
+
+
+def _upsert_rows(model, rows: list, conflict_target: list, update: dict, where: Optional[peewee.Expression]) -> list:
+    """
+    Upsert rows in a savepoint. A failed batch is retried in halves down to single rows, so only the rows which cannot
+    be written are dropped.
+
+    @param model: Model to insert rows into.
+    @param rows: Rows to insert.
+    @param conflict_target: Fields of the unique index used for the upsert.
+    @param update: Fields to update on conflict.
+    @param where: Condition of the update on conflict if SKIP_UNCHANGED_ROWS is enabled, see `_changed_rows_condition`.
+
+    @return: Rows upserted successfully.
+    """
+    try:
+        with database.atomic():
+            if SKIP_UNCHANGED_ROWS:
+                _upsert_chunk(model, rows, conflict_target, update, where, _get_upsert_metrics(model))
+            else:
+                model.insert_many(rows).on_conflict(conflict_target=conflict_target, update=update).execute()
+        return rows
+    except (peewee.OperationalError, peewee.InterfaceError) as e:
+        _log_dropped_rows(model, rows, conflict_target, e)
+        return []
+    except Exception as e:
+        if len(rows) == 1:
+            _log_dropped_rows(model, rows, conflict_target, e)
+            return []
+        logger.debug(f"Error on inserting {len(rows)} {model.__name__} rows, retrying them in halves: {e}")
+        middle = len(rows) // 2
+        return (_upsert_rows(model, rows[:middle], conflict_target, update, where) +
+                _upsert_rows(model, rows[middle:], conflict_target, update, where))
+
+
+def insert_data_to_db(model, data, conflict_target, update) -> list:
+    """
+    Upsert rows. If SKIP_UNCHANGED_ROWS is enabled, the rows equal to the stored ones are not rewritten, and the number
+    of inserted, updated and unchanged rows is counted by model. Rows which cannot be written are dropped and logged
+    with their keys, without dropping the other rows of their batch.
+
+    @param model: Model to insert rows into.
+    @param data: Rows to insert.
+    @param conflict_target: Fields of the unique index used for the upsert.
+    @param update: Fields to update on conflict.
+
+    @return: Rows written into the database, once committed.
+    """
+    if not data:
+        return []
+    logger.debug(f"Inserting {model.__name__} ({len(data)})")
+    where = _changed_rows_condition(update) if SKIP_UNCHANGED_ROWS else None
+    written = []
+    try:
+        with database:
+            for chunk in peewee.chunked(data.values(), INSERT_CHUNK_SIZE):
+                written += _upsert_rows(model, chunk, conflict_target, update, where)
+    except Exception as e:
+        _log_dropped_rows(model, list(data.values()), conflict_target, e)
+        return []
+    return written
+
+
+def copy_data_to_staging(model, data, conflict_target, update) -> list:
+    """
+    Stream rows into the staging table of the model, they are merged into the model table by `merge_staged_rows`.
+
+    @param model: Model to insert rows into.
+    @param data: Rows to insert.
+    @param conflict_target: Fields of the unique index used for the upsert.
+    @param update: Fields to update on conflict.
+
+    @return: Rows written into the database, always empty as staged rows are written by the merge.
+    """
     if data:
-        logger.debug(f"Inserting {model.__name__} ({len(data)})")
+        logger.debug(f"Staging {model.__name__} ({len(data)})")
+        try:
+            with database:
+                _get_upsert_metrics(model).incr("staged", staging_loader.copy(model, data, conflict_target, update))
+        except Exception as e:
+            logger.error(f"Error on staging {model.__name__}: {e}")
+    return []
+
+
+def merge_staged_rows() -> None:
+    """
+    Merge the rows staged by the current process into the model tables with a single upsert by model.
+
+    @return: None.
+    """
+    if staging_loader is None:
+        return
+    for model in staging_loader.staged_models():
         try:
             with database:
-                for chunk in peewee.chunked(data.values(), INSERT_CHUNK_SIZE):
-                    model.insert_many(chunk).on_conflict(conflict_target=conflict_target, update=update).execute()
+                merged, inserted, written = staging_loader.merge(
+                    model, _changed_rows_condition if SKIP_UNCHANGED_ROWS else None)
         except Exception as e:
-            logger.error(f"Error on inserting {model.__name__}: {e}")
+            logger.error(f"Error on merging staged {model.__name__}: {e}")
+            continue
+        metrics = _get_upsert_metrics(model)
+        metrics.incr("inserted", inserted)
+        metrics.incr("updated", written - inserted)
+        metrics.incr("unchanged", merged - written)
+        if merged:
+            metrics.incr("merges")
+
+
+def write_data_to_db(model, data, conflict_target, update) -> list:
+    """
+    Write the rows of the VCS instances being bulk loaded into the staging table of the model, and upsert the other
+    rows at once.
+
+    @param model: Model to insert rows into.
+    @param data: Rows to insert.
+    @param conflict_target: Fields of the unique index used for the upsert.
+    @param update: Fields to update on conflict.
+
+    @return: Rows written into the database, see `insert_data_to_db` and `copy_data_to_staging`.
+    """
+    active_instances = staging_loader.active_instances() if staging_loader is not None else set()
+    if not active_instances:
+        return insert_data_to_db(model, data, conflict_target, update)
+    staged = {key: row for key, row in data.items() if row.get('vcs_instance_id') in active_instances}
+    upserted = {key: row for key, row in data.items() if key not in staged}
+    return (copy_data_to_staging(model, staged, conflict_target, update) +
+            insert_data_to_db(model, upserted, conflict_target, update))
+
+
+@contextmanager
+def bulk_load(instance_id: int, enabled: bool = True):
+    """
+    Write the rows of the VCS instance buffered within the context with COPY into staging tables, merged into the
+    model tables whenever the write buffers are flushed, if BULK_LOAD_ENABLED is set and the database is PostgreSQL.
+    Rows of the other instances inventoried concurrently are upserted as usual.
+
+    @param instance_id: ID of the VCS instance whose rows are bulk loaded.
+    @param enabled: Whether the rows are written with COPY, e.g. for full runs only.
+    """
+    if not enabled or staging_loader is None:
+        yield
+        return
+    staging_loader.begin(instance_id)
+    try:
+        yield
+    finally:
+        staging_loader.end(instance_id)
+        if not staging_loader.is_active(instance_id):
+            flush_write_buffers(log_stats=False)
+
+
+def buffer_data_to_db(model, data, conflict_target, update,
+                      on_written: Optional[Callable[[list], None]] = None) -> None:
+    """
+    Queue rows into the write-behind buffer of the model, or insert them at once if buffering is disabled.
+
+    @param model: Model to insert rows into.
+    @param data: Rows to insert.
+    @param conflict_target: Fields of the unique index used for the upsert.
+    @param update: Fields to update on conflict.
+    @param on_written: Function called with the rows of the model once they are written into the database.
+
+    @return: None.
+    """
+    if not WRITE_BUFFER_ENABLED:
+        written = write_data_to_db(model, data, conflict_target, update)
+        if on_written and written:
+            on_written(written)
+        return
+    if not data:
+        return
+
+    with write_buffers_lock:
+        buffer = write_buffers.get(model)
+        if buffer is None:
+            buffer = WriteBehindBuffer(model, conflict_target, update, write_data_to_db,
+                                       max_rows=WRITE_BUFFER_SIZE, max_age=WRITE_BUFFER_FLUSH_INTERVAL,
+                                       on_written=on_written)
+            write_buffers[model] = buffer
+    buffer.add(data)
+
+
+def flush_write_buffers(log_stats: bool = True) -> None:
+    """
+    Write all rows pending in the write-behind buffers into the database, merge the staged rows, and log the buffers
+    statistics.
+
+    @param log_stats: Whether to log the statistics of the buffers.
+
+    @return: None.
+    """
+    with write_buffers_lock:
+        buffers = list(write_buffers.values())
+    for buffer in buffers:
+        buffer.flush()
+        if log_stats:
+            logger.info(str(buffer.metrics))
+    merge_staged_rows()
+    if log_stats:
+        logger.info(str(users_cache_metrics))
+
+
+def get_database_pool_stats() -> dict:
+    return database.metrics.snapshot() if isinstance(database, InstrumentedPooledPostgresqlDatabase) else {}
+
+
+def get_write_buffers_stats() -> dict:
+    with write_buffers_lock:
+        return {model.__name__: buffer.metrics.snapshot() for model, buffer in write_buffers.items()}
+
+
+def get_upsert_stats() -> dict:
+    with upsert_metrics_lock:
+        return {model.__name__: metrics.snapshot() for model, metrics in upsert_metrics.items()}
+
+
+def reset_upsert_stats() -> None:
+    with upsert_metrics_lock:
+        upsert_metrics.clear()
 
 
 def fetch_vcs_instances() -> list[VCSInstance]:
@@ -61,11 +389,19 @@ def fetch_vcs_instances() -> list[VCSInstance]:
         return list(VCSInstance.select())
 
 
-def fetch_tags(registry: ProjectRegistryRepository, instance_id: int) -> set:
+def fetch_tags(registry: ProjectRegistryRepository, instance_id: int) -> dict:
+    """
+    Build the digest index of the registry tags stored in the database.
+
+    @param registry: The project registry repository.
+    @param instance_id: The ID of the instance.
+
+    @return: Dictionary of stored tags by their path, with their image location, digest and last check time.
+    """
     with database:
         tags_in_db = {
-            image.path
-            for image in Image.select(Image.path).where(
+            image.path: {"image": image.image, "digest": image.digest, "last_time_checked": image.last_time_checked}
+            for image in Image.select(Image.path, Image.image, Image.digest, Image.last_time_checked).where(
                 Image.vcs_instance_id == instance_id,
                 Image.repo_id == registry.project_id,
                 Image.registry_id == registry.get_id()
@@ -75,6 +411,23 @@ def fetch_tags(registry: ProjectRegistryRepository, instance_id: int) -> set:
     return tags_in_db
 
 
+def fetch_contributors_states(instance_id: int) -> dict:
+    """
+    Fetch the head commits the contributors of the instance repositories were computed at.
+
+    @param instance_id: The ID of the instance.
+
+    @return: Dictionary of states by repository ID, with the head SHA and the last activity time of the repository.
+    """
+    with database:
+        return {
+            state.repo_id: {"head_sha": state.head_sha, "last_activity_at": state.last_activity_at}
+            for state in ContributorsState.select(ContributorsState.repo_id, ContributorsState.head_sha,
+                                                  ContributorsState.last_activity_at).where(
+                ContributorsState.vcs_instance_id == instance_id)
+        }
+
+
 def fetch_last_inventoried_group(instance_id: int):
     with database:
         last_inventoried_group = Group.select(Group.vcs_id).where(Group.vcs_instance_id == instance_id).order_by(
@@ -83,6 +436,11 @@ def fetch_last_inventoried_group(instance_id: int):
     return last_inventoried_group
 
 
+def fetch_groups(instance_id: int) -> list[Group]:
+    with database:
+        return list(Group.select(Group.vcs_id, Group.parent_id, Group.path).where(Group.vcs_instance_id == instance_id))
+
+
 def fetch_last_inventoried_project(instance_id: int):
     with database:
         last_inventoried_project = Repository.select(Repository.vcs_id).where(
@@ -92,6 +450,195 @@ def fetch_last_inventoried_project(instance_id: int):
     return last_inventoried_project
 
 
+def start_inventory_run(instance_id: int, mode: str, started_at: datetime) -> InventoryRun:
+    with database:
+        return InventoryRun.create(vcs_instance_id=instance_id, mode=mode, started_at=started_at)
+
+
+def finish_inventory_run(run: InventoryRun, status: str) -> None:
+    with database:
+        InventoryRun.update(finished_at=datetime.now(), status=status).where(InventoryRun.id == run.id).execute()
+
+
+def fetch_last_completed_run(instance_id: int) -> Optional[InventoryRun]:
+    with database:
+        return InventoryRun.select().where(
+            InventoryRun.vcs_instance_id == instance_id,
+            InventoryRun.status == 'completed'
+        ).order_by(-InventoryRun.started_at).limit(1).get_or_none()
+
+
+def fetch_unfinished_run(instance_id: int) -> Optional[InventoryRun]:
+    """
+    Retrieve the last inventory run of the instance if it was interrupted or failed.
+
+    @param instance_id: ID of the instance.
+
+    @return: The unfinished run, or None if the last run of the instance has finished.
+    """
+    with database:
+        run = InventoryRun.select().where(
+            InventoryRun.vcs_instance_id == instance_id
+        ).order_by(-InventoryRun.started_at).limit(1).get_or_none()
+    return run if run and run.status in ('running', 'failed') else None
+
+
+def resume_inventory_run(run: InventoryRun) -> None:
+    with database:
+        InventoryRun.update(finished_at=None, status='running').where(InventoryRun.id == run.id).execute()
+
+
+def fetch_inventory_checkpoints(run_id: int) -> dict:
+    with database:
+        return {checkpoint.stage: {'cursor': checkpoint.cursor, 'is_completed': checkpoint.is_completed}
+                for checkpoint in InventoryCheckpoint.select().where(InventoryCheckpoint.run_id == run_id)}
+
+
+def save_inventory_checkpoint(run_id: int, stage: str, cursor: Optional[int], is_completed: bool = False) -> None:
+    """
+    Store the position of a stage of an inventory run.
+
+    @param run_id: ID of the inventory run.
+    @param stage: Name of the stage.
+    @param cursor: ID the listing of the stage is resumed before.
+    @param is_completed: Whether the stage has been completed.
+
+    @return: None.
+    """
+    with database:
+        InventoryCheckpoint.insert(run_id=run_id, stage=stage, cursor=cursor, is_completed=is_completed,
+                                   updated_at=datetime.now()).on_conflict(
+            conflict_target=[InventoryCheckpoint.run_id, InventoryCheckpoint.stage],
+            preserve=[InventoryCheckpoint.cursor, InventoryCheckpoint.is_completed, InventoryCheckpoint.updated_at]
+        ).execute()
+
+
+def enqueue_inventory_tasks(run_id: int, instance_id: int, tasks: list[dict]) -> None:
+    """
+    Store the tasks of a distributed inventory run, to be claimed by inventory workers.
+
+    @param run_id: ID of the inventory run.
+    @param instance_id: ID of the instance.
+    @param tasks: Stage names and optional ID ranges (lower_bound, upper_bound) of the tasks.
+
+    @return: None.
+    """
+    now = datetime.now()
+    with database:
+        InventoryTask.insert_many([{'run_id': run_id, 'vcs_instance_id': instance_id, 'stage': task['stage'],
+                                    'lower_bound': task.get('lower_bound'), 'upper_bound': task.get('upper_bound'),
+                                    'updated_at': now} for task in tasks]).execute()
+
+
+def _claim_transaction() -> Any:
+    # SQLite has no row locks, an immediate transaction takes the write lock of the whole database instead.
+    return database.atomic('IMMEDIATE') if isinstance(database, peewee.SqliteDatabase) else database.atomic()
+
+
+def claim_inventory_task(worker_id: str, lease_seconds: int, max_attempts: int) -> Optional[InventoryTask]:
+    """
+    Lease the oldest pending task, or a task whose lease has expired, to the worker.
+
+    Concurrent workers skip the rows locked by each other (`FOR UPDATE SKIP LOCKED`), so every task is leased to a
+    single worker. Tasks whose lease has expired `max_attempts` times are marked as failed. Tasks of the
+    FINAL_INVENTORY_STAGES are not leased while other tasks of their run are pending or leased.
+
+    @param worker_id: Identifier of the worker.
+    @param lease_seconds: Duration of the lease.
+    @param max_attempts: Maximum number of times a task is leased.
+
+    @return: The leased task with its run and instance, or None if there is no task to process.
+    """
+    now = datetime.now()
+    is_expired = (InventoryTask.status == 'leased') & (InventoryTask.lease_expires_at < now)
+    other_task = InventoryTask.alias()
+    unfinished_tasks = other_task.select().where(other_task.run_id == InventoryTask.run_id,
+                                                 other_task.stage.not_in(FINAL_INVENTORY_STAGES),
+                                                 other_task.status.in_(['pending', 'leased']))
+    with database.connection_context():
+        with _claim_transaction():
+            InventoryTask.update(status='failed', leased_by=None, error='lease expired', updated_at=now).where(
+                is_expired, InventoryTask.attempts >= max_attempts).execute()
+            query = InventoryTask.select().where(
+                (InventoryTask.status == 'pending') | is_expired,
+                InventoryTask.stage.not_in(FINAL_INVENTORY_STAGES) | ~peewee.fn.EXISTS(unfinished_tasks)
+            ).order_by(InventoryTask.id).limit(1)
+            if not isinstance(database, peewee.SqliteDatabase):
+                query = query.for_update('FOR UPDATE SKIP LOCKED')
+            task = query.get_or_none()
+            if task is None:
+                return None
+            task.status = 'leased'
+            task.leased_by = worker_id
+            task.lease_expires_at = now + timedelta(seconds=lease_seconds)
+            task.attempts += 1
+            task.updated_at = now
+            task.save()
+            # the run and the instance are loaded while the connection is open
+            task.run_id, task.vcs_instance_id
+    return task
+
+
+def renew_inventory_task_lease(task: InventoryTask, worker_id: str, lease_seconds: int) -> bool:
+    """
+    @return: Whether the lease of the task is still held by the worker and has been extended.
+    """
+    now = datetime.now()
+    with database:
+        return InventoryTask.update(lease_expires_at=now + timedelta(seconds=lease_seconds), updated_at=now).where(
+            InventoryTask.id == task.id, InventoryTask.status == 'leased', InventoryTask.leased_by == worker_id
+        ).execute() > 0
+
+
+def finish_inventory_task(task: InventoryTask, worker_id: str, status: str, error: Optional[str] = None) -> None:
+    """
+    Release the task leased by the worker.
+
+    @param task: The task.
+    @param worker_id: Identifier of the worker.
+    @param status: New status of the task: 'done', 'failed', or 'pending' to retry it.
+    @param error: Error the task failed with.
+
+    @return: None.
+    """
+    with database:
+        InventoryTask.update(status=status, leased_by=None, lease_expires_at=None, error=error,
+                             updated_at=datetime.now()).where(
+            InventoryTask.id == task.id, InventoryTask.leased_by == worker_id).execute()
+
+
+def retry_inventory_tasks(run_id: int) -> None:
+    with database:
+        InventoryTask.update(status='pending', attempts=0, error=None, updated_at=datetime.now()).where(
+            InventoryTask.run_id == run_id, InventoryTask.status == 'failed').execute()
+
+
+def cancel_inventory_tasks(run_id: int) -> None:
+    with database:
+        InventoryTask.update(status='cancelled', leased_by=None, updated_at=datetime.now()).where(
+            InventoryTask.run_id == run_id, InventoryTask.status.in_(['pending', 'leased'])).execute()
+
+
+def finish_inventory_run_if_done(run_id: int) -> Optional[str]:
+    """
+    Finish the distributed inventory run if none of its tasks is pending or leased.
+
+    @param run_id: ID of the inventory run.
+
+    @return: Status the run has been finished with, or None if it is still in progress or was finished by another
+    worker.
+    """
+    with database:
+        statuses = {task.status for task in
+                    InventoryTask.select(InventoryTask.status).where(InventoryTask.run_id == run_id).distinct()}
+        if statuses & {'pending', 'leased'}:
+            return None
+        status = 'failed' if 'failed' in statuses else 'dry_run' if DRY_RUN else 'completed'
+        is_finished = InventoryRun.update(finished_at=datetime.now(), status=status).where(
+            InventoryRun.id == run_id, InventoryRun.status == 'running').execute()
+    return status if is_finished else None
+
+
 def get_scanned_repo_id(instance_id: int) -> list:
     checked_ids = []
     logger.info(f"Getting list of previously checked repositories...")
@@ -107,24 +654,78 @@ def get_inventoried_projects_with_parents(instance_id: int) -> tuple[list, dict]
     inventoried_projects_in_db = list()
     projects_parents = {}
     with database:
-        for repo in Repository.select(Repository.vcs_id, Repository.path, Repository.parents).where(
+        for repo in Repository.select(Repository.vcs_id, Repository.path, Repository.parents,
+                                      Repository.last_activity_repo, Repository.last_commit_at).where(
                 Repository.vcs_instance_id == instance_id).order_by(-Repository.vcs_id):
-            projects_parents[repo.vcs_id] = {'path': repo.path, 'parents': repo.parents}
+            projects_parents[repo.vcs_id] = {'path': repo.path, 'parents': repo.parents,
+                                             'last_activity_repo': repo.last_activity_repo,
+                                             'last_commit_at': repo.last_commit_at}
             inventoried_projects_in_db.append(repo.vcs_id)
 
     return inventoried_projects_in_db, projects_parents
 
 
+def reset_users_cache(instance_id: Optional[int] = None) -> None:
+    """
+    Forget the users written during the previous run, so they are written again at least once by the next run.
+
+    @param instance_id: ID of the instance whose users are forgotten, the users of all the instances if not given.
+
+    @return: None.
+    """
+    with users_cache_lock:
+        if instance_id is None:
+            users_caches.clear()
+        else:
+            users_caches.pop(instance_id, None)
+    if instance_id is None:
+        users_cache_metrics.reset()
+
+
 def insert_users(users_to_insert: dict) -> None:
-    insert_data_to_db(
-        User, users_to_insert,
+    """
+    Upsert users, skipping the users already written with the same data during the current run.
+
+    @param users_to_insert: Users to insert.
+
+    @return: None.
+    """
+    changed_users = {}
+    with users_cache_lock:
+        for key, user in users_to_insert.items():
+            if users_caches.get(user['vcs_instance_id'], {}).get(user['vcs_id']) != _get_user_fingerprint(user):
+                changed_users[key] = user
+    users_cache_metrics.incr("hits", len(users_to_insert) - len(changed_users))
+    users_cache_metrics.incr("writes", len(changed_users))
+
+    buffer_data_to_db(
+        User, changed_users,
         [User.vcs_instance_id, User.username],
-        {User.locked: peewee.EXCLUDED.locked, User.state: peewee.EXCLUDED.state}
+        {User.locked: peewee.EXCLUDED.locked, User.state: peewee.EXCLUDED.state},
+        on_written=_remember_users
     )
 
 
+def _get_user_fingerprint(user: dict) -> int:
+    return hash(tuple(sorted(user.items())))
+
+
+def _remember_users(users: list) -> None:
+    """
+    Record the users written into the database, so that they are not written again unchanged during the run. Users
+    staged for a bulk load are not recorded until merged, and are staged again when seen again.
+
+    @param users: Users written into the database.
+
+    @return: None.
+    """
+    with users_cache_lock:
+        for user in users:
+            users_caches.setdefault(user['vcs_instance_id'], {})[user['vcs_id']] = _get_user_fingerprint(user)
+
+
 def insert_repositories(repos_to_insert: dict) -> None:
-    insert_data_to_db(
+    buffer_data_to_db(
         Repository, repos_to_insert,
         [Repository.vcs_instance_id, Repository.vcs_id],
         {
@@ -138,25 +739,27 @@ def insert_repositories(repos_to_insert: dict) -> None:
             Repository.path: peewee.EXCLUDED.path,
             Repository.group_id: peewee.EXCLUDED.group_id,
             Repository.parents: peewee.EXCLUDED.parents,
-            Repository.is_archived: peewee.EXCLUDED.is_archived
+            Repository.is_archived: peewee.EXCLUDED.is_archived,
+            Repository.deleted_at: None
         }
     )
 
 
 def insert_registries(registries_to_insert: dict) -> None:
-    insert_data_to_db(
+    buffer_data_to_db(
         Registry, registries_to_insert,
         [Registry.vcs_instance_id, Registry.vcs_id, Registry.repo_id],
         {
             Registry.path: peewee.EXCLUDED.path,
             Registry.name: peewee.EXCLUDED.name,
-            Registry.last_time_checked: peewee.EXCLUDED.last_time_checked
+            Registry.last_time_checked: peewee.EXCLUDED.last_time_checked,
+            Registry.deleted_at: None
         }
     )
 
 
 def insert_images(images_to_insert: dict) -> None:
-    insert_data_to_db(
+    buffer_data_to_db(
         Image, images_to_insert,
         [Image.vcs_instance_id, Image.image, Image.repo_id, Image.registry_id],
         {
@@ -167,13 +770,15 @@ def insert_images(images_to_insert: dict) -> None:
             Image.digest: peewee.EXCLUDED.digest,
             Image.revision: peewee.EXCLUDED.revision,
             Image.total_size: peewee.EXCLUDED.total_size,
-            Image.last_time_checked: peewee.EXCLUDED.last_time_checked
+            Image.last_time_checked: peewee.EXCLUDED.last_time_checked,
+            Image.last_time_seen: peewee.EXCLUDED.last_time_seen,
+            Image.deleted_at: None
         }
     )
 
 
 def insert_repository_users(repository_users_to_insert: dict) -> None:
-    insert_data_to_db(
+    buffer_data_to_db(
         RepositoryUser, repository_users_to_insert,
         [RepositoryUser.vcs_instance_id, RepositoryUser.repo_id, RepositoryUser.user_id, RepositoryUser.access_level],
         {RepositoryUser.access_level: peewee.EXCLUDED.access_level}
@@ -181,7 +786,7 @@ def insert_repository_users(repository_users_to_insert: dict) -> None:
 
 
 def insert_contributors(contributors_to_insert: dict) -> None:
-    insert_data_to_db(
+    buffer_data_to_db(
         Contributor, contributors_to_insert,
         [Contributor.vcs_instance_id, Contributor.repo_id, Contributor.email],
         {
@@ -192,18 +797,212 @@ def insert_contributors(contributors_to_insert: dict) -> None:
     )
 
 
+def insert_contributors_states(states_to_insert: dict) -> None:
+    buffer_data_to_db(
+        ContributorsState, states_to_insert,
+        [ContributorsState.vcs_instance_id, ContributorsState.repo_id],
+        {
+            ContributorsState.head_sha: peewee.EXCLUDED.head_sha,
+            ContributorsState.last_activity_at: peewee.EXCLUDED.last_activity_at,
+            ContributorsState.computed_at: peewee.EXCLUDED.computed_at
+        }
+    )
+
+
+def store_repository_contributors(contributors_to_insert: dict, state: dict, increment: bool) -> None:
+    """
+    Write the contributors of a repository together with the commit they are counted up to, in one transaction, so
+    commits of a failed write are counted again by the next run instead of being lost or added twice.
+
+    @param contributors_to_insert: Contributors of the repository.
+    @param state: State of the contributors of the repository, see `ContributorsState`.
+    @param increment: Whether the counts are added to the stored counts instead of replacing them.
+
+    @return: None.
+    """
+    update = {field: field + getattr(peewee.EXCLUDED, field.name) if increment else getattr(peewee.EXCLUDED, field.name)
+              for field in (Contributor.commits, Contributor.additions, Contributor.deletions)}
+    with database:
+        for chunk in peewee.chunked(contributors_to_insert.values(), INSERT_CHUNK_SIZE):
+            Contributor.insert_many(chunk).on_conflict(
+                conflict_target=[Contributor.vcs_instance_id, Contributor.repo_id, Contributor.email],
+                update=update
+            ).execute()
+        ContributorsState.insert(state).on_conflict(
+            conflict_target=[ContributorsState.vcs_instance_id, ContributorsState.repo_id],
+            update={
+                ContributorsState.head_sha: peewee.EXCLUDED.head_sha,
+                ContributorsState.last_activity_at: peewee.EXCLUDED.last_activity_at,
+                ContributorsState.computed_at: peewee.EXCLUDED.computed_at
+            }
+        ).execute()
+
+
 def insert_groups(groups_to_insert: dict) -> None:
-    insert_data_to_db(
+    buffer_data_to_db(
         Group, groups_to_insert,
         [Group.vcs_instance_id, Group.vcs_id],
         {
             Group.path: peewee.EXCLUDED.path,
             Group.parent_id: peewee.EXCLUDED.parent_id,
-            Group.visibility: peewee.EXCLUDED.visibility
+            Group.visibility: peewee.EXCLUDED.visibility,
+            Group.last_time_checked: peewee.EXCLUDED.last_time_checked,
+            Group.deleted_at: None
         }
     )
 
 
+def touch_repositories(instance_id: int, repo_ids: list) -> None:
+    """
+    Mark the repositories as seen by the current run without rewriting them. Repositories checked less than
+    LAST_SEEN_RESOLUTION_HOURS hours ago are left as is.
+
+    @param instance_id: ID of the instance.
+    @param repo_ids: IDs of the repositories in the instance.
+
+    @return: None.
+    """
+    now = datetime.now()
+    seen_before = get_seen_before()
+    with database:
+        for chunk in peewee.chunked(repo_ids, 1000):
+            Repository.update(last_time_checked=now, deleted_at=None).where(
+                Repository.vcs_instance_id == instance_id, Repository.vcs_id.in_(chunk),
+                Repository.last_time_checked.is_null() | (Repository.last_time_checked < seen_before) |
+                Repository.deleted_at.is_null(False)).execute()
+
+
+def touch_group_repositories(instance_id: int, group_id: int) -> None:
+    """
+    Mark the stored repositories of a group as seen by the current run, when the repositories of the group could not
+    be listed because of an API error, so that they are not swept.
+
+    @param instance_id: ID of the instance.
+    @param group_id: ID of the group in the instance.
+
+    @return: None.
+    """
+    with database:
+        repo_ids = [repo.vcs_id for repo in Repository.select(Repository.vcs_id).where(
+            Repository.vcs_instance_id == instance_id, Repository.group_id == group_id)]
+    touch_repositories(instance_id, repo_ids)
+
+
+def touch_images(registry: ProjectRegistryRepository, instance_id: int, paths: list) -> None:
+    """
+    Mark the images of the registry tags as seen by the current run without rewriting them. Their `last_time_checked`
+    is kept, as their details have not been requested. Images seen less than LAST_SEEN_RESOLUTION_HOURS hours ago are
+    left as is.
+
+    @param registry: The project registry repository.
+    @param instance_id: ID of the instance.
+    @param paths: Paths of the tags.
+
+    @return: None.
+    """
+    now = datetime.now()
+    seen_before = get_seen_before()
+    with database:
+        for chunk in peewee.chunked(paths, 1000):
+            Image.update(last_time_seen=now, deleted_at=None).where(
+                Image.vcs_instance_id == instance_id,
+                Image.repo_id == registry.project_id,
+                Image.registry_id == registry.get_id(),
+                Image.path.in_(chunk),
+                Image.last_time_seen.is_null() | (Image.last_time_seen < seen_before) | Image.deleted_at.is_null(False)
+            ).execute()
+
+
+def touch_registries(instance_id: int, repo_id: int, registry_id: Optional[int] = None) -> None:
+    """
+    Mark the registries of the repository and their images as seen by the current run without rewriting them, when
+    they could not be requested because of an API error, so that they are not swept.
+
+    @param instance_id: ID of the instance.
+    @param repo_id: ID of the repository in the instance.
+    @param registry_id: ID of the registry whose images are marked, or None to mark all the registries of the
+                        repository.
+
+    @return: None.
+    """
+    now = datetime.now()
+    seen_before = get_seen_before()
+    registries = (Registry.vcs_instance_id == instance_id) & (Registry.repo_id == repo_id)
+    images = (Image.vcs_instance_id == instance_id) & (Image.repo_id == repo_id)
+    if registry_id is not None:
+        registries &= Registry.vcs_id == registry_id
+        images &= Image.registry_id == registry_id
+    with database:
+        Registry.update(last_time_checked=now, deleted_at=None).where(
+            registries, (Registry.last_time_checked < seen_before) | Registry.deleted_at.is_null(False)).execute()
+        Image.update(last_time_seen=now, deleted_at=None).where(
+            images, Image.last_time_seen.is_null() | (Image.last_time_seen < seen_before) |
+            Image.deleted_at.is_null(False)).execute()
+
+
+def _tombstone_unseen(model, instance_id: int, seen_since: datetime, now: datetime) -> int:
+    # images are marked as seen in `last_time_seen`, their `last_time_checked` is the time of their details request
+    last_seen = model.last_time_seen if model is Image else model.last_time_checked
+    alive = (model.vcs_instance_id == instance_id) & model.deleted_at.is_null()
+    unseen = alive & (last_seen.is_null() | (last_seen < seen_since))
+    alive_count = model.select().where(alive).count()
+    unseen_count = model.select().where(unseen).count()
+    if alive_count and unseen_count / alive_count > SWEEP_MAX_FRACTION:
+        logger.warning(f"{unseen_count} of {alive_count} {model.__name__} rows were not seen by the run, "
+                       f"more than SWEEP_MAX_FRACTION={SWEEP_MAX_FRACTION}, not sweeping them")
+        return 0
+    return model.update(deleted_at=now).where(unseen).execute() if unseen_count else 0
+
+
+def sweep_unseen_rows(instance_id: int, seen_since: datetime, groups: bool, repositories: bool,
+                      registries: bool) -> dict:
+    """
+    Tombstone the rows of the instance not seen by a completed run with a few set-based statements, and delete the
+    rows tombstoned more than SWEEP_DELETE_AFTER_DAYS days ago.
+
+    Registries and images of tombstoned repositories are tombstoned with them. Users, contributors and contributors
+    states of deleted repositories are deleted with them.
+
+    @param instance_id: ID of the instance.
+    @param seen_since: Start time of the run, rows checked more than LAST_SEEN_RESOLUTION_HOURS hours before it have
+                       not been seen by the run.
+    @param groups: Whether the run has seen all the groups of the instance.
+    @param repositories: Whether the run has seen all the repositories of the instance.
+    @param registries: Whether the run has seen all the registries and images of the instance.
+
+    @return: Number of tombstoned and deleted rows by model.
+    """
+    now = datetime.now()
+    seen_since -= timedelta(hours=LAST_SEEN_RESOLUTION_HOURS)
+    logger.info(f"Sweeping rows of instance {instance_id} not seen since {seen_since:%Y-%m-%d %H:%M:%S}, "
+                f"LAST_SEEN_RESOLUTION_HOURS={LAST_SEEN_RESOLUTION_HOURS} before the start of the run")
+    stats = {}
+    models = ([Group] if groups else []) + ([Repository] if repositories else []) + \
+             ([Registry, Image] if registries else [])
+    with database:
+        for model in models:
+            stats[f"{model.__name__}.tombstoned"] = _tombstone_unseen(model, instance_id, seen_since, now)
+        if repositories:
+            tombstoned_repos = Repository.select(Repository.vcs_id).where(
+                Repository.vcs_instance_id == instance_id, Repository.deleted_at.is_null(False))
+            for model in (Registry, Image):
+                stats[f"{model.__name__}.tombstoned"] = stats.get(f"{model.__name__}.tombstoned", 0) + \
+                    model.update(deleted_at=now).where(model.vcs_instance_id == instance_id,
+                                                       model.deleted_at.is_null(),
+                                                       model.repo_id.in_(tombstoned_repos)).execute()
+        if SWEEP_DELETE_AFTER_DAYS:
+            deleted_before = now - timedelta(days=SWEEP_DELETE_AFTER_DAYS)
+            deleted_repos = Repository.select(Repository.vcs_id).where(
+                Repository.vcs_instance_id == instance_id, Repository.deleted_at < deleted_before)
+            for model in (RepositoryUser, Contributor, ContributorsState):
+                stats[f"{model.__name__}.deleted"] = model.delete().where(
+                    model.vcs_instance_id == instance_id, model.repo_id.in_(deleted_repos)).execute()
+            for model in (Image, Registry, Repository, Group):
+                stats[f"{model.__name__}.deleted"] = model.delete().where(
+                    model.vcs_instance_id == instance_id, model.deleted_at < deleted_before).execute()
+    return stats
+
+
 def insert_findings(findings_to_insert: dict) -> None:
     insert_data_to_db(
         Finding, findings_to_insert,
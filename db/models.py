@@ -51,6 +51,7 @@ class Repository(BaseModel):
     last_activity_repo = peewee.DateTimeField()
     last_commit_at = peewee.DateTimeField(null=True)
     is_archived = peewee.BooleanField(default=False)
+    deleted_at = peewee.DateTimeField(null=True)
 
     class Meta:
         indexes = ((('vcs_instance_id', 'vcs_id'), True),)
@@ -63,6 +64,8 @@ class Group(BaseModel):
     parent_id = peewee.BitField(null=True)
     path = peewee.TextField(default='')
     visibility = peewee.TextField(default='')
+    last_time_checked = peewee.DateTimeField(null=True)
+    deleted_at = peewee.DateTimeField(null=True)
 
     class Meta:
         indexes = ((('vcs_instance_id', 'vcs_id'), True),)
@@ -80,6 +83,7 @@ class Registry(BaseModel):
     last_time_checked = peewee.DateTimeField()
     is_scanned = peewee.BooleanField(default=False)
     last_time_scanned = peewee.DateTimeField(null=True)
+    deleted_at = peewee.DateTimeField(null=True)
 
     class Meta:
         indexes = ((('vcs_instance_id', 'vcs_id', 'repo_id'), True),)
@@ -98,9 +102,11 @@ class Image(BaseModel):
     revision = peewee.TextField()
     total_size = peewee.BitField()
     last_time_checked = peewee.DateTimeField(null=True)
+    last_time_seen = peewee.DateTimeField(null=True)
     is_scanned = peewee.BooleanField(default=False)
     last_time_scanned = peewee.DateTimeField(null=True)
     last_scan_id = peewee.UUIDField(null=True)
+    deleted_at = peewee.DateTimeField(null=True)
 
     class Meta:
         indexes = ((('vcs_instance_id', 'image', 'repo_id', 'registry_id'), True),)
@@ -173,6 +179,64 @@ class Finding(BaseModel):
         db_table = 'findings'
 
 
+class InventoryRun(BaseModel):
+    id = peewee.PrimaryKeyField()
+    vcs_instance_id = peewee.ForeignKeyField(VCSInstance, backref='inventory_runs', on_delete='CASCADE')
+    mode = peewee.TextField(default='full')
+    started_at = peewee.DateTimeField()
+    finished_at = peewee.DateTimeField(null=True)
+    status = peewee.TextField(default='running')
+
+    class Meta:
+        indexes = ((('vcs_instance_id', 'status', 'started_at'), False),)
+        db_table = 'inventory_runs'
+
+
+class InventoryCheckpoint(BaseModel):
+    id = peewee.PrimaryKeyField()
+    run_id = peewee.ForeignKeyField(InventoryRun, backref='checkpoints', on_delete='CASCADE')
+    stage = peewee.TextField()
+    cursor = peewee.BigIntegerField(null=True)
+    is_completed = peewee.BooleanField(default=False)
+    updated_at = peewee.DateTimeField()
+
+    class Meta:
+        indexes = ((('run_id', 'stage'), True),)
+        db_table = 'inventory_checkpoints'
+
+
+class InventoryTask(BaseModel):
+    id = peewee.PrimaryKeyField()
+    run_id = peewee.ForeignKeyField(InventoryRun, backref='tasks', on_delete='CASCADE')
+    vcs_instance_id = peewee.ForeignKeyField(VCSInstance, backref='inventory_tasks', on_delete='CASCADE')
+    stage = peewee.TextField()
+    lower_bound = peewee.BigIntegerField(null=True)
+    upper_bound = peewee.BigIntegerField(null=True)
+    status = peewee.TextField(default='pending')
+    attempts = peewee.IntegerField(default=0)
+    leased_by = peewee.TextField(null=True)
+    lease_expires_at = peewee.DateTimeField(null=True)
+    error = peewee.TextField(null=True)
+    updated_at = peewee.DateTimeField()
+
+    class Meta:
+        indexes = ((('run_id', 'stage'), True), (('status', 'lease_expires_at'), False))
+        db_table = 'inventory_tasks'
+
+
+class ContributorsState(BaseModel):
+    id = peewee.PrimaryKeyField()
+    vcs_instance_id = peewee.ForeignKeyField(VCSInstance, backref='contributors_states', on_delete='CASCADE')
+    repo_id = peewee.BitField()
+    head_sha = peewee.TextField()
+    last_activity_at = peewee.DateTimeField(null=True)
+    computed_at = peewee.DateTimeField()
+
+    class Meta:
+        indexes = ((('vcs_instance_id', 'repo_id'), True),)
+        db_table = 'contributors_states'
+
+
 @dataclass
 class ScanRepo:
     vcs_id: int
@@ -0,0 +1,39 @@
+import threading
+from time import monotonic
+
+from playhouse.pool import PooledPostgresqlDatabase, MaxConnectionsExceeded
+
+from utils.metrics import Metrics
+
+
+class InstrumentedPooledPostgresqlDatabase(PooledPostgresqlDatabase):
+    """
+    Pooled PostgreSQL database counting connection checkouts and the time threads spent waiting for a free
+    connection, so pool contention can be observed and the pool sized accordingly.
+    """
+
+    def __init__(self, database, **kwargs):
+        self.metrics = Metrics("db_pool")
+        self._waiting = threading.local()
+        super().__init__(database, **kwargs)
+
+    def connect(self, reuse_if_open=False):
+        self._waiting.flag = False
+        started = monotonic()
+        result = super().connect(reuse_if_open)
+        self.metrics.incr("checkouts")
+        if self._waiting.flag:
+            waited = monotonic() - started
+            self.metrics.incr("waits")
+            self.metrics.incr("wait_seconds", waited)
+            self.metrics.set_max("max_wait_seconds", waited)
+        return result
+
+    def _connect(self):
+        try:
+            conn = super()._connect()
+        except MaxConnectionsExceeded:
+            self._waiting.flag = True
+            raise
+        self.metrics.set_max("max_in_use", len(self._in_use))
+        return conn
@@ -0,0 +1,189 @@
+import io
+import itertools
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional
+from uuid import uuid4
+
+import peewee
+
+from settings.logger import logger
+
+
+class StagingLoader:
+    """
+    Bulk loader of PostgreSQL tables: rows are streamed with COPY into unlogged staging tables, then merged into their
+    target tables with a single upsert by model.
+
+    Staging tables are shared by all the processes writing into the database, the rows of each loader are kept apart
+    by its ID, and the rows left by loaders which died before merging them are dropped after `max_age_hours` hours.
+    A bulk load is active for the VCS instances it was begun for only, the rows of other instances are not staged.
+    """
+
+    def __init__(self, db: peewee.Database, max_age_hours: float):
+        self.db = db
+        self.loader_id = uuid4().hex
+        self.max_age_hours = max_age_hours
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._merge_lock = threading.Lock()
+        self._tables = {}
+        self._staged = {}
+        self._runs = Counter()
+
+    def begin(self, instance_id: int) -> None:
+        with self._lock:
+            self._runs[instance_id] += 1
+
+    def end(self, instance_id: int) -> None:
+        with self._lock:
+            self._runs[instance_id] -= 1
+            if self._runs[instance_id] <= 0:
+                del self._runs[instance_id]
+
+    def is_active(self, instance_id: int) -> bool:
+        with self._lock:
+            return self._runs[instance_id] > 0
+
+    def active_instances(self) -> set:
+        with self._lock:
+            return set(self._runs)
+
+    def staged_models(self) -> list:
+        with self._lock:
+            return list(self._staged)
+
+    @staticmethod
+    def _get_fields(model: type[peewee.Model]) -> list:
+        return [field for field in model._meta.sorted_fields if not isinstance(field, peewee.AutoField)]
+
+    @staticmethod
+    def _entity(*parts: Optional[str]) -> str:
+        return ".".join('"' + part.replace('"', '""') + '"' for part in parts if part)
+
+    def _get_table(self, model: type[peewee.Model]) -> str:
+        """
+        Create the staging table of the model on the first use by the loader, and add to it the columns of the model
+        it misses.
+
+        @param model: Model of the target table.
+
+        @return: Name of the staging table.
+        """
+        with self._lock:
+            table = self._tables.get(model)
+        if table:
+            return table
+
+        schema = model._meta.schema
+        name = f"{model._meta.table_name}_staging"
+        table = self._entity(schema, name)
+        columns = ", ".join(self._entity(field.column_name) for field in self._get_fields(model))
+        with self.db.atomic():
+            self.db.execute_sql("SELECT pg_advisory_xact_lock(hashtext(%s))", (table,))
+            self.db.execute_sql(
+                f"CREATE UNLOGGED TABLE IF NOT EXISTS {table} AS SELECT {columns}, NULL::text AS \"_loader\", "
+                f"NULL::bigint AS \"_seq\", NULL::timestamp AS \"_loaded_at\" "
+                f"FROM {self._entity(schema, model._meta.table_name)} WITH NO DATA")
+            existing = {column.name for column in self.db.get_columns(name, schema)}
+            for field in self._get_fields(model):
+                if field.column_name not in existing:
+                    logger.info(f"Adding column '{field.column_name}' to table '{name}'...")
+                    self.db.execute_sql(f"ALTER TABLE {table} ADD COLUMN {self._entity(field.column_name)} "
+                                        f"{field.ddl_datatype(self.db.get_sql_context()).sql}")
+            self.db.execute_sql(f"DELETE FROM {table} WHERE \"_loaded_at\" < %s",
+                                (datetime.now() - timedelta(hours=self.max_age_hours),))
+        with self._lock:
+            self._tables[model] = table
+        return table
+
+    @staticmethod
+    def _encode(value: Any) -> str:
+        if value is None:
+            return "\\N"
+        if isinstance(value, bool):
+            value = "t" if value else "f"
+        elif isinstance(value, (list, tuple)):
+            value = "{" + ",".join(
+                "NULL" if item is None else '"' + str(item).replace("\\", "\\\\").replace('"', '\\"') + '"'
+                for item in value) + "}"
+        elif isinstance(value, datetime):
+            value = value.isoformat()
+        return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+    def copy(self, model: type[peewee.Model], data: dict, conflict_target: list, update: dict) -> int:
+        """
+        Stream rows into the staging table of the model.
+
+        @param model: Model to insert rows into.
+        @param data: Rows to insert, in the same format as accepted by `insert_data_to_db`.
+        @param conflict_target: Fields of the unique index used by the merge.
+        @param update: Fields to update on conflict by the merge.
+
+        @return: Number of staged rows.
+        """
+        table = self._get_table(model)
+        fields = self._get_fields(model)
+        loaded_at = datetime.now()
+        buffer = io.StringIO()
+        for row in data.values():
+            values = []
+            for field in fields:
+                if field.name in row:
+                    value = row[field.name]
+                else:
+                    value = field.default() if callable(field.default) else field.default
+                values.append(self._encode(field.db_value(value)))
+            values += [self.loader_id, str(next(self._seq)), loaded_at.isoformat()]
+            buffer.write("\t".join(values) + "\n")
+        buffer.seek(0)
+
+        columns = ", ".join(self._entity(field.column_name) for field in fields)
+        with self.db.atomic():
+            self.db.cursor().copy_expert(
+                f"COPY {table} ({columns}, \"_loader\", \"_seq\", \"_loaded_at\") FROM STDIN", buffer)
+        with self._lock:
+            self._staged[model] = (conflict_target, update)
+        return len(data)
+
+    def merge(self, model: type[peewee.Model],
+              get_where: Optional[Callable[[dict], Optional[peewee.Expression]]] = None) -> tuple[int, int, int]:
+        """
+        Move the rows staged by the loader into the target table of the model with a single upsert, the latest staged
+        row of each key wins.
+
+        @param model: Model of the target table.
+        @param get_where: Function returning the condition of the update of the existing rows on conflict, given the
+                          fields to update.
+
+        @return: Number of the merged rows, of the inserted rows and of the written (inserted or updated) rows.
+        """
+        with self._merge_lock:
+            with self._lock:
+                if model not in self._staged:
+                    return 0, 0, 0
+                conflict_target, update = self._staged.pop(model)
+            try:
+                table = self._get_table(model)
+                fields = self._get_fields(model)
+                columns = ", ".join(self._entity(field.column_name) for field in fields)
+                keys = ", ".join(self._entity(field.column_name) for field in conflict_target)
+                upsert = model.insert_from(peewee.SQL('SELECT * FROM "rows"'), fields).on_conflict(
+                    conflict_target=conflict_target, update=update,
+                    where=get_where(update) if get_where else None).returning(peewee.SQL("xmax = 0 AS inserted"))
+                upsert_sql, upsert_params = self.db.get_sql_context().sql(upsert).query()
+                with self.db.atomic():
+                    cursor = self.db.execute_sql(
+                        f"WITH \"moved\" AS (DELETE FROM {table} WHERE \"_loader\" = %s RETURNING *), "
+                        f"\"rows\" AS (SELECT DISTINCT ON ({keys}) {columns} FROM \"moved\" "
+                        f"ORDER BY {keys}, \"_seq\" DESC), "
+                        f"\"merged\" AS ({upsert_sql}) "
+                        f"SELECT (SELECT count(*) FROM \"rows\"), count(*) FILTER (WHERE inserted), count(*) "
+                        f"FROM \"merged\"",
+                        [self.loader_id] + upsert_params)
+                    return cursor.fetchone()
+            except Exception:
+                with self._lock:
+                    self._staged.setdefault(model, (conflict_target, update))
+                raise
@@ -0,0 +1,83 @@
+import threading
+from time import monotonic
+from typing import Callable, Optional
+
+import peewee
+
+from settings.logger import logger
+from utils.metrics import Metrics
+
+
+class WriteBehindBuffer:
+    """
+    Thread-safe write-behind buffer of a single model.
+
+    Rows are accumulated in memory (deduplicated by the conflict target, the latest row wins) and written with
+    a single multi-row upsert once the buffer holds `max_rows` rows or its oldest row is older than `max_age` seconds.
+    The writer returns the rows actually written, which are passed to `on_written`, if any.
+    """
+
+    def __init__(self, model: type[peewee.Model], conflict_target: list, update: dict, writer: Callable,
+                 max_rows: int, max_age: float, on_written: Optional[Callable[[list], None]] = None):
+        self.model = model
+        self.conflict_target = conflict_target
+        self.update = update
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.metrics = Metrics(f"write_buffer.{model.__name__}")
+        self._writer = writer
+        self._on_written = on_written
+        self._rows = {}
+        self._first_row_at = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def _row_key(self, row: dict) -> tuple:
+        return tuple(row.get(field.name) for field in self.conflict_target)
+
+    def add(self, data: dict) -> None:
+        """
+        Add rows to the buffer, flushing it if the row count or age limit is reached.
+
+        @param data: Rows to write, in the same format as accepted by `insert_data_to_db`.
+
+        @return: None.
+        """
+        with self._lock:
+            for row in data.values():
+                self._rows[self._row_key(row)] = row
+            if self._first_row_at is None:
+                self._first_row_at = monotonic()
+            should_flush = len(self._rows) >= self.max_rows or monotonic() - self._first_row_at >= self.max_age
+
+        if should_flush:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write all buffered rows into the database.
+
+        @return: None.
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, {}
+                self._first_row_at = None
+            if not rows:
+                return
+
+            started = monotonic()
+            written = self._writer(self.model, rows, self.conflict_target, self.update)
+            elapsed = monotonic() - started
+            if self._on_written and written:
+                self._on_written(written)
+
+            self.metrics.incr("rows", len(rows))
+            self.metrics.incr("batches")
+            self.metrics.incr("flush_seconds", elapsed)
+            self.metrics.set_max("max_flush_seconds", elapsed)
+            logger.debug(f"Flushed {len(rows)} {self.model.__name__} rows in {elapsed:.3f}s")
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._rows)
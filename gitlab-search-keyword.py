@@ -1,16 +1,15 @@
 import argparse
-import requests
 import os
 import urllib.parse
 
 from peewee import SQL
-from time import sleep
 
 
+from settings.config import SESSION
 from settings.logger import logger
 from settings.yaml_parser import process_yaml
 from db.models import VSC, VCSInstance, Repository
-from db.db_utils import initialize_database
+from db.db_utils import initialize_database, database
 
 
 def search(vsc: VSC, args: argparse.Namespace) -> None:
@@ -25,7 +24,9 @@ def search(vsc: VSC, args: argparse.Namespace) -> None:
         logger.info(f"# Filter set to {args.filter}")
         repos = repos.where(SQL(args.filter.strip("\"")))
 
-    repos_count = repos.count()
+    with database:
+        repos_count = repos.count()
+        repos = list(repos)
     logger.info(f"# {repos_count} repositories match in '{vcs.url}'. Searching '{keyword}' in them...")
     counter = 0
     for repo in repos:
@@ -33,14 +34,14 @@ def search(vsc: VSC, args: argparse.Namespace) -> None:
         logger.info(f"[{counter}/{repos_count}] # Searching '{keyword}' in '{vcs.url}/{repo.path}' (id:{repo.vcs_id})")
         try:
             while True:
-                response = requests.get(f"{vcs.url}/api/v4/projects/{repo.vcs_id}/search?scope=blobs&search={keyword}",
+                response = SESSION.get(f"{vcs.url}/api/v4/projects/{repo.vcs_id}/search?scope=blobs&search={keyword}",
                                         headers={'PRIVATE-TOKEN': vcs.token},
                                         timeout=40)
                 if not response.ok:
                     logger.info(f"Got bad response while initing: {response}")
                     if response.status_code == 429:
+                        # the shared rate limiter of the session waits for Retry-After before the next request
                         logger.info("Got 429, retrying...")
-                        sleep(1)
                         continue
                     response = []
                     break
@@ -1,12 +1,21 @@
 #!/bin/python3
 
-from datetime import datetime
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from time import sleep
+from typing import Optional
 
 import schedule
 
-from db.db_utils import fetch_vcs_instances, initialize_database
-from db.models import VCSInstance, Repository, Group, Registry, Image, User, Contributor, RepositoryUser, Repository, database_proxy
+from db.db_utils import fetch_vcs_instances, initialize_database, get_database_pool_stats, reset_users_cache, \
+    get_upsert_stats, reset_upsert_stats, fetch_unfinished_run, start_inventory_run, finish_inventory_run, \
+    resume_inventory_run, enqueue_inventory_tasks, claim_inventory_task, renew_inventory_task_lease, \
+    finish_inventory_task, retry_inventory_tasks, cancel_inventory_tasks, finish_inventory_run_if_done
+from db.models import VCSInstance, Repository, Group, Registry, Image, User, Contributor, RepositoryUser, Repository, database_proxy, \
+    InventoryRun, InventoryCheckpoint, InventoryTask, ContributorsState
 from parsers.gitlab_parser import GitLabParser
 from parsers.bitbucket_parser import BitbucketParser
 from settings.config import *
@@ -15,37 +24,83 @@ from settings.logger import logger
 from utils.exceptions import CantInitParserObject
 
 
-def process_vcs_instance(instance: VCSInstance) -> None:
+def create_parser(instance: VCSInstance) -> Optional[GitLabParser | BitbucketParser]:
+    settings = vcs_instances[instance.mnemonic]
+    workers_count = settings.get('WORKERS_COUNT', PROJECT_WORKERS_COUNT)
+    max_rate = settings.get('RATE_LIMIT_MAX_RPS', RATE_LIMIT_MAX_RPS)
+    if instance.type == "gitlab":
+        return GitLabParser(vcs_instance=instance,
+                            token=settings['PAT'],
+                            engine=settings.get('ENGINE', 'threaded'),
+                            workers_count=workers_count,
+                            max_rate=max_rate)
+    elif instance.type == "bitbucket":
+        return BitbucketParser(vcs_instance=instance,
+                               username=settings['USERNAME'],
+                               password=settings['PAT'],
+                               workers_count=workers_count,
+                               max_rate=max_rate)
+    return None
+
+
+def process_vcs_instance(instance: VCSInstance) -> str:
+    """
+    Run the full inventory of a VCS instance.
+
+    @param instance: The VCS instance to process.
+
+    @return: Status of the processing, 'completed', 'failed' or 'skipped'.
+    """
     try:
-        if instance.type == "gitlab":
-            parser = GitLabParser(vcs_instance=instance,
-                                  token=vcs_instances[instance.mnemonic]['PAT'])
-        elif instance.type == "bitbucket":
-            parser = BitbucketParser(vcs_instance=instance,
-                                     username=vcs_instances[instance.mnemonic]['USERNAME'],
-                                     password=vcs_instances[instance.mnemonic]['PAT'])
-        else:
+        parser = create_parser(instance)
+        if parser is None:
             logger.critical(f"Unsupported instance type: '{instance.type}'!")
-            return
+            return 'skipped'
         logger.info(f"Start processing {instance.type} instance '{instance.url}'...")
         parser.process_instance()
+        return 'completed'
     except CantInitParserObject as e:
         logger.error(
             f"Error on connecting to {instance.type} instance '{instance.url}': {e} {type(e).__name__} {__file__} {e.__traceback__.tb_lineno}")
+    except Exception as e:
+        logger.error(
+            f"Error on processing {instance.type} instance '{instance.url}': {e} {type(e).__name__} {__file__} {e.__traceback__.tb_lineno}")
+    return 'failed'
+
+
+def process_vcs_instance_timed(instance: VCSInstance) -> tuple[str, timedelta]:
+    start_time = datetime.now()
+    status = process_vcs_instance(instance)
+    return status, datetime.now() - start_time
 
 
 def inventory() -> None:
     if inventory_lock.acquire(blocking=False):
         try:
             logger.info(f"Starting an inventory at {datetime.now()}")
+            reset_users_cache()
+            reset_upsert_stats()
             instances = fetch_vcs_instances()
 
-            for instance in instances:
-                if instance.mnemonic not in vcs_instances:
-                    logger.critical(f"No '{instance.mnemonic}' in '{SETTINGS_FILE}'! Skipping it...")
-                    continue
-                process_vcs_instance(instance)
+            results = {}
+            with ThreadPoolExecutor(max_workers=INSTANCE_WORKERS_COUNT) as executor:
+                for instance in instances:
+                    if instance.mnemonic not in vcs_instances:
+                        logger.critical(f"No '{instance.mnemonic}' in '{SETTINGS_FILE}'! Skipping it...")
+                        continue
+                    results[instance] = executor.submit(process_vcs_instance_timed, instance)
 
+            logger.info(f"Inventory of {len(results)} instances finished, {INSTANCE_WORKERS_COUNT} processed at a time:")
+            for instance, result in results.items():
+                status, duration = result.result()
+                logger.info(f"- '{instance.mnemonic}' ({instance.type}, {instance.url}): {status} in {duration}")
+
+            pool_stats = get_database_pool_stats()
+            if pool_stats:
+                logger.info(f"Database pool stats: {pool_stats}")
+            upsert_stats = get_upsert_stats()
+            if upsert_stats:
+                logger.info(f"Upsert stats: {upsert_stats}")
         finally:
             inventory_lock.release()
     else:
@@ -60,13 +115,12 @@ def fast_inventory() -> None:
                 instances = fetch_vcs_instances()
 
                 for instance in instances:
-                    if instance.type == 'gitlab':
-                        logger.info(f"Start processing ({instance.url})...")
-                        instance_processor = GitLabParser(vcs_instance=instance,
-                                                          token=vcs_instances[instance.mnemonic]['PAT'])
-
-                        instance_processor.process_new_projects(instance.id)
-                        instance_processor.process_new_groups(instance.id)
+                    if instance.type not in ('gitlab', 'bitbucket'):
+                        continue
+                    logger.info(f"Start processing ({instance.url})...")
+                    instance_processor = create_parser(instance)
+                    instance_processor.process_new_groups(instance.id)
+                    instance_processor.process_new_projects(instance.id)
 
             except Exception as e:
                 logger.error(f"{e} {type(e).__name__} {__file__} {e.__traceback__.tb_lineno}")
@@ -76,21 +130,188 @@ def fast_inventory() -> None:
         logger.warning("Fast inventory is already running, skipping this execution.")
 
 
-def schedule_inventory() -> None:
+def has_interrupted_runs() -> bool:
+    """
+    @return: Whether an inventory run of any instance was interrupted recently and can be resumed.
+    """
+    resumable_after = datetime.now() - timedelta(hours=RESUME_MAX_AGE_HOURS)
+    for instance in fetch_vcs_instances():
+        run = fetch_unfinished_run(instance.id)
+        if run and run.started_at >= resumable_after:
+            return True
+    return False
+
+
+def plan_vcs_instance(instance: VCSInstance) -> None:
+    """
+    Start a distributed inventory run of a VCS instance and queue its tasks for the inventory workers.
+
+    A failed run started less than RESUME_MAX_AGE_HOURS ago is resumed by retrying its failed tasks, and a run still
+    in progress is left to the workers.
+
+    @param instance: The VCS instance to process.
+
+    @return: None.
+    """
+    run = fetch_unfinished_run(instance.id)
+    if run and run.started_at >= datetime.now() - timedelta(hours=RESUME_MAX_AGE_HOURS):
+        if run.status == 'running':
+            logger.warning(f"Inventory run of '{instance.url}' started at {run.started_at} is still in progress, "
+                           f"skipping...")
+            return
+        logger.info(f"Retrying failed tasks of the inventory run of '{instance.url}' started at {run.started_at}...")
+        resume_inventory_run(run)
+        retry_inventory_tasks(run.id)
+        return
+    if run:
+        cancel_inventory_tasks(run.id)
+        finish_inventory_run(run, 'abandoned')
+
+    parser = create_parser(instance)
+    if parser is None:
+        logger.critical(f"Unsupported instance type: '{instance.type}'!")
+        return
+    mode, tasks = parser.plan_tasks()
+    run = start_inventory_run(instance.id, mode, datetime.now())
+    enqueue_inventory_tasks(run.id, instance.id, tasks)
+    logger.info(f"Queued {len(tasks)} tasks of the {mode} inventory of '{instance.url}'")
+
+
+def plan_inventory() -> None:
+    logger.info(f"Planning a distributed inventory at {datetime.now()}")
+    for instance in fetch_vcs_instances():
+        if instance.mnemonic not in vcs_instances:
+            logger.critical(f"No '{instance.mnemonic}' in '{SETTINGS_FILE}'! Skipping it...")
+            continue
+        try:
+            plan_vcs_instance(instance)
+        except Exception as e:
+            logger.error(f"Error on planning inventory of {instance.type} instance '{instance.url}': {e} "
+                         f"{type(e).__name__} {__file__} {e.__traceback__.tb_lineno}")
+
+
+def keep_task_lease(task: InventoryTask, worker_id: str, stop: threading.Event) -> None:
+    while not stop.wait(TASK_LEASE_SECONDS / 3):
+        try:
+            if not renew_inventory_task_lease(task, worker_id, TASK_LEASE_SECONDS):
+                logger.warning(f"Lease of task '{task.stage}' of run {task.run_id.id} has been lost")
+                return
+        except Exception as e:
+            logger.error(f"Error on renewing lease of task '{task.stage}' of run {task.run_id.id}: {e}")
+
+
+def get_task_parser(instance: VCSInstance, run: InventoryRun, parsers: dict) -> GitLabParser | BitbucketParser:
+    """
+    Retrieve the parser processing the tasks of the run, so caches are shared by the tasks of the same run only.
+
+    @param instance: The VCS instance of the run.
+    @param run: The inventory run.
+    @param parsers: Parsers created by the worker, by instance and run IDs.
+
+    @return: The parser.
+    """
+    key = (instance.id, run.id)
+    if key not in parsers:
+        for stale_key in [stale_key for stale_key in parsers if stale_key[0] == instance.id]:
+            del parsers[stale_key]
+        reset_users_cache(instance.id)
+        parser = create_parser(instance)
+        if parser is None:
+            raise CantInitParserObject(f"Unsupported instance type: '{instance.type}'")
+        parsers[key] = parser
+    return parsers[key]
+
+
+def process_inventory_task(task: InventoryTask, worker_id: str, parsers: dict) -> None:
+    """
+    Process a leased task, keeping its lease alive, and finish the run of the task once all its tasks are done.
+
+    @param task: The leased task.
+    @param worker_id: Identifier of the worker.
+    @param parsers: Parsers created by the worker, by instance and run IDs.
+
+    @return: None.
+    """
+    instance, run = task.vcs_instance_id, task.run_id
+    logger.info(f"Processing task '{task.stage}' of '{instance.url}' (attempt {task.attempts})...")
+    start_time = datetime.now()
+    stop = threading.Event()
+    lease_keeper = threading.Thread(target=keep_task_lease, args=(task, worker_id, stop), daemon=True)
+    lease_keeper.start()
+    try:
+        get_task_parser(instance, run, parsers).process_task(run, task.stage, task.lower_bound, task.upper_bound)
+        status, error = 'done', None
+    except Exception as e:
+        status, error = 'failed' if task.attempts >= TASK_MAX_ATTEMPTS else 'pending', f"{type(e).__name__}: {e}"
+        logger.error(f"Error on processing task '{task.stage}' of '{instance.url}': {e} {type(e).__name__} "
+                     f"{__file__} {e.__traceback__.tb_lineno}")
+    finally:
+        stop.set()
+        lease_keeper.join()
+    finish_inventory_task(task, worker_id, status, error)
+    logger.info(f"Task '{task.stage}' of '{instance.url}': {status} in {datetime.now() - start_time}")
+
+    run_status = finish_inventory_run_if_done(run.id)
+    if run_status:
+        logger.info(f"Inventory run of '{instance.url}' started at {run.started_at}: {run_status}")
+    if run_status == 'completed':
+        get_task_parser(instance, run, parsers).sweep_unseen(run)
+
+
+def run_inventory_worker() -> None:
+    """
+    Claim and process the tasks of distributed inventory runs until the process is stopped.
+
+    @return: None.
+    """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    logger.info(f"Inventory worker '{worker_id}' started, polling for tasks every {WORKER_POLL_INTERVAL} seconds...")
+    parsers = {}
+    while True:
+        try:
+            task = claim_inventory_task(worker_id, TASK_LEASE_SECONDS, TASK_MAX_ATTEMPTS)
+        except Exception as e:
+            logger.error(f"Error on claiming inventory task: {e}")
+            task = None
+        if task is None:
+            sleep(WORKER_POLL_INTERVAL)
+            continue
+        try:
+            process_inventory_task(task, worker_id, parsers)
+        except Exception as e:
+            logger.error(f"Error on finishing inventory task '{task.stage}': {e}")
+
+
+def schedule_inventory(job=inventory) -> None:
     logger.info(f"Next launch scheduled at {START_TIME}. Now chilling...")
     logger.info(f"Fast inventory interval: {FAST_INVENTORY_INTERVAL=} minutes.")
-    schedule.every().day.at(START_TIME).do(inventory)
+    schedule.every().day.at(START_TIME).do(job)
     schedule.every(FAST_INVENTORY_INTERVAL).minutes.do(fast_inventory)
 
 
 if __name__ == '__main__':
     logger.info("Starting inventory...")
     vcs_instances = process_yaml()
-    initialize_database([Repository, Group, Registry, Image, User, Contributor, RepositoryUser, VCSInstance], vcs_instances=vcs_instances)
+    initialize_database([Repository, Group, Registry, Image, User, Contributor, RepositoryUser, VCSInstance, InventoryRun,
+                         InventoryCheckpoint, InventoryTask, ContributorsState],
+                        vcs_instances=vcs_instances)
 
-    if DRY_RUN:
+    if INVENTORY_ROLE == 'worker':
+        run_inventory_worker()
+    elif INVENTORY_ROLE == 'coordinator':
+        threading.Thread(target=run_inventory_worker, name="InventoryWorker-0_0", daemon=True).start()
+        if DRY_RUN:
+            plan_inventory()
+        schedule_inventory(plan_inventory)
+        while True:
+            schedule.run_pending()
+            sleep(10)
+    elif DRY_RUN:
         inventory()
     else:
+        if RESUME_INVENTORY and has_interrupted_runs():
+            logger.info("Found interrupted inventory, resuming it now...")
+            inventory()
         schedule_inventory()
         while True:
             schedule.run_pending()
@@ -1,5 +1,6 @@
 import sys
-from concurrent.futures import ThreadPoolExecutor
+import threading
+from time import monotonic
 from typing import Optional
 
 from atlassian import Bitbucket
@@ -7,17 +8,32 @@ from datetime import datetime
 from requests.exceptions import HTTPError
 from settings.logger import logger
 from settings.config import DRY_RUN, PROCESS_PROJECTS, PROCESS_GROUPS, PROCESS_USERS, PROJECT_WORKERS_COUNT, \
-    GROUP_WORKERS_COUNT
+    CONTRIBUTORS_FULL_REBUILD, FAST_INVENTORY_MAX_PROJECTS, BITBUCKET_FAST_INVENTORY_INTERVAL, RATE_LIMIT_MAX_RPS, \
+    SWEEP_UNSEEN, create_session
+from utils.memo import Memo
+from utils.pipeline import FairScheduler
 from utils.utils import get_thread_num
-from db.db_utils import insert_repositories, insert_groups, insert_contributors, insert_repository_users
+from db.db_utils import insert_repositories, insert_groups, insert_repository_users, insert_users, \
+    flush_write_buffers, fetch_contributors_states, store_repository_contributors, fetch_groups, \
+    get_inventoried_projects_with_parents, fetch_unfinished_run, start_inventory_run, finish_inventory_run, \
+    sweep_unseen_rows, touch_repositories, touch_group_repositories, bulk_load
 
-from db.models import VCSInstance, User
+from db.models import VCSInstance, InventoryRun
+
+# monotonic time of the last fast inventory listing by instance ID and listing, parsers are created per run
+last_crawls = {}
+last_crawls_lock = threading.Lock()
 
 
 class BitbucketParser:
-    def __init__(self, vcs_instance: VCSInstance, username: str, password: str):
+    def __init__(self, vcs_instance: VCSInstance, username: str, password: str,
+                 workers_count: int = PROJECT_WORKERS_COUNT, max_rate: float = RATE_LIMIT_MAX_RPS):
         self.instance = vcs_instance
-        self._conn = Bitbucket(url=self.instance.url, username=username, password=password)
+        self.workers_count = workers_count
+        self._conn = Bitbucket(url=self.instance.url, username=username, password=password,
+                               session=create_session(max_rate, workers_count))
+        self._repos = Memo()
+        self._contributors_states = {}
 
     @staticmethod
     def create_group_dict(group: dict, vcs_instance_id: int) -> dict:
@@ -26,15 +42,20 @@ class BitbucketParser:
             "vcs_id": group['id'],
             "parent_id": None,
             "path": group['links']['self'][0]['href'],
-            "visibility": "public" if group['public'] else "private"
+            "visibility": "public" if group['public'] else "private",
+            "last_time_checked": datetime.now()
         }
 
+    @staticmethod
+    def get_repo_path(repo: dict, instance: VCSInstance) -> str:
+        return repo['links']['self'][0]['href'].replace(instance.url + '/', '')
+
     @staticmethod
     def create_repo_dict(repo: dict, instance: VCSInstance, last_activity: datetime, default_branch: Optional[str]) -> dict:
         return {
             "vcs_instance_id": instance.id,
             "vcs_id": repo['id'],
-            "path": repo['links']['self'][0]['href'].replace(instance.url + '/', ''),
+            "path": BitbucketParser.get_repo_path(repo, instance),
             "group_id": repo['project']['id'],
             "parents": None,
             "web_url": repo['links']['self'][0]['href'],
@@ -60,9 +81,56 @@ class BitbucketParser:
             "access_level": permission
         }
 
+    @staticmethod
+    def create_vcs_user_dict(user: dict, vcs_instance_id: int) -> dict:
+        return {
+            "vcs_instance_id": vcs_instance_id,
+            "vcs_id": user['id'],
+            "name": user['displayName'],
+            "username": user['name'],
+            "state": "active" if user['active'] else "blocked",
+            "locked": False if user['active'] else True,
+            "web_url": user['links']['self'][0]['href']
+        }
+
     def _get_projects(self):
         return self._conn.project_list()
 
+    @staticmethod
+    def _compact_repo(repo: dict) -> dict:
+        return {
+            "id": repo['id'],
+            "slug": repo['slug'],
+            "public": repo['public'],
+            "project": {"id": repo['project']['id']},
+            "links": {"self": repo['links']['self'][:1], "clone": repo['links']['clone'][:1]}
+        }
+
+    def _get_repos(self, project_key: str) -> list[dict]:
+        """
+        Lists the repositories of a project once per run, later calls are served from the in-memory index.
+
+        @param project_key: The key of the project.
+
+        @return: List of the repositories of the project, with only the fields used by the parser.
+        """
+        return self._repos.get(project_key, lambda: [self._compact_repo(repo) for repo in
+                                                     self._conn.repo_list(project_key, limit=1000)])
+
+    def _list_all_repos(self):
+        """
+        Lists all repositories of the instance visible to the user, without going through the projects.
+
+        @return: A generator of repositories.
+        """
+        params = {"limit": 1000}
+        while True:
+            page = self._conn.get(self._conn.resource_url("repos"), params=params)
+            yield from page.get('values', [])
+            if page.get('isLastPage', True) or page.get('nextPageStart') is None:
+                return
+            params["start"] = page['nextPageStart']
+
     def _get_groups(self):
         return self._conn.get_groups()
 
@@ -88,29 +156,26 @@ class BitbucketParser:
         except Exception as err:
             logger.error(
                 f"- [T{get_thread_num()}] An unexpected error occurred while processing project '{repo_name}': {err.__class__.__name__} {str(err)}")
+            touch_repositories(self.instance.id, [repo['id']])
             return
 
-    def _process_project(self, project: dict) -> None:
+    def _process_project(self, scheduler: FairScheduler, project: dict) -> None:
         try:
             project_key = project['key']
             logger.info(f"- [T{get_thread_num()}] Processing project '{project_key}' (id={project['id']})")
-            repos = self._conn.repo_list(project_key)
+            repos = self._get_repos(project_key)
             dry_count = 0
-            with ThreadPoolExecutor(max_workers=PROJECT_WORKERS_COUNT) as queue:
-                for repo in repos:
-                    dry_count += 1
-                    queue.submit(self._process_repository, project_key, repo)
+            for repo in repos:
+                dry_count += 1
+                scheduler.submit(project_key, self._process_repository, project_key, repo)
 
-                    if DRY_RUN and dry_count > 100:
-                        break
-                queue.shutdown(wait=True, cancel_futures=False)
-        except HTTPError as err:
-            print(str(err))
-            exit(-1)
+                if DRY_RUN and dry_count > 100:
+                    break
         except Exception as err:
             logger.error(
                 f"- [T{get_thread_num()}] An unexpected error occurred while processing project '{project_key}' (id={project['id']}): {err.__class__.__name__} {str(err)}")
-            exit(-1)
+            # the repositories of the project could not be listed, they must not be swept as unseen
+            touch_group_repositories(self.instance.id, project['id'])
 
     def _process_group(self, project: dict) -> None:
         logger.debug(f"- [T{get_thread_num()}]: Trying group with id {id}/{project['id']}...")
@@ -127,22 +192,18 @@ class BitbucketParser:
                 continue
 
     def _process_user(self, project_key: str) -> None:
-        users = self._conn.project_users(project_key)
+        users = list(self._conn.project_users(project_key))
         if users:
-            repos = self._conn.repo_list(project_key)
+            insert_users({user['user']['id']: self.create_vcs_user_dict(user['user'], self.instance.id)
+                          for user in users})
+            repos = self._get_repos(project_key)
+            repository_users = {}
             for repo in repos:
                 for user in users:
-                    user_obj = User.get_or_create(vcs_instance_id=self.instance.id,
-                                                  vcs_id=user['user']['id'],
-                                                  name=user['user']['displayName'],
-                                                  username=user['user']['name'],
-                                                  state="active" if user['user']['active'] else "blocked",
-                                                  locked=False if user['user']['active'] else True,
-                                                  web_url=user['user']['links']['self'][0]['href'])
-                    user_id = user_obj[0].vcs_id
-                    user_dict = self.create_user_dict(self.instance.id, repo['project']['id'], user_id,
-                                                      user['permission'])
-                    insert_repository_users({user_id: user_dict})
+                    user_id = user['user']['id']
+                    repository_users[(repo['id'], user_id)] = self.create_user_dict(self.instance.id, repo['id'],
+                                                                                    user_id, user['permission'])
+            insert_repository_users(repository_users)
 
     def _process_project_contributors(self, project_key: str) -> None:
         """
@@ -153,72 +214,244 @@ class BitbucketParser:
         @return: None.
         """
         try:
-            repos = self._conn.repo_list(project_key)
+            repos = self._get_repos(project_key)
 
             for repo in repos:
-                repo_slug = repo['slug']
-                commits = self._conn.get_commits(project_key, repo_slug)
-                contributors = {}
-
-                for commit in commits:
-                    author_email = commit['author']['emailAddress']
-                    if author_email not in contributors:
-                        contributors[author_email] = {
-                            "email": author_email,
-                            "commits": 0,
-                            "additions": 0,
-                            "deletions": 0,
-                            "vcs_instance_id": self.instance.id,
-                            "repo_id": repo['id']
-                        }
-                    contributors[author_email]["commits"] += 1
-
-                for email, contributor_info in contributors.items():
-                    contributor_insert_key = f"{repo['id']}{email}"
-                    insert_contributors({contributor_insert_key: contributor_info})
+                self._process_repository_contributors(project_key, repo)
 
         except Exception as err:
             logger.error(f"- [T{get_thread_num()}] Caught unexpected error: {err}")
 
-    def process_instance(self) -> None:
-        start_time = datetime.now()
+    def _process_repository_contributors(self, project_key: str, repo: dict) -> None:
+        """
+        Count the commits of a repository per author, walking only the commits newer than the last processed one,
+        unless CONTRIBUTORS_FULL_REBUILD is set or the last processed commit is gone from the history.
 
-        projects = self._get_projects()
-        if PROCESS_PROJECTS:
-            with ThreadPoolExecutor(max_workers=PROJECT_WORKERS_COUNT) as queue:
-                dry_count = 0
-                for project in projects:
-                    dry_count += 1
-                    queue.submit(self._process_project, project)
-
-                    if DRY_RUN and dry_count > 100:
-                        break
-                queue.shutdown(wait=True, cancel_futures=False)
+        @param project_key: The key of the project of the repository.
+        @param repo: The repository.
 
-        if PROCESS_GROUPS:
-            with ThreadPoolExecutor(max_workers=GROUP_WORKERS_COUNT) as queue:
-                dry_count = 0
-                for project in projects:
-                    dry_count += 1
-                    queue.submit(self._process_group, project)
+        @return: None.
+        """
+        state = None if CONTRIBUTORS_FULL_REBUILD else self._contributors_states.get(repo['id'])
+        last_commit_id = state['head_sha'] if state and state['head_sha'] else None
+        try:
+            contributors, head_commit = self._count_commits(project_key, repo, last_commit_id)
+        except HTTPError as err:
+            if not last_commit_id:
+                raise
+            logger.warning(f"- [T{get_thread_num()}] Last processed commit of '{repo['slug']}' not found, "
+                           f"rebuilding its contributors: {err}")
+            last_commit_id = None
+            contributors, head_commit = self._count_commits(project_key, repo, None)
 
-                    if DRY_RUN and dry_count > 100:
-                        break
-                queue.shutdown(wait=True, cancel_futures=False)
-
-        if PROCESS_USERS:
-            with ThreadPoolExecutor(max_workers=PROJECT_WORKERS_COUNT) as queue:
-                dry_count = 0
-                for project in projects:
-                    dry_count += 1
-                    project_key = project['key']
-                    queue.submit(self._process_user, project_key)
-                    queue.submit(self._process_project_contributors, project_key)
-                    if DRY_RUN and dry_count > 100:
+        if last_commit_id and head_commit is None:
+            return
+        state = {
+            "vcs_instance_id": self.instance.id,
+            "repo_id": repo['id'],
+            "head_sha": head_commit['id'] if head_commit else '',
+            "last_activity_at": datetime.fromtimestamp(head_commit['authorTimestamp'] / 1000) if head_commit else None,
+            "computed_at": datetime.now()
+        }
+        store_repository_contributors(contributors, state, increment=last_commit_id is not None)
+
+    def _count_commits(self, project_key: str, repo: dict, last_commit_id: Optional[str]) -> tuple[dict, Optional[dict]]:
+        """
+        Count the commits of a repository per author email.
+
+        @param project_key: The key of the project of the repository.
+        @param repo: The repository.
+        @param last_commit_id: If set, only commits newer than this one are counted.
+
+        @return: Contributors of the repository and the newest commit, or None if there are no (new) commits.
+        """
+        commits = self._conn.get_commits(project_key, repo['slug'], hash_oldest=last_commit_id, limit=1000)
+        contributors = {}
+        head_commit = None
+
+        for commit in commits:
+            if head_commit is None:
+                head_commit = commit
+            author_email = commit['author']['emailAddress']
+            contributor_insert_key = f"{repo['id']}{author_email}"
+            if contributor_insert_key not in contributors:
+                contributors[contributor_insert_key] = {
+                    "email": author_email,
+                    "commits": 0,
+                    "additions": 0,
+                    "deletions": 0,
+                    "vcs_instance_id": self.instance.id,
+                    "repo_id": repo['id']
+                }
+            contributors[contributor_insert_key]["commits"] += 1
+
+        return contributors, head_commit
+
+    @staticmethod
+    def _is_crawl_due(instance_id: int, listing: str) -> bool:
+        """
+        Check whether a full listing of the instance was not requested by the fast inventory for
+        BITBUCKET_FAST_INVENTORY_INTERVAL minutes, and register the listing if so.
+
+        @param instance_id: ID of the instance.
+        @param listing: Name of the listing.
+
+        @return: True if the listing has to be requested.
+        """
+        now = monotonic()
+        with last_crawls_lock:
+            last_crawl = last_crawls.get((instance_id, listing))
+            if last_crawl is not None and now - last_crawl < BITBUCKET_FAST_INVENTORY_INTERVAL * 60:
+                return False
+            last_crawls[(instance_id, listing)] = now
+        return True
+
+    def process_new_groups(self, instance_id: int) -> None:
+        """
+        Insert Bitbucket projects which are not stored as groups yet.
+
+        Bitbucket cannot list only the new projects, so all the projects are listed, at most once per
+        BITBUCKET_FAST_INVENTORY_INTERVAL minutes.
+
+        @param instance_id: ID of the current instance
+
+        @return: None
+        """
+        if not self._is_crawl_due(instance_id, "projects"):
+            return
+        known_groups = {group.vcs_id for group in fetch_groups(instance_id)}
+        groups_to_insert = {}
+        try:
+            for project in self._conn.project_list(limit=1000):
+                if project['id'] not in known_groups:
+                    groups_to_insert[project['id']] = self.create_group_dict(project, instance_id)
+        except Exception as e:
+            logger.error(f"Error listing new bitbucket projects: {e}")
+        insert_groups(groups_to_insert)
+
+        if groups_to_insert:
+            logger.info(f"Processed new bitbucket projects ({len(groups_to_insert)})")
+
+        flush_write_buffers()
+
+    def process_new_projects(self, instance_id: int) -> None:
+        """
+        Process Bitbucket repositories which are new or were moved since they were inventoried.
+
+        All repositories are listed with one paginated listing of the instance, one request per 1000 repositories,
+        and compared with the database, only the new and moved ones are enriched, at most FAST_INVENTORY_MAX_PROJECTS
+        per run. The listing is requested at most once per BITBUCKET_FAST_INVENTORY_INTERVAL minutes.
+
+        @param instance_id: ID of the current instance
+
+        @return: None
+        """
+        if not self._is_crawl_due(instance_id, "repos"):
+            return
+        _, projects_parents = get_inventoried_projects_with_parents(instance_id)
+
+        processed = 0
+        with FairScheduler(self.workers_count, "bitbucket_new_repos") as scheduler:
+            try:
+                for repo in self._list_all_repos():
+                    inventoried_repo = projects_parents.get(repo['id'])
+                    if inventoried_repo and inventoried_repo['path'] == self.get_repo_path(repo, self.instance):
+                        continue
+                    processed += 1
+                    project_key = repo['project']['key']
+                    scheduler.submit(project_key, self._process_repository, project_key, self._compact_repo(repo))
+                    if processed >= FAST_INVENTORY_MAX_PROJECTS:
+                        logger.info(f"Reached the limit of {FAST_INVENTORY_MAX_PROJECTS} new repositories per run")
                         break
-                queue.shutdown(wait=True, cancel_futures=False)
+            except Exception as e:
+                logger.error(f"Error listing new bitbucket repositories: {e}")
+
+        if processed:
+            logger.info(f"Processed new bitbucket repositories ({processed})")
+
+        flush_write_buffers()
+
+    def plan_tasks(self) -> tuple[str, list[dict]]:
+        """
+        Split the inventory of the instance into tasks processed by inventory workers. Bitbucket projects are not
+        listed in ID order, so the whole instance is a single task.
+
+        @return: Mode of the run and the list of its tasks.
+        """
+        return 'full', [{'stage': 'instance'}]
+
+    def process_task(self, run: InventoryRun, stage: str, lower_bound: Optional[int] = None,
+                     upper_bound: Optional[int] = None) -> None:
+        """
+        Process a task of a distributed inventory run.
+
+        @param run: The inventory run.
+        @param stage: Stage of the task.
+        @param lower_bound: Unused, Bitbucket tasks have no ID ranges.
+        @param upper_bound: Unused, Bitbucket tasks have no ID ranges.
+
+        @return: None
+        """
+        with bulk_load(self.instance.id):
+            self._process_instance()
+
+    def sweep_unseen(self, run: InventoryRun) -> None:
+        """
+        Tombstone the projects and repositories of the instance not seen by the completed run.
+
+        @param run: The completed inventory run.
+
+        @return: None
+        """
+        if not SWEEP_UNSEEN:
+            return
+        try:
+            stats = sweep_unseen_rows(self.instance.id, run.started_at, groups=PROCESS_GROUPS,
+                                      repositories=PROCESS_PROJECTS, registries=False)
+            logger.info(f"'{self.instance.url}': swept rows not seen since {run.started_at}: {stats}")
+        except Exception as err:
+            logger.error(f"Error on sweeping rows of '{self.instance.url}': {err}")
+
+    def process_instance(self) -> None:
+        start_time = datetime.now()
+
+        run = fetch_unfinished_run(self.instance.id)
+        if run:
+            finish_inventory_run(run, 'abandoned')
+        run = start_inventory_run(self.instance.id, 'full', start_time)
+        try:
+            with bulk_load(self.instance.id):
+                self._process_instance()
+        except Exception:
+            finish_inventory_run(run, 'failed')
+            raise
+        finish_inventory_run(run, 'dry_run' if DRY_RUN else 'completed')
+        if not DRY_RUN:
+            self.sweep_unseen(run)
 
         end_time = datetime.now()
 
         logger.info(
             f"'{self.instance.url}': processed in {end_time - start_time}")
+
+    def _process_instance(self) -> None:
+        if PROCESS_USERS and not CONTRIBUTORS_FULL_REBUILD:
+            self._contributors_states = fetch_contributors_states(self.instance.id)
+
+        projects = self._get_projects()
+        with FairScheduler(self.workers_count, "bitbucket") as scheduler:
+            dry_count = 0
+            for project in projects:
+                dry_count += 1
+                project_key = project['key']
+                if PROCESS_PROJECTS:
+                    scheduler.submit(project_key, self._process_project, scheduler, project)
+                if PROCESS_GROUPS:
+                    scheduler.submit(project_key, self._process_group, project)
+                if PROCESS_USERS:
+                    scheduler.submit(project_key, self._process_user, project_key)
+                    scheduler.submit(project_key, self._process_project_contributors, project_key)
+
+                if DRY_RUN and dry_count > 100:
+                    break
+        flush_write_buffers()
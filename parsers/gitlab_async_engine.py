@@ -0,0 +1,424 @@
+import asyncio
+from datetime import datetime
+from typing import Any, AsyncIterator, Optional
+from urllib.parse import quote
+
+import aiohttp
+from gitlab.v4.objects import Project, Group, ProjectRegistryRepository, ProjectRegistryTag
+
+from db.db_utils import fetch_tags, insert_repositories, insert_registries, insert_images, insert_groups, \
+    insert_contributors_states, touch_images, touch_repositories, touch_registries
+from settings.config import ASYNC_MAX_CONCURRENCY, ASYNC_MAX_RETRIES, ASYNC_REQUEST_TIMEOUT, PROCESS_REGISTRIES, \
+    PROCESS_USERS, FULL_UPDATE_DAY, DRY_RUN, LEAN_PROJECT_ENRICHMENT, FAST_INVENTORY_MAX_PROJECTS, \
+    GROUP_MEMBERSHIP_RESOLUTION
+from settings.logger import logger
+from utils.checkpoint import ListingCheckpoint
+
+
+class AsyncGitLabEngine:
+    """
+    Asyncio-based inventory engine of a GitLab instance.
+
+    Drives the same REST endpoints as the threaded GitLabParser with a non-blocking HTTP client and up to
+    ASYNC_MAX_CONCURRENCY requests in flight. API responses are wrapped into python-gitlab objects, and rows are built
+    with the parser helpers and written through db_utils, so both engines produce the same data.
+    """
+
+    def __init__(self, parser, token: str):
+        self.parser = parser
+        self.instance = parser.instance
+        self.api_url = f"{self.instance.url.rstrip('/')}/api/v4"
+        self._headers = {"PRIVATE-TOKEN": token}
+        self._session = None
+        self._semaphore = None
+        self._tasks = {}
+
+    def _run(self, coroutine_function, *args, **kwargs) -> Any:
+        return asyncio.run(self._with_session(coroutine_function, *args, **kwargs))
+
+    async def _with_session(self, coroutine_function, *args, **kwargs) -> Any:
+        self._semaphore = asyncio.Semaphore(ASYNC_MAX_CONCURRENCY)
+        self._tasks = {}
+        connector = aiohttp.TCPConnector(limit=ASYNC_MAX_CONCURRENCY, ssl=False)
+        timeout = aiohttp.ClientTimeout(total=ASYNC_REQUEST_TIMEOUT)
+        async with aiohttp.ClientSession(headers=self._headers, connector=connector, timeout=timeout) as session:
+            self._session = session
+            try:
+                return await coroutine_function(*args, **kwargs)
+            finally:
+                self._session = None
+
+    @staticmethod
+    def _encode_params(params: dict) -> dict:
+        return {key: str(value).lower() if isinstance(value, bool) else str(value) for key, value in params.items()}
+
+    async def _request(self, url: str, params: Optional[dict] = None) -> tuple[Any, Any]:
+        """
+        Perform a GET request through the instance rate limiter, retrying on rate limiting, server errors, connection
+        errors and timeouts.
+
+        @param url: Absolute URL of the request.
+        @param params: Query parameters of the request.
+
+        @return: Decoded JSON body of the response and the parsed `Link` header.
+        """
+        for attempt in range(ASYNC_MAX_RETRIES + 1):
+            status = None
+            try:
+                async with self._semaphore:
+                    await self.parser.rate_limiter.acquire_async()
+                    async with self._session.get(url, params=params) as response:
+                        status = response.status
+                        self.parser.rate_limiter.update(response.status, response.headers)
+                        retryable = response.status == 429 or response.status >= 500
+                        if not retryable or attempt == ASYNC_MAX_RETRIES:
+                            response.raise_for_status()
+                            return await response.json(), response.links
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt == ASYNC_MAX_RETRIES:
+                    raise
+                logger.debug(f"Request to {url} failed ({type(e).__name__}: {e}), retrying...")
+            # Retry-After of a 429 response is already honoured by the rate limiter
+            if status != 429:
+                await asyncio.sleep(2 ** attempt)
+
+    async def _get(self, path: str, **params) -> Any:
+        data, _ = await self._request(f"{self.api_url}{path}", self._encode_params(params))
+        return data
+
+    async def _paginate(self, path: str, **params) -> AsyncIterator[dict]:
+        url, query = f"{self.api_url}{path}", self._encode_params({"per_page": 100, **params})
+        while url:
+            data, links = await self._request(url, query)
+            for item in data:
+                yield item
+            next_link = links.get('next')
+            url, query = (str(next_link['url']), None) if next_link else (None, None)
+
+    async def _get_parents(self, projects_parents: dict, project: Project, repo_id: int) -> list:
+        parents = self.parser._get_known_parents(projects_parents, project, repo_id)
+        if parents is not None:
+            return parents
+
+        self.parser._count_api_call("groups")
+        groups = await self._get(f"/projects/{repo_id}/groups")
+        self.parser._add_ancestor_groups(groups)
+        return [group['id'] for group in groups]
+
+    async def _get_forks_count(self, project: Project) -> int:
+        if LEAN_PROJECT_ENRICHMENT and 'forks_count' in project.attributes:
+            return project.forks_count
+        self.parser._count_api_call("forks")
+        return len([fork async for fork in self._paginate(f"/projects/{project.id}/forks")])
+
+    async def _get_last_commit_at(self, project: Project, inventoried_project: dict) -> Optional[Any]:
+        if self.parser._can_reuse_last_commit(project, inventoried_project):
+            return inventoried_project['last_commit_at']
+        head_commit = await self._get_head_commit(project)
+        return head_commit['committed_date'] if head_commit else None
+
+    async def _once(self, key: tuple, coroutine_function, *args) -> Any:
+        """Await the result of a coroutine run at most once per key and session, failed runs are not memoized"""
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(coroutine_function(*args))
+        try:
+            return await task
+        except Exception:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+            raise
+
+    async def _get_head_commit(self, project: Project) -> Optional[dict]:
+        return await self._once(("head_commit", project.id), self._fetch_head_commit, project)
+
+    async def _fetch_head_commit(self, project: Project) -> Optional[dict]:
+        self.parser._count_api_call("commits")
+        last_commit = await self._get(f"/projects/{project.id}/repository/commits", per_page=1)
+        return {'id': last_commit[0]['id'], 'committed_date': last_commit[0]['committed_date']} \
+            if len(last_commit) > 0 else None
+
+    async def _process_project(self, project: Project, projects_parents: dict, instance_id: int) -> None:
+        logger.info(f"[async]: Processing project '{project.path}' ({project.id=})")
+        try:
+            repo_id = project.get_id()
+            self.parser.metrics.incr("projects")
+            parents, forks_count, last_commit_at = await asyncio.gather(
+                self._get_parents(projects_parents, project, repo_id),
+                self._get_forks_count(project),
+                self._get_last_commit_at(project, projects_parents.get(repo_id, {}))
+            )
+            repo = self.parser._create_project_dict(project, parents, instance_id, forks_count, last_commit_at)
+            await asyncio.to_thread(insert_repositories, {repo_id: repo})
+        except Exception as err:
+            logger.error(f"- [async] Caught unexpected error while inserting repository into database: {err}")
+            await asyncio.to_thread(touch_repositories, instance_id, [project.id])
+
+    async def _process_project_registry(self, project: Project, instance_id: int) -> None:
+        self.parser._count_api_call("registries")
+        try:
+            registries = [ProjectRegistryRepository(project.repositories, attrs) async for attrs in
+                          self._paginate(f"/projects/{project.id}/registry/repositories")]
+        except aiohttp.ClientResponseError as err:
+            if err.status == 403:
+                logger.debug(f"- [async] Got 403 while processing '{project.path}'")
+            else:
+                logger.error(f"- [async] Caught unexpected error while requesting registries of '{project.path}': {err}")
+                await asyncio.to_thread(touch_registries, instance_id, project.id)
+            return
+        except Exception as err:
+            logger.error(f"- [async] Caught unexpected error while requesting registries of '{project.path}': {err}")
+            await asyncio.to_thread(touch_registries, instance_id, project.id)
+            return
+
+        for registry in registries:
+            try:
+                await self._process_registry(registry, instance_id)
+            except Exception as err:
+                logger.error(f"-- [async] Caught unexpected error while processing registry '{registry.path}': {err}")
+                await asyncio.to_thread(touch_registries, instance_id, registry.project_id, registry.get_id())
+
+    async def _process_registry(self, registry: ProjectRegistryRepository, instance_id: int) -> None:
+        logger.debug(f"-- [async] Processing registry '{registry.location}'")
+        image = self.parser._create_image_dict(registry, instance_id)
+        await asyncio.to_thread(insert_registries, {registry.get_id(): image})
+
+        tags_path = f"/projects/{registry.project_id}/registry/repositories/{registry.get_id()}/tags"
+        tags = [attrs async for attrs in self._paginate(tags_path)]
+        if not tags:
+            logger.debug(f"-- [async] No tags in registry {registry.location}")
+            return
+
+        tags_index = await asyncio.to_thread(fetch_tags, registry, instance_id)
+        tags_to_fetch = [tag for tag in tags if self.parser._tag_needs_details(tag, tags_index.get(tag['path']))]
+        self.parser.metrics.incr("registry_tags_skipped", len(tags) - len(tags_to_fetch))
+        if len(tags_to_fetch) < len(tags):
+            fetched_paths = {tag['path'] for tag in tags_to_fetch}
+            await asyncio.to_thread(touch_images, registry, instance_id,
+                                    [tag['path'] for tag in tags if tag['path'] not in fetched_paths])
+        images = await asyncio.gather(*(self._fetch_image(registry, tags_path, tag, instance_id)
+                                        for tag in tags_to_fetch))
+        failed_paths = [tag['path'] for tag, image in zip(tags_to_fetch, images) if image is None]
+        if failed_paths:
+            await asyncio.to_thread(touch_images, registry, instance_id, failed_paths)
+        images_to_insert = {image['image']: image for image in images if image}
+        if images_to_insert:
+            await asyncio.to_thread(insert_images, images_to_insert)
+
+    async def _fetch_image(self, registry: ProjectRegistryRepository, tags_path: str, tag: dict,
+                           instance_id: int) -> Optional[dict]:
+        logger.debug(f"--- [async] Processing image '{tag['location']}'")
+        self.parser._count_api_call("registry_tags")
+        try:
+            tag = ProjectRegistryTag(registry.tags, await self._get(f"{tags_path}/{quote(tag['name'], safe='')}"))
+            return self.parser._create_image_tag_dict(tag, instance_id)
+        except Exception as err:
+            logger.error(f"--- [async] Caught unexpected error while processing image '{tag['location']}': {err}")
+            return None
+
+    async def _process_project_users(self, project: Project, instance_id: int) -> None:
+        try:
+            members = await self._resolve_project_members(project) if GROUP_MEMBERSHIP_RESOLUTION else None
+            if members is None:
+                self.parser._count_api_call("members_all")
+                members = [attrs async for attrs in self._paginate(f"/projects/{project.id}/members/all")]
+            await asyncio.to_thread(self.parser._insert_project_members, project, members, instance_id)
+        except Exception as err:
+            logger.error(f"- [async] Caught unexpected error while processing users of '{project.path}': {err}")
+
+    async def _resolve_project_members(self, project: Project) -> Optional[list]:
+        if project.namespace.get('kind') != 'group' or 'shared_with_groups' not in project.attributes:
+            return None
+        try:
+            shares = [(share['group_id'], share['group_access_level']) for share in project.shared_with_groups]
+            group_members, shared_members = await asyncio.gather(self._get_group_members(project.namespace['id']),
+                                                                 self._get_shared_members(shares))
+            if group_members is None or shared_members is None:
+                return None
+
+            self.parser._count_api_call("members")
+            members = dict(group_members)
+            self.parser._merge_members(members,
+                                       [attrs async for attrs in self._paginate(f"/projects/{project.id}/members")])
+            self.parser._merge_members(members, shared_members.values())
+            return list(members.values())
+        except Exception as err:
+            logger.warning(f"- [async] Couldn't resolve members of '{project.path}' from its groups, "
+                           f"requesting all its members: {err}")
+            return None
+
+    async def _get_group_members(self, group_id: int) -> Optional[dict]:
+        return await self._once(("group_members", group_id), self._compose_group_members, group_id)
+
+    async def _compose_group_members(self, group_id: int) -> Optional[dict]:
+        chain = self.parser.group_tree.ancestors(group_id)
+        if chain is None:
+            return None
+        direct_members = await asyncio.gather(*(self._get_group_direct_members(group) for group in chain))
+        shares = await asyncio.gather(*(self._get_group_shares(group) for group in chain))
+        shared_members = await self._get_shared_members([share for group_shares in shares for share in group_shares])
+        if shared_members is None:
+            return None
+        members = {}
+        for group_members in direct_members:
+            self.parser._merge_members(members, group_members)
+        self.parser._merge_members(members, shared_members.values())
+        return members
+
+    async def _get_shared_members(self, shares: list) -> Optional[dict]:
+        chains = [(self.parser.group_tree.ancestors(group_id), group_access_level)
+                  for group_id, group_access_level in shares]
+        if any(chain is None for chain, _ in chains):
+            return None
+        members = {}
+        for chain, group_access_level in chains:
+            for group_members in await asyncio.gather(*(self._get_group_direct_members(group) for group in chain)):
+                self.parser._merge_members(members, group_members, group_access_level)
+        return members
+
+    async def _get_group_direct_members(self, group_id: int) -> list:
+        return await self._once(("group_direct_members", group_id), self._fetch_group_direct_members, group_id)
+
+    async def _fetch_group_direct_members(self, group_id: int) -> list:
+        self.parser._count_api_call("group_members")
+        return [attrs async for attrs in self._paginate(f"/groups/{group_id}/members")]
+
+    async def _get_group_shares(self, group_id: int) -> list:
+        return await self._once(("group_shares", group_id), self._fetch_group_shares, group_id)
+
+    async def _fetch_group_shares(self, group_id: int) -> list:
+        self.parser._count_api_call("group")
+        group = await self._get(f"/groups/{group_id}", with_projects=False)
+        return [(share['group_id'], share['group_access_level']) for share in group.get('shared_with_groups', [])]
+
+    async def _process_project_contributors(self, project: Project, instance_id: int) -> None:
+        try:
+            state = await asyncio.to_thread(self.parser._get_contributors_state, project.id)
+            if self.parser._contributors_unchanged(project, state):
+                self.parser.metrics.incr("contributors_skipped")
+                return
+
+            head_commit = await self._get_head_commit(project)
+            head_sha = head_commit['id'] if head_commit else ''
+            new_state = self.parser._create_contributors_state_dict(project, instance_id, head_sha)
+            if self.parser._contributors_unchanged(project, state, head_sha):
+                self.parser.metrics.incr("contributors_skipped")
+                await asyncio.to_thread(insert_contributors_states, {project.id: new_state})
+            else:
+                self.parser._count_api_call("contributors")
+                contributors = [contributor async for contributor in
+                                self._paginate(f"/projects/{project.id}/repository/contributors")]
+                await asyncio.to_thread(self.parser._store_project_contributors, project, contributors, new_state)
+        except Exception as err:
+            logger.error(f"- [async] Caught unexpected error while processing contributors of '{project.path}': {err}")
+
+    def _project_coroutines(self, project: Project, projects_parents: dict, instance_id: int,
+                            is_inventoried: bool) -> list:
+        coroutines = [self._process_project(project, projects_parents, instance_id)]
+        if PROCESS_REGISTRIES:
+            coroutines.append(self._process_project_registry(project, instance_id))
+        if PROCESS_USERS and (not is_inventoried or datetime.now().isoweekday() == FULL_UPDATE_DAY):
+            coroutines.append(self._process_project_users(project, instance_id))
+            coroutines.append(self._process_project_contributors(project, instance_id))
+        return coroutines
+
+    async def _process_projects(self, projects_parents: dict, inventoried: set, limit: Optional[int],
+                                checkpoint: Optional[ListingCheckpoint] = None, **list_params) -> set:
+        processed = set()
+        tasks = set()
+        async for attrs in self._paginate("/projects", pagination='keyset', order_by='id', **list_params):
+            project = Project(self.parser.gl.projects, attrs)
+            processed.add(project.id)
+            for coroutine in self._project_coroutines(project, projects_parents, self.instance.id,
+                                                      project.id in inventoried):
+                task = asyncio.create_task(coroutine)
+                if checkpoint:
+                    checkpoint.add(project.id)
+                    task.add_done_callback(lambda _, project_id=project.id: checkpoint.done(project_id, autosave=False))
+                tasks.add(task)
+            if len(tasks) >= ASYNC_MAX_CONCURRENCY * 2:
+                _, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            if checkpoint and checkpoint.is_due():
+                await asyncio.to_thread(checkpoint.save)
+            if (DRY_RUN and len(processed) > 100) or (limit and len(processed) >= limit):
+                break
+        if tasks:
+            await asyncio.wait(tasks)
+        return processed
+
+    async def _insert_groups(self, groups_to_insert: dict, checkpoint: Optional[ListingCheckpoint]) -> None:
+        await asyncio.to_thread(insert_groups, groups_to_insert)
+        if checkpoint:
+            for group_id in groups_to_insert:
+                checkpoint.done(group_id, autosave=False)
+            if checkpoint.is_due():
+                await asyncio.to_thread(checkpoint.save)
+
+    async def _process_groups(self, checkpoint: Optional[ListingCheckpoint] = None) -> None:
+        groups_to_insert = {}
+        dry_count = 0
+        async for attrs in self._paginate("/groups", order_by='id', sort='desc'):
+            if checkpoint and checkpoint.is_done(attrs['id']):
+                continue
+            dry_count += 1
+            group = Group(self.parser.gl.groups, attrs)
+            groups_to_insert[group.id] = self.parser._create_group_dict(group, self.instance.id)
+            self.parser.group_tree.add(group.id, group.parent_id, group.full_path)
+            if checkpoint:
+                checkpoint.add(group.id)
+            if len(groups_to_insert) >= 100:
+                await self._insert_groups(groups_to_insert, checkpoint)
+                groups_to_insert = {}
+            if DRY_RUN and dry_count > 100:
+                break
+        await self._insert_groups(groups_to_insert, checkpoint)
+
+    def process_groups(self, checkpoint: Optional[ListingCheckpoint] = None) -> None:
+        """
+        Process all groups of the instance.
+
+        @param checkpoint: Checkpoint of the listing, groups processed before the run was interrupted are skipped.
+
+        @return: None
+        """
+        logger.info("- Groups will be processed by the async engine...")
+        self._run(self._process_groups, checkpoint)
+
+    async def _process_partitions(self, projects_parents: dict, inventoried: set, partitions: list,
+                                  list_filters: dict) -> set:
+        listings = [self._process_projects(projects_parents, inventoried, None, checkpoint, sort='desc',
+                                           **self.parser._merge_list_filters(checkpoint, list_filters, range_filters))
+                    for checkpoint, range_filters in partitions]
+        return set().union(*await asyncio.gather(*listings))
+
+    def process_projects(self, last_project_id: int, last_activity_after: Optional[datetime] = None,
+                         partitions: Optional[list] = None) -> set:
+        """
+        Process projects of the instance.
+
+        @param last_project_id: ID of the last project of the instance.
+        @param last_activity_after: If set, only projects with activity after this time are processed.
+        @param partitions: Checkpoints and filters of the ID ranges listed concurrently, by default all the
+        projects are listed at once.
+
+        @return: Set of IDs of the processed projects.
+        """
+        inventoried, projects_parents = self.parser._get_inventoried_projects(self.instance.id, last_project_id)
+        list_filters = self.parser._get_list_filters(last_activity_after)
+        partitions = partitions or [(None, {})]
+        logger.info(f"- Will be listed in {len(partitions)} ranges and processed by the async engine with "
+                    f"{ASYNC_MAX_CONCURRENCY} requests in flight...")
+        return self._run(self._process_partitions, projects_parents, inventoried, partitions, list_filters)
+
+    def process_new_projects(self, last_inventoried_project_id: int, projects_parents: dict) -> int:
+        """
+        Process projects created after the last inventoried one.
+
+        @param last_inventoried_project_id: ID of the last project stored in the database.
+        @param projects_parents: A dictionary of inventoried projects with their parents.
+
+        @return: Number of processed projects.
+        """
+        processed = self._run(self._process_projects, projects_parents, set(), FAST_INVENTORY_MAX_PROJECTS,
+                              sort='asc', id_after=last_inventoried_project_id)
+        return len(processed)
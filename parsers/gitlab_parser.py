@@ -1,7 +1,9 @@
+import threading
 from concurrent.futures import ThreadPoolExecutor
-from datetime import datetime
+from datetime import datetime, timedelta
 import dateutil.parser
 from typing import Optional, Any
+from urllib.parse import urlparse
 
 import gitlab
 import gitlab.const
@@ -9,34 +11,64 @@ from gitlab.base import RESTObject
 from gitlab.v4.objects import Project, ProjectRegistryRepository, ProjectRegistryTag
 
 from db.db_utils import get_inventoried_projects_with_parents, fetch_tags, fetch_last_inventoried_group, \
-    insert_repositories, insert_registries, insert_images, insert_contributors, insert_users, insert_repository_users, \
-    insert_groups
-from db.models import VCSInstance
+    insert_repositories, insert_registries, insert_images, insert_users, insert_repository_users, \
+    insert_groups, flush_write_buffers, fetch_groups, fetch_last_completed_run, start_inventory_run, finish_inventory_run, \
+    fetch_contributors_states, insert_contributors_states, fetch_unfinished_run, resume_inventory_run, \
+    fetch_inventory_checkpoints, save_inventory_checkpoint, touch_repositories, touch_images, sweep_unseen_rows, \
+    touch_registries, bulk_load, store_repository_contributors
+from db.models import VCSInstance, InventoryRun
+from parsers.gitlab_async_engine import AsyncGitLabEngine
 from utils.exceptions import NoExistedRegistryTag, CantProcessGitlabRegistry, CantProcessProjectUsers, \
     CantInitParserObject
-from settings.config import SESSION, GROUP_WORKERS_COUNT, PROJECT_WORKERS_COUNT, PROCESS_REGISTRIES, PROCESS_USERS, \
-    DEBUG_LAST_ID, FULL_UPDATE_DAY, DRY_RUN, PROCESS_PROJECTS, PROCESS_GROUPS
+from settings.config import create_session, GROUP_WORKERS_COUNT, PROJECT_WORKERS_COUNT, PROCESS_REGISTRIES, PROCESS_USERS, \
+    DEBUG_LAST_ID, FULL_UPDATE_DAY, WORK_QUEUE_SIZE, DRY_RUN, PROCESS_PROJECTS, PROCESS_GROUPS, LEAN_PROJECT_ENRICHMENT, \
+    INCREMENTAL_INVENTORY, INCREMENTAL_OVERLAP_MINUTES, FAST_INVENTORY_MAX_PROJECTS, RATE_LIMIT_MAX_RPS, RATE_LIMIT_MIN_RPS, \
+    REGISTRY_TAG_REFRESH_DAYS, CACHE_CONTRIBUTORS, GROUP_MEMBERSHIP_RESOLUTION, RESUME_INVENTORY, \
+    RESUME_MAX_AGE_HOURS, LISTING_WORKERS_COUNT, INVENTORY_TASK_RANGES, SWEEP_UNSEEN
 from settings.logger import logger
-from utils.utils import get_thread_num
+from utils.checkpoint import ListingCheckpoint
+from utils.group_tree import GroupTree
+from utils.memo import Memo
+from utils.metrics import Metrics
+from utils.pipeline import BoundedExecutor
+from utils.rate_limiter import get_rate_limiter
+from utils.utils import get_thread_num, to_naive_utc
 
 
 class GitLabParser:
-    def __init__(self, vcs_instance: VCSInstance, token: str):
+    def __init__(self, vcs_instance: VCSInstance, token: str, engine: str = 'threaded',
+                 workers_count: int = PROJECT_WORKERS_COUNT, max_rate: float = RATE_LIMIT_MAX_RPS):
         """
         Authenticates with a Gitlab instance using the provided URL and token.
 
         @param: url: The URL of the Gitlab instance.
         @param: token: The private token for authentication.
+        @param: engine: Inventory engine to use, 'threaded' or 'async'.
+        @param: workers_count: Number of threads processing projects of the instance.
+        @param: max_rate: Maximum number of requests per second sent to the instance.
 
         @return: Optional[Gitlab]: The Gitlab instance if authentication is successful, None otherwise.
         """
         self.instance = vcs_instance
+        self.metrics = Metrics(f"gitlab.{self.instance.mnemonic}")
+        self.group_tree = GroupTree()
+        self.workers_count = workers_count
+        self.rate_limiter = get_rate_limiter(urlparse(self.instance.url).netloc, max_rate, RATE_LIMIT_MIN_RPS)
+        self._head_commits = Memo()
+        self._group_direct_members = Memo()
+        self._group_shares = Memo()
+        self._group_members = Memo()
+        self._contributors_states = None
+        self._contributors_states_lock = threading.Lock()
         try:
-            self.gl = gitlab.Gitlab(session=SESSION, url=self.instance.url, private_token=token, ssl_verify=False,
-                                    retry_transient_errors=True)
+            self.gl = gitlab.Gitlab(session=create_session(max_rate, workers_count + LISTING_WORKERS_COUNT),
+                                    url=self.instance.url,
+                                    private_token=token, ssl_verify=False, retry_transient_errors=True)
             self.gl.auth()
         except Exception as e:
             raise CantInitParserObject
+        self.engine = engine
+        self._async_engine = AsyncGitLabEngine(self, token) if engine == 'async' else None
 
     @staticmethod
     def _create_image_tag_dict(tag: ProjectRegistryTag, instance_id: int) -> dict:
@@ -52,6 +84,7 @@ class GitLabParser:
                 "revision": tag.revision,
                 "total_size": tag.total_size,
                 "last_time_checked": datetime.now(),
+                "last_time_seen": datetime.now(),
                 "is_scanned": False,
                 "last_time_scanned": None,
                 "last_scan_id": None
@@ -64,7 +97,8 @@ class GitLabParser:
             "vcs_id": group.get_id(),
             "parent_id": group.parent_id,
             "path": group.full_path,
-            "visibility": group.visibility
+            "visibility": group.visibility,
+            "last_time_checked": datetime.now()
             }
 
     @staticmethod
@@ -83,7 +117,8 @@ class GitLabParser:
         }
 
     @staticmethod
-    def _create_project_dict(project: Project, project_parents: list, instance_id: int, last_commit_at: Optional[Any] = None) -> dict:
+    def _create_project_dict(project: Project, project_parents: list, instance_id: int, forks_count: int,
+                             last_commit_at: Optional[Any] = None) -> dict:
         return {
                 "vcs_instance_id": instance_id,
                 "vcs_id": project.get_id(),
@@ -92,9 +127,9 @@ class GitLabParser:
                 "parents": project_parents,
                 "web_url": project.web_url,
                 "git_url": project.http_url_to_repo,
-                "forks_count": len(project.forks.list(all=True)),
+                "forks_count": forks_count,
                 "created": project.created_at,
-                "default_branch": None,
+                "default_branch": project.attributes.get('default_branch'),
                 "last_time_checked": datetime.now(),
                 "is_scanned": False,
                 "last_time_scanned": None,
@@ -104,22 +139,51 @@ class GitLabParser:
                 "is_archived": project.archived
             }
 
-    def _process_groups(self, vcs_instance: VCSInstance, start_time: datetime, last_group_id: int) -> None:
+    def _count_api_call(self, endpoint: str) -> None:
+        self.metrics.incr("api_calls")
+        self.metrics.incr(f"api_calls.{endpoint}")
+
+    def _log_api_calls(self) -> None:
+        projects = self.metrics.get("projects")
+        api_calls = self.metrics.get("api_calls")
+        per_project = api_calls / projects if projects else 0
+        logger.info(f"'{self.instance.url}': {int(api_calls)} per-project API calls for {int(projects)} projects "
+                    f"({per_project:.2f} per project) | {self.metrics}")
+        logger.info(f"'{self.instance.url}': {self.rate_limiter.metrics}")
+
+    def _load_group_tree(self, instance_id: int) -> None:
+        """
+        Fill the in-memory group tree with the groups already stored in the database.
+
+        @param instance_id: ID of the current instance
+
+        @return: None
+        """
+        for group in fetch_groups(instance_id):
+            self.group_tree.add(group.vcs_id, group.parent_id, group.path)
+        logger.info(f"- Loaded {len(self.group_tree)} groups into the group tree")
+
+    def _process_groups(self, vcs_instance: VCSInstance, start_time: datetime, last_group_id: int,
+                        checkpoint: Optional[ListingCheckpoint] = None) -> None:
         """
         Process groups from Gitlab instance.
     
         @param vcs_instance: VCSInstance object.
         @param start_time: Start time of the process.
         @param last_group_id: ID of the last group.
+        @param checkpoint: Checkpoint of the listing, groups processed before the run was interrupted are skipped.
     
         @return: None.
         """
         logger.info(f"- Last group id is '{last_group_id}', using {GROUP_WORKERS_COUNT} workers... ")
-        with ThreadPoolExecutor(max_workers=GROUP_WORKERS_COUNT) as groups_queue:
+        with BoundedExecutor(GROUP_WORKERS_COUNT, WORK_QUEUE_SIZE, "groups") as groups_queue:
             dry_count = 0
             for group in self.gl.groups.list(order_by='id', sort='desc', iterator=True):
+                if checkpoint and checkpoint.is_done(group.id):
+                    continue
                 dry_count += 1
-                groups_queue.submit(self._process_group, start_time, group, last_group_id, vcs_instance.id)
+                self._submit_tracked(groups_queue, checkpoint, group.id,
+                                     [(self._process_group, start_time, group, last_group_id, vcs_instance.id)])
                 if DRY_RUN and dry_count > 100:
                     break
             groups_queue.shutdown(wait=True, cancel_futures=False)
@@ -127,83 +191,260 @@ class GitLabParser:
     def process_new_groups(self, instance_id: int) -> None:
         """
         Process new Gitlab groups that have not been inventoried yet.
+
+        Groups are listed newest first and the listing stops at the last inventoried group, so only the pages
+        containing new groups are requested. Each page is upserted as one batch.
     
         @param instance_id: ID of the current instance
     
         @return: None
         """
-        groups = self.gl.groups.list(get_all=False, per_page=1, order_by='id', sort='desc')
-        last_gitlab_group_id = groups[0].id
         last_inventoried_group = fetch_last_inventoried_group(instance_id)
-
         last_inventoried_group_id = last_inventoried_group.vcs_id if last_inventoried_group else 0
 
-        start_time = datetime.now()
-
-        if last_gitlab_group_id > last_inventoried_group_id:
-            new_groups_id = range(last_inventoried_group_id + 1, last_gitlab_group_id + 1)
+        processed = 0
+        groups_to_insert = {}
+        try:
+            for group in self.gl.groups.list(iterator=True, order_by='id', sort='desc', per_page=100):
+                if group.id <= last_inventoried_group_id:
+                    break
+                groups_to_insert[group.id] = self._create_group_dict(group, instance_id)
+                self.group_tree.add(group.id, group.parent_id, group.full_path)
+                if len(groups_to_insert) >= 100:
+                    insert_groups(groups_to_insert)
+                    processed += len(groups_to_insert)
+                    groups_to_insert = {}
+        except Exception as e:
+            logger.error(f"Error listing new groups after {last_inventoried_group_id}: {e}")
+        insert_groups(groups_to_insert)
+        processed += len(groups_to_insert)
 
+        if processed:
             logger.info(
-                f"Processing new gitlab groups "
-                f"({last_gitlab_group_id - last_inventoried_group_id}) | "
-                f"{last_inventoried_group_id=} | "
-                f"{last_gitlab_group_id=}"
+                f"Processed new gitlab groups "
+                f"({processed}) | "
+                f"{last_inventoried_group_id=}"
             )
 
-            with ThreadPoolExecutor(max_workers=GROUP_WORKERS_COUNT) as groups_queue:
-                for gr_id in new_groups_id:
-                    try:
-                        group = self.gl.groups.get(gr_id)
-                        groups_queue.submit(self._process_group, start_time, group, last_gitlab_group_id, instance_id)
-                    except Exception as e:
-                        logger.error(f"Error processing group {gr_id}: {e}")
+        flush_write_buffers()
 
     def process_new_projects(self, instance_id: int) -> None:
         """
         Process new GitLab projects and update related data.
+
+        New projects are discovered with a keyset listing of projects with IDs greater than the last inventoried one,
+        so deleted or inaccessible IDs cost nothing, and at most FAST_INVENTORY_MAX_PROJECTS projects are processed
+        per run.
     
         @param instance_id: Instance ID
     
         @return: None
         """
-        projects = self.gl.projects.list(get_all=False, per_page=1, order_by='id', sort='desc')
-        last_gitlab_project_id = projects[0].id
         inventoried_projects_in_db, projects_parents = get_inventoried_projects_with_parents(instance_id)
         last_inventoried_project_id = inventoried_projects_in_db[0] if inventoried_projects_in_db else 0
 
-        if last_gitlab_project_id > last_inventoried_project_id:
-            new_projects_id = range(last_inventoried_project_id + 1, last_gitlab_project_id + 1)
+        self._load_group_tree(instance_id)
+
+        processed = 0
+        if self._async_engine:
+            try:
+                processed = self._async_engine.process_new_projects(last_inventoried_project_id, projects_parents)
+            except Exception as e:
+                logger.error(f"Error listing new projects after {last_inventoried_project_id}: {e}")
+        else:
+            with BoundedExecutor(self.workers_count, WORK_QUEUE_SIZE, "new_projects") as queue:
+                try:
+                    new_projects = self.gl.projects.list(iterator=True, pagination='keyset', order_by='id', sort='asc',
+                                                         per_page=100, id_after=last_inventoried_project_id)
+                    for project in new_projects:
+                        processed += 1
+                        self._submit_project(queue, project, projects_parents, instance_id, False)
+                        if processed >= FAST_INVENTORY_MAX_PROJECTS:
+                            logger.info(f"Reached the limit of {FAST_INVENTORY_MAX_PROJECTS} new projects per run")
+                            break
+                except Exception as e:
+                    logger.error(f"Error listing new projects after {last_inventoried_project_id}: {e}")
+                queue.shutdown(wait=True, cancel_futures=False)
 
+        if processed:
             logger.info(
-                f"Processing new gitlab projects "
-                f"({last_gitlab_project_id - last_inventoried_project_id}) | "
-                f"{last_inventoried_project_id=} | "
-                f"{last_gitlab_project_id=}"
+                f"Processed new gitlab projects "
+                f"({processed}) | "
+                f"{last_inventoried_project_id=}"
             )
 
-            with ThreadPoolExecutor(max_workers=PROJECT_WORKERS_COUNT) as queue:
-                for pr_id in new_projects_id:
-                    try:
-                        project = self.gl.projects.get(pr_id)
-
-                        queue.submit(self._process_project, project, projects_parents, instance_id)
-                        queue.submit(self._process_project_registry, project, instance_id)
-                        queue.submit(self._process_project_users, project, instance_id)
-                        queue.submit(self._process_project_contributors, project, instance_id)
-                    except Exception as e:
-                        logger.error(f"Error processing project {pr_id}: {e}")
-                queue.shutdown(wait=True, cancel_futures=False)
+        flush_write_buffers()
+        self._log_api_calls()
+
+    @staticmethod
+    def _submit_tracked(queue: BoundedExecutor, checkpoint: Optional[ListingCheckpoint], item_id: int,
+                        tasks: list) -> None:
+        """
+        Submit the tasks of a listed item into the queue. All the tasks are registered in the checkpoint of the listing
+        before any of them is submitted, so the item is not passed by the checkpoint until its last task is finished.
+
+        @param queue: Executor to submit the tasks into.
+        @param checkpoint: Checkpoint of the listing, if any.
+        @param item_id: ID of the listed item the tasks belong to.
+        @param tasks: List of tuples of the function to run and its arguments.
+
+        @return: None
+        """
+        if checkpoint is not None:
+            for _ in tasks:
+                checkpoint.add(item_id)
+        for fn, *args in tasks:
+            future = queue.submit(fn, *args)
+            if checkpoint is not None:
+                future.add_done_callback(lambda _: checkpoint.done(item_id))
+
+    def _submit_project(self, queue: BoundedExecutor, project: Project, projects_parents: dict, instance_id: int,
+                        is_inventoried: bool, checkpoint: Optional[ListingCheckpoint] = None) -> None:
+        """
+        Submit processing of a project and its registries, users and contributors into the queue.
+
+        @param queue: Executor to submit the processing into.
+        @param project: The GitLab project to process.
+        @param projects_parents: A dictionary of inventoried projects with their parents.
+        @param instance_id: The ID of the GitLab instance.
+        @param is_inventoried: Whether the project is already stored in the database.
+        @param checkpoint: Checkpoint of the listing the project comes from, if any.
 
-    def _process_projects(self, vcs_instance: VCSInstance, last_project_id: int) -> None:
+        @return: None
+        """
+        tasks = [(self._process_project, project, projects_parents, instance_id)]
+        if PROCESS_REGISTRIES:
+            tasks.append((self._process_project_registry, project, instance_id))
+        if PROCESS_USERS and (not is_inventoried or datetime.now().isoweekday() == FULL_UPDATE_DAY):
+            tasks.append((self._process_project_users, project, instance_id))
+            tasks.append((self._process_project_contributors, project, instance_id))
+        self._submit_tracked(queue, checkpoint, project.id, tasks)
+
+    def _process_projects(self, vcs_instance: VCSInstance, last_project_id: int,
+                          last_activity_after: Optional[datetime] = None, partitions: Optional[list] = None) -> set:
         """
            Process projects from Gitlab.
     
            @param vcs_instance: VCSInstance object containing information about the version control system.
            @param last_project_id: Integer representing the ID of the last project that was processed.
+           @param last_activity_after: If set, only projects with activity after this time are processed.
+           @param partitions: Checkpoints and filters of the ID ranges listed concurrently, by default all the
+           projects are listed at once.
     
-           @return: None
+           @return: Set of IDs of the processed projects.
            """
-        inventoried_projects_in_db, projects_parents = get_inventoried_projects_with_parents(vcs_instance.id)
+        inventoried_projects_in_db, projects_parents = self._get_inventoried_projects(vcs_instance.id, last_project_id)
+        list_filters = self._get_list_filters(last_activity_after)
+        partitions = partitions or [(None, {})]
+        logger.info(f"- Will be listed in {len(partitions)} ranges and processed using {self.workers_count} workers... ")
+        processed = set()
+        with BoundedExecutor(self.workers_count, WORK_QUEUE_SIZE, "projects") as queue:
+            with ThreadPoolExecutor(max_workers=len(partitions)) as listing_pool:
+                listings = [listing_pool.submit(self._list_projects, queue, checkpoint,
+                                                self._merge_list_filters(checkpoint, list_filters, range_filters),
+                                                inventoried_projects_in_db, projects_parents, vcs_instance.id)
+                            for checkpoint, range_filters in partitions]
+                for listing in listings:
+                    processed |= listing.result()
+            queue.shutdown(wait=True, cancel_futures=False)
+
+        return processed
+
+    def _list_projects(self, queue: BoundedExecutor, checkpoint: Optional[ListingCheckpoint], list_filters: dict,
+                       inventoried_projects_in_db: set, projects_parents: dict, instance_id: int) -> set:
+        """
+        Page through the projects matching the filters with keyset pagination, submitting them into the queue.
+
+        @param queue: Executor to submit the processing into.
+        @param checkpoint: Checkpoint of the listing, if any.
+        @param list_filters: Filters of the listing.
+        @param inventoried_projects_in_db: Set of IDs of inventoried projects.
+        @param projects_parents: A dictionary of inventoried projects with their parents.
+        @param instance_id: The ID of the GitLab instance.
+
+        @return: Set of IDs of the listed projects.
+        """
+        listed = set()
+        for project in self.gl.projects.list(order_by='id', sort='desc', pagination='keyset', iterator=True,
+                                             **list_filters):
+            listed.add(project.id)
+            is_inventoried = project.id in inventoried_projects_in_db
+            self._submit_project(queue, project, projects_parents, instance_id, is_inventoried, checkpoint)
+            if DRY_RUN and len(listed) > 100:
+                break
+        logger.debug(f"- [T{get_thread_num()}] Listed {len(listed)} projects with filters {list_filters}")
+        return listed
+
+    @staticmethod
+    def _merge_list_filters(checkpoint: Optional[ListingCheckpoint], list_filters: dict, range_filters: dict) -> dict:
+        """
+        @return: Filters of a listing of an ID range, resumed from the position of its checkpoint.
+        """
+        return {**list_filters, **range_filters, **(checkpoint.list_filters() if checkpoint else {})}
+
+    def _get_project_partitions(self, run: InventoryRun, checkpoints: dict, last_project_id: int) -> list:
+        """
+        Split the project ID space into LISTING_WORKERS_COUNT ranges listed concurrently, each one with a checkpoint.
+
+        The ranges of a resumed run are restored from its checkpoints. The top range has no upper bound, so projects
+        created after the run has started are listed too.
+
+        @param run: The inventory run.
+        @param checkpoints: Checkpoints of the stages of the run.
+        @param last_project_id: ID of the last project of the instance.
+
+        @return: List of checkpoints and listing filters of the ranges which have not been completed.
+        """
+        lower_bounds = sorted(int(stage.split('.')[1]) for stage in checkpoints if stage.startswith('projects.'))
+        if not lower_bounds and ('projects' in checkpoints or LISTING_WORKERS_COUNT < 2):
+            checkpoint = self._get_checkpoint(run, checkpoints, 'projects')
+            return [(checkpoint, {})] if checkpoint else []
+
+        is_new = not lower_bounds
+        ranges = self._split_id_space(last_project_id, LISTING_WORKERS_COUNT) if is_new else \
+            list(zip(lower_bounds, lower_bounds[1:] + [None]))
+        partitions = []
+        for lower_bound, upper_bound in ranges:
+            stage = f"projects.{lower_bound}"
+            if is_new:
+                save_inventory_checkpoint(run.id, stage, None)
+            checkpoint = self._get_checkpoint(run, checkpoints, stage)
+            if checkpoint:
+                partitions.append((checkpoint, self._get_range_filters(lower_bound, upper_bound)))
+        return partitions
+
+    @staticmethod
+    def _split_id_space(last_id: int, count: int) -> list[tuple[int, Optional[int]]]:
+        """
+        Split the ID space into ranges of equal width, the top range has no upper bound.
+
+        @param last_id: The greatest ID at the moment.
+        @param count: Number of ranges.
+
+        @return: List of the lower (exclusive) and upper (inclusive) bounds of the ranges.
+        """
+        width = last_id // count + 1
+        lower_bounds = [num * width for num in range(count)]
+        return list(zip(lower_bounds, lower_bounds[1:] + [None]))
+
+    @staticmethod
+    def _get_range_filters(lower_bound: int, upper_bound: Optional[int]) -> dict:
+        range_filters = {'id_after': lower_bound}
+        if upper_bound is not None:
+            range_filters['id_before'] = upper_bound + 1
+        return range_filters
+
+    @staticmethod
+    def _get_inventoried_projects(instance_id: int, last_project_id: int) -> tuple[set, dict]:
+        """
+        Retrieve the projects already stored in the database.
+
+        @param instance_id: ID of the current instance
+        @param last_project_id: ID of the last project of the instance.
+
+        @return: Set of IDs of inventoried projects and a dictionary of their paths and parents.
+        """
+        inventoried_projects_in_db, projects_parents = get_inventoried_projects_with_parents(instance_id)
         last_inventoried_project_in_db = max(inventoried_projects_in_db, default=0)
         if last_inventoried_project_in_db > last_project_id:
             last_inventoried_project_in_db = 0
@@ -211,21 +452,100 @@ class GitLabParser:
 
         logger.info(f"- Last project id in GT: '{last_project_id}'")
         logger.info(f"- Last project id in DB: '{last_inventoried_project_in_db}'")
-        logger.info(f"- Will be processed using {PROJECT_WORKERS_COUNT} workers... ")
-        with ThreadPoolExecutor(max_workers=PROJECT_WORKERS_COUNT) as queue:
+        return set(inventoried_projects_in_db), projects_parents
+
+    @staticmethod
+    def _get_list_filters(last_activity_after: Optional[datetime]) -> dict:
+        list_filters = {}
+        if last_activity_after:
+            list_filters['last_activity_after'] = last_activity_after.astimezone().isoformat()
+            logger.info(f"- Incremental mode: processing projects active after {list_filters['last_activity_after']}")
+        return list_filters
+
+    def _sweep_projects(self, vcs_instance: VCSInstance, processed: set,
+                        checkpoint: Optional[ListingCheckpoint] = None) -> None:
+        """
+        Walk the id-only listing of all the projects of the instance with keyset pagination, processing projects which
+        are new or were moved since they were inventoried, but have not been processed by the incremental listing.
+
+        Unchanged projects are registered in the checkpoint until they are touched, so a resumed sweep does not pass
+        projects whose last check time was not updated.
+
+        @param vcs_instance: VCSInstance object containing information about the version control system.
+        @param processed: Set of IDs of the projects already processed in this run.
+        @param checkpoint: Checkpoint of the listing, the listing is resumed from its position.
+
+        @return: None
+        """
+        inventoried_projects_in_db, projects_parents = get_inventoried_projects_with_parents(vcs_instance.id)
+        inventoried_projects_in_db = set(inventoried_projects_in_db)
+        list_filters = checkpoint.list_filters() if checkpoint else {}
+
+        logger.info("- Sweeping all projects for new and moved ones...")
+        unchanged = []
+        with BoundedExecutor(self.workers_count, WORK_QUEUE_SIZE, "projects_sweep") as queue:
             dry_count = 0
-            for project in self.gl.projects.list(order_by='id', sort='desc', iterator=True):
+            for project in self.gl.projects.list(order_by='id', sort='desc', pagination='keyset', iterator=True,
+                                                 simple=True, **list_filters):
+                if project.id in processed:
+                    continue
                 dry_count += 1
                 is_inventoried = project.id in inventoried_projects_in_db
-                queue.submit(self._process_project, project, projects_parents, vcs_instance.id)
-                if PROCESS_REGISTRIES:
-                    queue.submit(self._process_project_registry, project, vcs_instance.id)
-                if PROCESS_USERS and (not is_inventoried or datetime.now().isoweekday() == FULL_UPDATE_DAY):
-                    queue.submit(self._process_project_users, project, vcs_instance.id)
-                    queue.submit(self._process_project_contributors, project, vcs_instance.id)
+                if is_inventoried and projects_parents[project.id]['path'] == project.path_with_namespace:
+                    self._add_unchanged(vcs_instance.id, unchanged, project.id, checkpoint)
+                    if PROCESS_USERS:
+                        self._submit_tracked(queue, checkpoint, project.id,
+                                             [(self._process_project_users, project, vcs_instance.id),
+                                              (self._process_project_contributors, project, vcs_instance.id)])
+                    continue
+                try:
+                    self._count_api_call("project")
+                    project = self.gl.projects.get(project.id)
+                except Exception as e:
+                    logger.error(f"Error processing project {project.id}: {e}")
+                    # the project is still there, it must not be swept as unseen
+                    self._add_unchanged(vcs_instance.id, unchanged, project.id, checkpoint)
+                    continue
+                self._submit_project(queue, project, projects_parents, vcs_instance.id, is_inventoried, checkpoint)
                 if DRY_RUN and dry_count > 100:
                     break
             queue.shutdown(wait=True, cancel_futures=False)
+        self._touch_unchanged(vcs_instance.id, unchanged, checkpoint)
+
+    def _add_unchanged(self, instance_id: int, unchanged: list, project_id: int,
+                       checkpoint: Optional[ListingCheckpoint]) -> None:
+        """
+        Add a listed project to the batch of the unchanged projects of the sweep, touching the batch once it is full.
+
+        @param instance_id: ID of the instance.
+        @param unchanged: Batch of IDs of the unchanged projects.
+        @param project_id: ID of the project.
+        @param checkpoint: Checkpoint of the listing, if any.
+
+        @return: None
+        """
+        if checkpoint:
+            checkpoint.add(project_id)
+        unchanged.append(project_id)
+        if len(unchanged) >= 1000:
+            self._touch_unchanged(instance_id, unchanged, checkpoint)
+
+    @staticmethod
+    def _touch_unchanged(instance_id: int, unchanged: list, checkpoint: Optional[ListingCheckpoint]) -> None:
+        """
+        Mark the batch of the unchanged projects of the sweep as seen and release them in the checkpoint.
+
+        @param instance_id: ID of the instance.
+        @param unchanged: Batch of IDs of the unchanged projects, emptied.
+        @param checkpoint: Checkpoint of the listing, if any.
+
+        @return: None
+        """
+        touch_repositories(instance_id, unchanged)
+        if checkpoint:
+            for project_id in unchanged:
+                checkpoint.done(project_id, autosave=False)
+        unchanged.clear()
 
     def _process_project_registry(self, project: Project, instance_id: int) -> None:
         """
@@ -238,7 +558,11 @@ class GitLabParser:
     
         @return: None.
         """
+        self._count_api_call("registries")
         registries = self._get_registries(project)
+        if registries is None:
+            touch_registries(instance_id, project.id)
+            return
         if not registries:
             logger.debug(f"- [T{get_thread_num()}] No registries in '{project.path}'")
             return
@@ -249,6 +573,10 @@ class GitLabParser:
             except (NoExistedRegistryTag, CantProcessGitlabRegistry):
                 continue
 
+    def _get_last_group_id(self) -> int:
+        groups = self.gl.groups.list(get_all=False, per_page=1, order_by='id', sort='desc')
+        return groups[0].id
+
     def _get_last_project_id(self) -> int:
         """
         Retrieve the ID of the last project from the Gitlab instance.
@@ -281,6 +609,7 @@ class GitLabParser:
                 logger.info(f"<{time_passed}> – [T{get_thread_num()}]: Processing group '{group.full_path}'")
                 group_id = group.get_id()
                 group_obj = self._create_group_dict(group, instance_id)
+                self.group_tree.add(group_id, group.parent_id, group.full_path)
                 insert_groups({group_id: group_obj})
                 return
             except Exception as e:
@@ -288,46 +617,75 @@ class GitLabParser:
                     f"- [T{get_thread_num()}]: Got exception while trying to get group with id '{id}: '{str(e)}'")
                 continue
     
-    def _process_image(self, registry: ProjectRegistryRepository, tag: RESTObject, instance_id: int) -> None:
+    @staticmethod
+    def _tag_needs_details(tag_attrs: dict, indexed_tag: Optional[dict]) -> bool:
+        """
+        Decide whether the details of a listed registry tag have to be requested from the instance.
+
+        @param tag_attrs: Attributes of the tag from the tags listing.
+        @param indexed_tag: The tag stored in the database, or None if the tag is new.
+
+        @return: True for new tags, tags without a stored digest, with a changed location or with a listed digest
+        different from the stored one, and, on FULL_UPDATE_DAY, tags not checked for REGISTRY_TAG_REFRESH_DAYS days.
+        """
+        if not indexed_tag or not indexed_tag['digest'] or indexed_tag['image'] != tag_attrs.get('location'):
+            return True
+        # the tags listing of older GitLab versions has no digest, a retagged image is then found by the refresh
+        if tag_attrs.get('digest') and tag_attrs['digest'] != indexed_tag['digest']:
+            return True
+        if datetime.now().isoweekday() != FULL_UPDATE_DAY:
+            return False
+        last_time_checked = indexed_tag['last_time_checked']
+        return not last_time_checked or last_time_checked <= datetime.now() - timedelta(days=REGISTRY_TAG_REFRESH_DAYS)
+
+    def _fetch_image(self, registry: ProjectRegistryRepository, tag: RESTObject, instance_id: int) -> Optional[dict]:
         """
-        Process a GitLab image from the provided registry and tag, and return a dictionary of images to insert.
+        Request the details of a GitLab registry tag and build the image to insert.
     
         @param registry: The project registry repository.
         @param tag: The RESTObject representing the image tag.
         @param instance_id: The ID of the instance.
     
-        @return: None.
+        @return: Dictionary of the image, or None if the tag details could not be requested.
         """
         logger.debug(f"--- [T{get_thread_num()}] Processing image '{tag.location}'")
+        self._count_api_call("registry_tags")
         try:
             tag = registry.tags.get(id=tag.name)
-            image = self._create_image_tag_dict(tag, instance_id)
-            insert_images({tag.location: image})
+            return self._create_image_tag_dict(tag, instance_id)
         except Exception as err:
             logger.error(
-                f"--- [T{get_thread_num()}] Caught unexpected error while processing image '{tag.location['path']}': {err}")
+                f"--- [T{get_thread_num()}] Caught unexpected error while processing image '{tag.location}': {err}")
+            return None
 
     def _process_registry_tags(self, registry: ProjectRegistryRepository, instance_id: int) -> None:
         """
-        Process registry tags, fetching and updating images based on the day of the week.
+        Process registry tags, requesting details only for the tags missing from the digest index of the registry.
     
         @param registry: The project registry repository.
         @param instance_id: The ID of the instance.
     
         @return: None.
         """
-        tags = registry.tags.list(iterator=True)
+        tags = list(registry.tags.list(iterator=True))
         if not tags:
             logger.debug(f"-- [T{get_thread_num()}] No tags in registry {registry.location}")
             raise NoExistedRegistryTag
 
-        tags_in_db = fetch_tags(registry, instance_id)
+        tags_index = fetch_tags(registry, instance_id)
+        tags_to_fetch = [tag for tag in tags if self._tag_needs_details(tag.attributes, tags_index.get(tag.path))]
+        self.metrics.incr("registry_tags_skipped", len(tags) - len(tags_to_fetch))
+        if len(tags_to_fetch) < len(tags):
+            fetched_paths = {tag.path for tag in tags_to_fetch}
+            touch_images(registry, instance_id, [tag.path for tag in tags if tag.path not in fetched_paths])
+        if not tags_to_fetch:
+            return
 
-        day_of_week = datetime.now().isoweekday()
-        for tag in tags:
-            if tag.path in tags_in_db and day_of_week != FULL_UPDATE_DAY:
-                continue
-            self._process_image(registry, tag, instance_id)
+        images = [self._fetch_image(registry, tag, instance_id) for tag in tags_to_fetch]
+        failed_paths = [tag.path for tag, image in zip(tags_to_fetch, images) if image is None]
+        if failed_paths:
+            touch_images(registry, instance_id, failed_paths)
+        insert_images({image['image']: image for image in images if image})
 
     def _process_registry(self, registry: ProjectRegistryRepository, instance_id: int) -> None:
         """
@@ -343,48 +701,169 @@ class GitLabParser:
             image = self._create_image_dict(registry, instance_id)
             insert_registries({registry.get_id(): image})
             self._process_registry_tags(registry, instance_id)
+        except NoExistedRegistryTag:
+            raise
         except Exception as err:
             logger.error(
                 f"-- [T{get_thread_num()}] Caught unexpected error while processing registry '{registry.path}': {err}")
+            touch_registries(instance_id, registry.project_id, registry.get_id())
             raise CantProcessGitlabRegistry
 
     def _process_project_users(self, project: Project, instance_id: int) -> None:
         """
         Process users associated with a project in a version control system.
     
-        It retrieves all members of the project, processes each member's data, and stores it in the provided dictionaries.
-        The function also handles exceptions and logs any errors that occur.
+        Effective members are composed from the direct members of the project and of its groups when possible, the
+        members of every group being requested once per run. Otherwise, all members of the project are requested.
     
         @param project: The project object to process users for.
         @param instance_id: The ID of the version control system instance.
     
         @return: None.
         """
-        members = project.members_all.list(get_all=True)
         try:
-            processed = set()
+            members = self._resolve_project_members(project) if GROUP_MEMBERSHIP_RESOLUTION else None
+            if members is None:
+                self._count_api_call("members_all")
+                members = [member.attributes for member in project.members_all.list(get_all=True)]
+            self._insert_project_members(project, members, instance_id)
+        except Exception as err:
+            logger.error(
+                f"-- [T{get_thread_num()}] Caught unexpected error while processing users of '{project.path}': {err}")
+
+    def _resolve_project_members(self, project: Project) -> Optional[list]:
+        """
+        Compose the effective members of a project from the direct members of the project, of its namespace group and
+        its ancestors, and of the groups the project and these groups are shared with.
+
+        @param project: The project object to resolve members for.
+
+        @return: List of members with their effective access level, or None if the project is not in a group, a
+        group involved is missing from the group tree or the members could not be requested.
+        """
+        if project.namespace.get('kind') != 'group' or 'shared_with_groups' not in project.attributes:
+            return None
+        try:
+            group_members = self._get_group_members(project.namespace['id'])
+            shares = [(share['group_id'], share['group_access_level']) for share in project.shared_with_groups]
+            shared_members = self._get_shared_members(shares)
+            if group_members is None or shared_members is None:
+                return None
+
+            self._count_api_call("members")
+            members = dict(group_members)
+            self._merge_members(members, [member.attributes for member in project.members.list(get_all=True)])
+            self._merge_members(members, shared_members.values())
+            return list(members.values())
+        except Exception as err:
+            logger.warning(f"-- [T{get_thread_num()}] Couldn't resolve members of '{project.path}' from its groups, "
+                           f"requesting all its members: {err}")
+            return None
+
+    def _get_group_members(self, group_id: int) -> Optional[dict]:
+        return self._group_members.get(group_id, lambda: self._compose_group_members(group_id))
+
+    def _compose_group_members(self, group_id: int) -> Optional[dict]:
+        chain = self.group_tree.ancestors(group_id)
+        if chain is None:
+            return None
+        members = {}
+        shares = []
+        for group in chain:
+            self._merge_members(members, self._get_group_direct_members(group))
+            shares += self._get_group_shares(group)
+        shared_members = self._get_shared_members(shares)
+        if shared_members is None:
+            return None
+        self._merge_members(members, shared_members.values())
+        return members
+
+    def _get_shared_members(self, shares: list) -> Optional[dict]:
+        """
+        Compose the members granted access through shared groups.
+
+        @param shares: List of tuples of the shared group ID and the maximum access level granted by the share.
+
+        @return: Dictionary of members by user ID, or None if a shared group is missing from the group tree.
+        """
+        members = {}
+        for group_id, group_access_level in shares:
+            chain = self.group_tree.ancestors(group_id)
+            if chain is None:
+                return None
+            for group in chain:
+                self._merge_members(members, self._get_group_direct_members(group), group_access_level)
+        return members
+
+    def _get_group_direct_members(self, group_id: int) -> list:
+        return self._group_direct_members.get(group_id, lambda: self._fetch_group_direct_members(group_id))
+
+    def _fetch_group_direct_members(self, group_id: int) -> list:
+        self._count_api_call("group_members")
+        return [member.attributes for member in self.gl.groups.get(group_id, lazy=True).members.list(get_all=True)]
+
+    def _get_group_shares(self, group_id: int) -> list:
+        return self._group_shares.get(group_id, lambda: self._fetch_group_shares(group_id))
+
+    def _fetch_group_shares(self, group_id: int) -> list:
+        self._count_api_call("group")
+        group = self.gl.groups.get(group_id, with_projects=False)
+        return [(share['group_id'], share['group_access_level'])
+                for share in group.attributes.get('shared_with_groups', [])]
+
+    @staticmethod
+    def _merge_members(members: dict, new_members, max_access_level: Optional[int] = None) -> None:
+        """
+        Merge members into the dictionary of members by user ID, keeping the highest access level of every user.
+
+        @param members: Dictionary of members to merge into.
+        @param new_members: Iterable of members to merge.
+        @param max_access_level: Access level the members are capped at, e.g. the access level of a group share.
+
+        @return: None.
+        """
+        for member in new_members:
+            access_level = member['access_level']
+            if max_access_level is not None:
+                access_level = min(access_level, max_access_level)
+            known_member = members.get(member['id'])
+            if known_member is None or known_member['access_level'] < access_level:
+                members[member['id']] = {**member, 'access_level': access_level}
+
+    def _insert_project_members(self, project: Project, members: list, instance_id: int) -> None:
+        """
+        Insert members of a project into the users and repository users tables.
+
+        @param project: The project object the members belong to.
+        @param members: List of project members, as dictionaries of their attributes.
+        @param instance_id: The ID of the version control system instance.
+
+        @return: None.
+        """
+        try:
+            users = {}
+            repository_users = {}
             access_levels = {gitlab.const.AccessLevel.GUEST: 'guest',
                              gitlab.const.AccessLevel.REPORTER: 'reporter',
                              gitlab.const.AccessLevel.DEVELOPER: 'developer',
                              gitlab.const.AccessLevel.MAINTAINER: 'maintainer',
                              gitlab.const.AccessLevel.OWNER: 'owner'}
             for member in members:
-                if member.id in processed:
+                if member['id'] in users:
                     continue
-                processed.add(member.id)
-                user = {key: getattr(member, attr) for key, attr in
+                user = {key: member[attr] for key, attr in
                         [("vcs_id", "id"), ("username", "username"), ("name", "name"), ("state", "state"),
                          ("locked", "locked"), ("web_url", "web_url")]}
                 user["vcs_instance_id"] = instance_id
+                users[member['id']] = user
 
-                insert_users({member.id: user})
-                access_level = access_levels.get(member.access_level)
+                access_level = access_levels.get(member['access_level'])
+                insert_user_key = f"{project.id}{member['id']}"
+                repository_users[insert_user_key] = {"repo_id": project.id, "user_id": member['id'],
+                                                     "access_level": access_level, "vcs_instance_id": instance_id}
 
-                user = {"repo_id": project.id, "user_id": member.id, "access_level": access_level,
-                        "vcs_instance_id": instance_id}
-
-                insert_user_key = f"{project.id}{member.id}"
-                insert_repository_users({insert_user_key: user})
+            insert_users(users)
+            insert_repository_users(repository_users)
         except Exception as err:
             logger.error(f"- [T{get_thread_num()}] Caught unexpected error: {err}")
             raise CantProcessProjectUsers
@@ -392,21 +871,83 @@ class GitLabParser:
     def _process_project_contributors(self, project: Project, instance_id: int) -> None:
         """
         Process the contributors of a project and insert their information into a dictionary.
+
+        Contributors are recomputed only if the head commit of the repository moved since the previous computation.
     
         @param project: The project object containing the repository contributors.
         @param instance_id: The ID of the VCS instance.
         
         @return: None.
         """
-        contributors = project.repository_contributors(get_all=True)
+        state = self._get_contributors_state(project.id)
+        if self._contributors_unchanged(project, state):
+            self.metrics.incr("contributors_skipped")
+            return
+
+        head_commit = self._get_head_commit(project)
+        head_sha = head_commit['id'] if head_commit else ''
+        new_state = self._create_contributors_state_dict(project, instance_id, head_sha)
+        if self._contributors_unchanged(project, state, head_sha):
+            self.metrics.incr("contributors_skipped")
+            insert_contributors_states({project.id: new_state})
+        else:
+            self._count_api_call("contributors")
+            contributors = project.repository_contributors(get_all=True)
+            self._store_project_contributors(project, contributors, new_state)
+
+    def _get_contributors_state(self, repo_id: int) -> Optional[dict]:
+        with self._contributors_states_lock:
+            if self._contributors_states is None:
+                self._contributors_states = fetch_contributors_states(self.instance.id)
+            return self._contributors_states.get(repo_id)
+
+    @staticmethod
+    def _contributors_unchanged(project: Project, state: Optional[dict], head_sha: Optional[str] = None) -> bool:
+        """
+        Check whether the stored contributors of a project are still up to date.
+
+        @param project: The project object.
+        @param state: State of the stored contributors, if any.
+        @param head_sha: SHA of the head commit of the repository. If not given, the project is considered unchanged
+        when it has had no activity since the contributors were computed.
+
+        @return: True if the contributors do not have to be recomputed.
+        """
+        if not CACHE_CONTRIBUTORS or not state:
+            return False
+        if head_sha is None:
+            return bool(LEAN_PROJECT_ENRICHMENT and state['last_activity_at'] and
+                        state['last_activity_at'] == to_naive_utc(project.last_activity_at))
+        return state['head_sha'] == head_sha
+
+    @staticmethod
+    def _create_contributors_state_dict(project: Project, instance_id: int, head_sha: str) -> dict:
+        return {
+            "vcs_instance_id": instance_id,
+            "repo_id": project.id,
+            "head_sha": head_sha,
+            "last_activity_at": to_naive_utc(project.last_activity_at),
+            "computed_at": datetime.now()
+        }
+
+    @staticmethod
+    def _store_project_contributors(project: Project, contributors: list, state: dict) -> None:
+        """
+        Write the contributors of a project together with the state they were computed in, in one transaction.
+
+        @param project: The project object the contributors belong to.
+        @param contributors: List of contributors as returned by the repository contributors API.
+        @param state: State of the contributors of the project, see `_create_contributors_state_dict`.
+
+        @return: None.
+        """
+        contributors_to_insert = {}
         for contributor in contributors:
-            contributor_info = {key: contributor.get(value) for key, value in
-                                [("email", "email"), ("commits", "commits"), ("additions", "additions"),
-                                 ("deletions", "deletions")]}
-            contributor_info["vcs_instance_id"] = instance_id
+            contributor_info = {key: contributor.get(key) for key in ("email", "commits", "additions", "deletions")}
+            contributor_info["vcs_instance_id"] = state["vcs_instance_id"]
             contributor_info['repo_id'] = project.id
-            contributor_insert_key = f"{project.id}{contributor['email']}"
-            insert_contributors({contributor_insert_key: contributor_info})
+            contributors_to_insert[f"{project.id}{contributor['email']}"] = contributor_info
+        store_repository_contributors(contributors_to_insert, state, increment=False)
 
     def _get_parents(self, project_parents: dict, project: Project, repo_id: int) -> list[Any] | Any:
         """
@@ -417,11 +958,91 @@ class GitLabParser:
         @param repo_id: The repository ID for which parents are being retrieved.
     
         @return: A list of parent project IDs if the project's path matches the path in project_parents.
-                 Otherwise, returns a list of group IDs associated with the project.
+                 Otherwise, returns a list of group IDs associated with the project, resolved from the group tree
+                 when all the ancestors of the project namespace are known.
+        """
+        parents = self._get_known_parents(project_parents, project, repo_id)
+        if parents is not None:
+            return parents
+
+        self._count_api_call("groups")
+        groups = project.groups.list()
+        self._add_ancestor_groups([group.attributes for group in groups])
+        return [group.id for group in groups]
+
+    def _get_known_parents(self, project_parents: dict, project: Project, repo_id: int) -> Optional[list]:
+        """
+        Retrieves parent groups of a project from the database data or the group tree, without API calls.
+
+        @param project_parents: A dictionary containing parent information for multiple projects.
+        @param project: The project object for which parents are being retrieved.
+        @param repo_id: The repository ID for which parents are being retrieved.
+
+        @return: A list of parent group IDs, or None if they cannot be resolved without API calls.
         """
         if project_parents.get(repo_id, {}).get('path', '') == project.path_with_namespace:
             return project_parents[repo_id]['parents']
-        return [group.id for group in project.groups.list()]
+        if LEAN_PROJECT_ENRICHMENT and project.namespace.get('kind') == 'user':
+            return []
+
+        namespace = project.namespace
+        if namespace.get('kind') == 'group' and 'full_path' in namespace:
+            self.group_tree.add(namespace['id'], namespace.get('parent_id'), namespace['full_path'])
+        return self.group_tree.ancestors(namespace['id'])
+
+    def _add_ancestor_groups(self, groups: list[dict]) -> None:
+        for group in groups:
+            if 'parent_id' in group:
+                self.group_tree.add(group['id'], group['parent_id'], group['full_path'])
+
+    def _get_forks_count(self, project: Project) -> int:
+        """
+        Retrieves the number of forks of a project, taking it from the listing payload when possible.
+
+        @param project: The project object for which forks are being counted.
+
+        @return: The number of forks of the project.
+        """
+        if LEAN_PROJECT_ENRICHMENT and 'forks_count' in project.attributes:
+            return project.forks_count
+        self._count_api_call("forks")
+        return len(project.forks.list(all=True))
+
+    def _get_last_commit_at(self, project: Project, inventoried_project: dict) -> Optional[Any]:
+        """
+        Retrieves the date of the last commit of a project. The date stored in the database is reused if the project
+        has had no activity since it was inventoried.
+
+        @param project: The project object for which the last commit is being retrieved.
+        @param inventoried_project: Data of the project stored in the database, if any.
+
+        @return: The date of the last commit, or None if the repository is empty.
+        """
+        if self._can_reuse_last_commit(project, inventoried_project):
+            return inventoried_project['last_commit_at']
+        head_commit = self._get_head_commit(project)
+        return head_commit['committed_date'] if head_commit else None
+
+    def _get_head_commit(self, project: Project) -> Optional[dict]:
+        """
+        Retrieves the last commit of a project, requesting it at most once per run.
+
+        @param project: The project object for which the last commit is being retrieved.
+
+        @return: Dictionary with the SHA and the date of the last commit, or None if the repository is empty.
+        """
+        return self._head_commits.get(project.id, lambda: self._fetch_head_commit(project))
+
+    def _fetch_head_commit(self, project: Project) -> Optional[dict]:
+        self._count_api_call("commits")
+        last_commit = project.commits.list(get_all=False, per_page=1, order_by='id', sort='desc')
+        return {'id': last_commit[0].id, 'committed_date': last_commit[0].committed_date} \
+            if len(last_commit) > 0 else None
+
+    @staticmethod
+    def _can_reuse_last_commit(project: Project, inventoried_project: dict) -> bool:
+        return bool(LEAN_PROJECT_ENRICHMENT and inventoried_project.get('last_commit_at') and
+                    to_naive_utc(inventoried_project.get('last_activity_repo')) == to_naive_utc(project.last_activity_at))
 
     def _process_project(self, project: Project, project_parents: Optional[dict], instance_id: int) -> None:
         """
@@ -437,20 +1058,18 @@ class GitLabParser:
         logger.info(f"[T{get_thread_num()}]: Processing project '{project.path}' ({project.id=})")
         try:
             repo_id = project.get_id()
-            project_parents = self._get_parents(project_parents, project, repo_id)
-
-            last_commit = project.commits.list(get_all=False, per_page=1, order_by='id', sort='desc')
-            last_commit_at = last_commit[0].committed_date if len(last_commit) > 0 else None
-            repo = self._create_project_dict(project, project_parents, instance_id, last_commit_at)
-
-            if 'default_branch' in project.attributes:
-                repo["default_branch"] = project.default_branch
+            self.metrics.incr("projects")
+            parents = self._get_parents(project_parents, project, repo_id)
+            forks_count = self._get_forks_count(project)
+            last_commit_at = self._get_last_commit_at(project, project_parents.get(repo_id, {}))
+            repo = self._create_project_dict(project, parents, instance_id, forks_count, last_commit_at)
 
             debug_var[repo_id] = repo
             insert_repositories({repo_id: repo})
         except Exception as err:
             logger.error(
                 f"- [T{get_thread_num()}] Caught unexpected error while inserting repository into database: {err}")
+            touch_repositories(instance_id, [project.id])
 
     def _get_registries(self, project: Project) -> Optional[list]:
         """
@@ -458,7 +1077,8 @@ class GitLabParser:
 
         @param project: The project for which to retrieve the registries.
 
-        @return Optional[list]: A list of registries if successful, None if a 403 Forbidden error occurs, or None if an unexpected error occurs.
+        @return Optional[list]: A list of registries if successful, an empty list if a 403 Forbidden error occurs (the
+        registry of the project is disabled), or None if an unexpected error occurs.
         """
         try:
             registries = project.repositories.list(get_all=True, retry_transient_errors=False)
@@ -466,25 +1086,184 @@ class GitLabParser:
         except Exception as err:
             if str(err) == "403: 403 Forbidden":
                 logger.debug(f"- [T{get_thread_num()}] Got 403 while processing '{project.path}'")
-                return None
+                return []
             else:
                 logger.error(
                     f"- [T{get_thread_num()}] Caught unexpected error while requesting registries of '{project.path}': {err}")
                 return None
 
+    def _start_run(self, mode: str, start_time: datetime) -> tuple[InventoryRun, dict]:
+        """
+        Resume the last inventory run of the instance if it was interrupted recently, otherwise start a new one.
+
+        @param mode: Mode of the new run.
+        @param start_time: Start time of the process.
+
+        @return: The run and the checkpoints of its stages.
+        """
+        run = fetch_unfinished_run(self.instance.id) if RESUME_INVENTORY else None
+        if run and run.started_at >= start_time - timedelta(hours=RESUME_MAX_AGE_HOURS):
+            logger.info(f"- Resuming inventory run started at {run.started_at}...")
+            resume_inventory_run(run)
+            return run, fetch_inventory_checkpoints(run.id)
+        if run:
+            logger.info(f"- Abandoning inventory run started at {run.started_at}...")
+            finish_inventory_run(run, 'abandoned')
+        return start_inventory_run(self.instance.id, mode, start_time), {}
+
+    @staticmethod
+    def _get_checkpoint(run: InventoryRun, checkpoints: dict, stage: str) -> Optional[ListingCheckpoint]:
+        """
+        @return: Checkpoint of the stage of the run, or None if the stage has been completed.
+        """
+        checkpoint = checkpoints.get(stage, {})
+        if checkpoint.get('is_completed'):
+            logger.info(f"- Stage '{stage}' has been completed before the run was interrupted, skipping...")
+            return None
+        return ListingCheckpoint(run.id, stage, checkpoint.get('cursor'))
+
+    @staticmethod
+    def _is_bulk_load(run: InventoryRun) -> bool:
+        """
+        @return: Whether the rows of the run are written with COPY, see `bulk_load`: in the full mode, and on
+        FULL_UPDATE_DAY when all the projects are swept.
+        """
+        return run.mode == 'full' or datetime.now().isoweekday() == FULL_UPDATE_DAY
+
+    def _get_last_activity_after(self) -> Optional[datetime]:
+        """
+        @return: Time of the activity after which projects are processed in the incremental mode, or None if all the
+        projects are processed.
+        """
+        last_run = fetch_last_completed_run(self.instance.id)
+        if INCREMENTAL_INVENTORY and last_run:
+            return last_run.started_at - timedelta(minutes=INCREMENTAL_OVERLAP_MINUTES)
+        return None
+
+    def _process_groups_stage(self, checkpoint: ListingCheckpoint, start_time: datetime, last_group_id: int) -> None:
+        if self._async_engine:
+            self._async_engine.process_groups(checkpoint)
+        else:
+            self._process_groups(self.instance, start_time, last_group_id, checkpoint)
+        checkpoint.save(is_completed=True)
+
+    def _process_projects_stage(self, partitions: list, last_project_id: int,
+                                last_activity_after: Optional[datetime]) -> set:
+        if self._async_engine:
+            processed = self._async_engine.process_projects(last_project_id, last_activity_after, partitions)
+        else:
+            processed = self._process_projects(self.instance, last_project_id, last_activity_after, partitions)
+        for checkpoint, _ in partitions:
+            checkpoint.save(is_completed=True)
+        return processed
+
+    def _sweep_projects_stage(self, checkpoint: ListingCheckpoint, processed: set) -> None:
+        self._sweep_projects(self.instance, processed, checkpoint)
+        checkpoint.save(is_completed=True)
+
+    def plan_tasks(self) -> tuple[str, list[dict]]:
+        """
+        Split the inventory of the instance into tasks processed by inventory workers: groups, the ID ranges of the
+        projects, and the sweep of all the projects on FULL_UPDATE_DAY in the incremental mode.
+
+        @return: Mode of the run and the list of its tasks.
+        """
+        last_activity_after = self._get_last_activity_after()
+        tasks = []
+        if PROCESS_GROUPS:
+            tasks.append({'stage': 'groups'})
+        if PROCESS_PROJECTS:
+            for lower_bound, upper_bound in self._split_id_space(self._get_last_project_id(), INVENTORY_TASK_RANGES):
+                tasks.append({'stage': f"projects.{lower_bound}", 'lower_bound': lower_bound,
+                              'upper_bound': upper_bound})
+            if last_activity_after and datetime.now().isoweekday() == FULL_UPDATE_DAY:
+                tasks.append({'stage': 'sweep'})
+        return 'incremental' if last_activity_after else 'full', tasks
+
+    def process_task(self, run: InventoryRun, stage: str, lower_bound: Optional[int] = None,
+                     upper_bound: Optional[int] = None) -> None:
+        """
+        Process a task of a distributed inventory run, resuming it from its checkpoint if it was leased before.
+
+        @param run: The inventory run.
+        @param stage: Stage of the task.
+        @param lower_bound: Lower (exclusive) bound of the ID range of the projects of the task.
+        @param upper_bound: Upper (inclusive) bound of the ID range of the projects of the task.
+
+        @return: None
+        """
+        checkpoint = self._get_checkpoint(run, fetch_inventory_checkpoints(run.id), stage)
+        if checkpoint is None:
+            return
+        self._load_group_tree(self.instance.id)
+        with bulk_load(self.instance.id, self._is_bulk_load(run)):
+            if stage == 'groups':
+                self._process_groups_stage(checkpoint, datetime.now(), self._get_last_group_id())
+            elif stage == 'sweep':
+                self._sweep_projects_stage(checkpoint, set())
+            else:
+                partitions = [(checkpoint, self._get_range_filters(lower_bound, upper_bound))]
+                self._process_projects_stage(partitions, self._get_last_project_id(), self._get_last_activity_after())
+            flush_write_buffers()
+        self._log_api_calls()
+
+    def sweep_unseen(self, run: InventoryRun) -> None:
+        """
+        Tombstone the groups, projects, registries and images of the instance not seen by the completed run.
+
+        Projects are swept only if the run has seen all of them: in the full mode, or in the incremental mode once the
+        sweep of all the projects has been completed. Registries and images are swept after full runs only.
+
+        @param run: The completed inventory run.
+
+        @return: None
+        """
+        if not SWEEP_UNSEEN:
+            return
+        checkpoints = fetch_inventory_checkpoints(run.id)
+        has_seen_projects = PROCESS_PROJECTS and (run.mode == 'full' or
+                                                  checkpoints.get('sweep', {}).get('is_completed', False))
+        try:
+            stats = sweep_unseen_rows(self.instance.id, run.started_at, groups=PROCESS_GROUPS,
+                                      repositories=has_seen_projects,
+                                      registries=has_seen_projects and run.mode == 'full' and PROCESS_REGISTRIES)
+            logger.info(f"'{self.instance.url}': swept rows not seen since {run.started_at}: {stats}")
+        except Exception as err:
+            logger.error(f"Error on sweeping rows of '{self.instance.url}': {err}")
+
     def process_instance(self):
         start_time = datetime.now()
 
-        last_project_id = self._get_last_project_id()
-        groups = self.gl.groups.list(get_all=False, per_page=1, order_by='id', sort='desc')
-        last_group_id = groups[0].id
+        last_activity_after = self._get_last_activity_after()
+        run, checkpoints = self._start_run('incremental' if last_activity_after else 'full', start_time)
 
-        if PROCESS_PROJECTS:
-            self._process_projects(self.instance, last_project_id)
-        if PROCESS_GROUPS:
-            self._process_groups(self.instance, start_time, last_group_id)
+        try:
+            last_project_id = self._get_last_project_id()
+            last_group_id = self._get_last_group_id()
+
+            self._load_group_tree(self.instance.id)
+            with bulk_load(self.instance.id, self._is_bulk_load(run)):
+                checkpoint = self._get_checkpoint(run, checkpoints, 'groups') if PROCESS_GROUPS else None
+                if checkpoint:
+                    self._process_groups_stage(checkpoint, start_time, last_group_id)
+                processed = set()
+                partitions = self._get_project_partitions(run, checkpoints, last_project_id) if PROCESS_PROJECTS else []
+                if partitions:
+                    processed = self._process_projects_stage(partitions, last_project_id, last_activity_after)
+                if PROCESS_PROJECTS and last_activity_after and datetime.now().isoweekday() == FULL_UPDATE_DAY:
+                    checkpoint = self._get_checkpoint(run, checkpoints, 'sweep')
+                    if checkpoint:
+                        self._sweep_projects_stage(checkpoint, processed)
+                flush_write_buffers()
+            self._log_api_calls()
+        except Exception:
+            finish_inventory_run(run, 'failed')
+            raise
+        finish_inventory_run(run, 'dry_run' if DRY_RUN else 'completed')
+        if not DRY_RUN:
+            self.sweep_unseen(run)
 
         end_time = datetime.now()
 
         logger.info(
-            f"'{self.instance.url}': {PROJECT_WORKERS_COUNT} workers processed {last_project_id} projects and {last_group_id} groups in {end_time - start_time}")
+            f"'{self.instance.url}': {self.workers_count} workers processed {last_project_id} projects and {last_group_id} groups in {end_time - start_time}")
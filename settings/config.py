@@ -1,11 +1,12 @@
 import os
 import threading
 
-import requests
 import urllib3
 from distutils.util import strtobool
 from requests.adapters import HTTPAdapter
 
+from utils.rate_limiter import RateLimitedSession
+
 
 inventory_lock = threading.Lock()
 fast_inventory_lock = threading.Lock()
@@ -14,12 +15,20 @@ urllib3.disable_warnings()
 
 ENVIRONMENT = os.getenv('ENVIRONMENT', 'DEV')
 FAST_INVENTORY_INTERVAL = int(os.getenv('FAST_INVENTORY_INTERVAL', default=1))
+FAST_INVENTORY_MAX_PROJECTS = int(os.getenv('FAST_INVENTORY_MAX_PROJECTS', default=1000))
+BITBUCKET_FAST_INVENTORY_INTERVAL = int(os.getenv('BITBUCKET_FAST_INVENTORY_INTERVAL', default=60))
 START_TIME = os.getenv('START_TIME', '09:45')
 CONTAINER_NAME = os.getenv('CONTAINER_NAME', 'sg-images-inventory')
 DEBUG_ENABLED = strtobool(os.getenv('DEBUG_ENABLED', default='False'))
 DEBUG_LAST_ID = int(os.getenv('DEBUG_LAST_ID', default=0))
 LOG_LEVEL = os.getenv('LOG_LEVEL', default='INFO')
 INSERT_CHUNK_SIZE = int(os.getenv('INSERT_CHUNK_SIZE', default=50000))
+WRITE_BUFFER_ENABLED = strtobool(os.getenv('WRITE_BUFFER_ENABLED', default='True'))
+WRITE_BUFFER_SIZE = int(os.getenv('WRITE_BUFFER_SIZE', default=1000))
+WRITE_BUFFER_FLUSH_INTERVAL = float(os.getenv('WRITE_BUFFER_FLUSH_INTERVAL', default=30))
+SKIP_UNCHANGED_ROWS = strtobool(os.getenv('SKIP_UNCHANGED_ROWS', default='True'))
+LAST_SEEN_RESOLUTION_HOURS = float(os.getenv('LAST_SEEN_RESOLUTION_HOURS', default=24))
+BULK_LOAD_ENABLED = strtobool(os.getenv('BULK_LOAD_ENABLED', default='False'))
 
 DRY_RUN = strtobool(os.getenv('DRY_RUN', default='False'))
 
@@ -28,13 +37,46 @@ PROCESS_GROUPS = strtobool(os.getenv('PROCESS_GROUPS', default='True'))
 PROCESS_REGISTRIES = strtobool(os.getenv('PROCESS_REGISTRIES', default='False'))
 PROCESS_USERS = strtobool(os.getenv('PROCESS_USERS', default='False'))
 SKIP_SCANNED = strtobool(os.getenv('SKIP_SCANNED', default='False'))
+LEAN_PROJECT_ENRICHMENT = strtobool(os.getenv('LEAN_PROJECT_ENRICHMENT', default='True'))
 
 PROJECT_WORKERS_COUNT = int(os.getenv('PROJECT_WORKERS_COUNT', default=20))
 GROUP_WORKERS_COUNT = int(os.getenv('GROUP_WORKERS_COUNT', default=10))
+LISTING_WORKERS_COUNT = int(os.getenv('LISTING_WORKERS_COUNT', default=4))
+INSTANCE_WORKERS_COUNT = int(os.getenv('INSTANCE_WORKERS_COUNT', default=2))
+WORK_QUEUE_SIZE = int(os.getenv('WORK_QUEUE_SIZE', default=1000))
+ASYNC_MAX_CONCURRENCY = int(os.getenv('ASYNC_MAX_CONCURRENCY', default=100))
+ASYNC_MAX_RETRIES = int(os.getenv('ASYNC_MAX_RETRIES', default=5))
+ASYNC_REQUEST_TIMEOUT = int(os.getenv('ASYNC_REQUEST_TIMEOUT', default=60))
 FULL_UPDATE_DAY = int(os.getenv('FULL_UPDATE_DAY', default=6))
+INCREMENTAL_INVENTORY = strtobool(os.getenv('INCREMENTAL_INVENTORY', default='True'))
+INCREMENTAL_OVERLAP_MINUTES = int(os.getenv('INCREMENTAL_OVERLAP_MINUTES', default=60))
+RESUME_INVENTORY = strtobool(os.getenv('RESUME_INVENTORY', default='True'))
+RESUME_MAX_AGE_HOURS = int(os.getenv('RESUME_MAX_AGE_HOURS', default=24))
+CHECKPOINT_INTERVAL = int(os.getenv('CHECKPOINT_INTERVAL', default=60))
+INVENTORY_ROLE = os.getenv('INVENTORY_ROLE', default='standalone')
+INVENTORY_TASK_RANGES = int(os.getenv('INVENTORY_TASK_RANGES', default=16))
+TASK_LEASE_SECONDS = int(os.getenv('TASK_LEASE_SECONDS', default=300))
+TASK_MAX_ATTEMPTS = int(os.getenv('TASK_MAX_ATTEMPTS', default=3))
+WORKER_POLL_INTERVAL = int(os.getenv('WORKER_POLL_INTERVAL', default=30))
+SWEEP_UNSEEN = strtobool(os.getenv('SWEEP_UNSEEN', default='True'))
+SWEEP_MAX_FRACTION = float(os.getenv('SWEEP_MAX_FRACTION', default=0.5))
+SWEEP_DELETE_AFTER_DAYS = int(os.getenv('SWEEP_DELETE_AFTER_DAYS', default=0))
+GROUP_MEMBERSHIP_RESOLUTION = strtobool(os.getenv('GROUP_MEMBERSHIP_RESOLUTION', default='True'))
+CACHE_CONTRIBUTORS = strtobool(os.getenv('CACHE_CONTRIBUTORS', default='True'))
+CONTRIBUTORS_FULL_REBUILD = strtobool(os.getenv('CONTRIBUTORS_FULL_REBUILD', default='False'))
+REGISTRY_TAG_REFRESH_DAYS = int(os.getenv('REGISTRY_TAG_REFRESH_DAYS', default=6))
+
+RATE_LIMIT_MAX_RPS = float(os.getenv('RATE_LIMIT_MAX_RPS', default=100))
+RATE_LIMIT_MIN_RPS = float(os.getenv('RATE_LIMIT_MIN_RPS', default=1))
+
 
-SESSION = requests.Session()
-SESSION.mount('https://', HTTPAdapter(pool_maxsize=PROJECT_WORKERS_COUNT))
+def create_session(max_rate: float = RATE_LIMIT_MAX_RPS, pool_maxsize: int = PROJECT_WORKERS_COUNT) -> RateLimitedSession:
+    session = RateLimitedSession(max_rate=max_rate, min_rate=RATE_LIMIT_MIN_RPS)
+    session.mount('https://', HTTPAdapter(pool_maxsize=pool_maxsize))
+    return session
+
+
+SESSION = create_session()
 
 # Database envs
 POSTGRES_HOST = os.getenv('POSTGRES_HOST', default='localhost')
@@ -43,3 +85,8 @@ POSTGRES_DB = os.getenv('POSTGRES_DB', default='postgres')
 POSTGRES_USER = os.getenv('POSTGRES_USER', default='postgres')
 POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD', default='postgres')
 POSTGRES_SCHEMA = os.getenv('POSTGRES_SCHEMA', default='public')
+
+DB_POOL_ENABLED = strtobool(os.getenv('DB_POOL_ENABLED', default='True'))
+DB_POOL_MAX_CONNECTIONS = int(os.getenv('DB_POOL_MAX_CONNECTIONS', default=(PROJECT_WORKERS_COUNT + GROUP_WORKERS_COUNT) * INSTANCE_WORKERS_COUNT))
+DB_POOL_STALE_TIMEOUT = int(os.getenv('DB_POOL_STALE_TIMEOUT', default=300))
+DB_POOL_WAIT_TIMEOUT = int(os.getenv('DB_POOL_WAIT_TIMEOUT', default=30))
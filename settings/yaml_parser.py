@@ -33,6 +33,16 @@ def process_yaml(settings_file=SETTINGS_FILE) -> dict:
         if vcs_instance['TYPE'] not in ('gitlab', 'bitbucket'):
             logger.critical(f"'{instance}': unsupported VCS type:'{vcs_instance['TYPE']}'! Cannot process, exitting...")
             exit(-1)
+        if vcs_instance.get('ENGINE', 'threaded') not in ('threaded', 'async'):
+            logger.critical(f"'{instance}': unsupported engine:'{vcs_instance['ENGINE']}'! Cannot process, exitting...")
+            exit(-1)
+        if vcs_instance.get('ENGINE') == 'async' and vcs_instance['TYPE'] != 'gitlab':
+            logger.critical(f"'{instance}': 'async' engine is supported only for Gitlab! Cannot process, exitting...")
+            exit(-1)
+        for key, key_type in (('WORKERS_COUNT', int), ('RATE_LIMIT_MAX_RPS', (int, float))):
+            if key in vcs_instance and (not isinstance(vcs_instance[key], key_type) or vcs_instance[key] <= 0):
+                logger.critical(f"'{instance}': {key} must be a positive number! Cannot process, exitting...")
+                exit(-1)
         logger.debug(f"'{instance}': VCS type: {vcs_instance['TYPE']}")
     logger.info(f"'{settings_file}' processed successfully!")
 
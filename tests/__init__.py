@@ -0,0 +1,4 @@
+import os
+
+# The models are bound to SQLite when the settings are imported, the tests never connect to PostgreSQL
+os.environ['DEBUG_ENABLED'] = 'True'
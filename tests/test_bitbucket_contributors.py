@@ -0,0 +1,94 @@
+import unittest
+from unittest import mock
+
+from requests.exceptions import HTTPError
+
+from parsers.bitbucket_parser import BitbucketParser
+
+REPO = {"id": 3, "slug": "repo"}
+
+
+def make_commit(commit_id, email, timestamp=1700000000000):
+    return {"id": commit_id, "author": {"emailAddress": email}, "authorTimestamp": timestamp}
+
+
+class BitbucketContributorsTest(unittest.TestCase):
+    def setUp(self):
+        self.parser = BitbucketParser.__new__(BitbucketParser)
+        self.parser.instance = mock.Mock(id=1)
+        self.parser._conn = mock.Mock()
+        self.parser._contributors_states = {}
+
+        patcher = mock.patch('parsers.bitbucket_parser.store_repository_contributors')
+        self.store = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('parsers.bitbucket_parser.CONTRIBUTORS_FULL_REBUILD', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_commits_are_counted_per_author(self):
+        self.parser._conn.get_commits.return_value = iter([
+            make_commit("c3", "a@example.com"), make_commit("c2", "b@example.com"), make_commit("c1", "a@example.com")])
+
+        contributors, head_commit = self.parser._count_commits("PRJ", REPO, None)
+
+        self.assertEqual(head_commit["id"], "c3")
+        self.assertEqual({row["email"]: row["commits"] for row in contributors.values()},
+                         {"a@example.com": 2, "b@example.com": 1})
+
+    def test_repository_without_commits_has_no_head(self):
+        self.parser._conn.get_commits.return_value = iter([])
+
+        self.assertEqual(self.parser._count_commits("PRJ", REPO, None), ({}, None))
+
+    def test_new_repository_is_fully_counted(self):
+        self.parser._conn.get_commits.return_value = iter([make_commit("c1", "a@example.com")])
+
+        self.parser._process_repository_contributors("PRJ", REPO)
+
+        self.parser._conn.get_commits.assert_called_once_with("PRJ", "repo", hash_oldest=None, limit=1000)
+        contributors, state = self.store.call_args.args
+        self.assertEqual(state["head_sha"], "c1")
+        self.assertFalse(self.store.call_args.kwargs["increment"])
+
+    def test_only_new_commits_are_counted(self):
+        self.parser._contributors_states[3] = {"head_sha": "c1"}
+        self.parser._conn.get_commits.return_value = iter([make_commit("c2", "a@example.com")])
+
+        self.parser._process_repository_contributors("PRJ", REPO)
+
+        self.parser._conn.get_commits.assert_called_once_with("PRJ", "repo", hash_oldest="c1", limit=1000)
+        self.assertEqual(self.store.call_args.args[1]["head_sha"], "c2")
+        self.assertTrue(self.store.call_args.kwargs["increment"])
+
+    def test_nothing_is_written_without_new_commits(self):
+        self.parser._contributors_states[3] = {"head_sha": "c1"}
+        self.parser._conn.get_commits.return_value = iter([])
+
+        self.parser._process_repository_contributors("PRJ", REPO)
+
+        self.store.assert_not_called()
+
+    def test_lost_commit_falls_back_to_full_recount(self):
+        self.parser._contributors_states[3] = {"head_sha": "gone"}
+        self.parser._conn.get_commits.side_effect = [HTTPError("404"), iter([make_commit("c5", "a@example.com")])]
+
+        self.parser._process_repository_contributors("PRJ", REPO)
+
+        self.assertIsNone(self.parser._conn.get_commits.call_args.kwargs["hash_oldest"])
+        self.assertEqual(self.store.call_args.args[1]["head_sha"], "c5")
+        self.assertFalse(self.store.call_args.kwargs["increment"])
+
+    def test_full_rebuild_ignores_the_stored_state(self):
+        self.parser._contributors_states[3] = {"head_sha": "c1"}
+        self.parser._conn.get_commits.return_value = iter([make_commit("c2", "a@example.com")])
+
+        with mock.patch('parsers.bitbucket_parser.CONTRIBUTORS_FULL_REBUILD', True):
+            self.parser._process_repository_contributors("PRJ", REPO)
+
+        self.assertIsNone(self.parser._conn.get_commits.call_args.kwargs["hash_oldest"])
+        self.assertFalse(self.store.call_args.kwargs["increment"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import unittest
+from unittest import mock
+
+import parsers.bitbucket_parser as bitbucket_parser
+from parsers.bitbucket_parser import BitbucketParser
+from utils.memo import Memo
+
+
+def make_repo(repo_id):
+    return {
+        "id": repo_id,
+        "slug": f"repo-{repo_id}",
+        "public": False,
+        "description": "not used by the parser",
+        "project": {"id": 7, "key": "PRJ", "name": "Project"},
+        "links": {"self": [{"href": f"https://bitbucket.invalid/projects/PRJ/repos/repo-{repo_id}/browse"}],
+                  "clone": [{"href": f"https://bitbucket.invalid/scm/prj/repo-{repo_id}.git"},
+                            {"href": f"ssh://git@bitbucket.invalid/prj/repo-{repo_id}.git"}]}
+    }
+
+
+class BitbucketReposTest(unittest.TestCase):
+    def setUp(self):
+        self.parser = BitbucketParser.__new__(BitbucketParser)
+        self.parser._conn = mock.Mock()
+        self.parser._conn.repo_list.side_effect = lambda project_key, limit: iter([make_repo(1), make_repo(2)])
+        self.parser._repos = Memo()
+
+    def test_repositories_are_listed_once_per_project(self):
+        first = self.parser._get_repos("PRJ")
+        second = self.parser._get_repos("PRJ")
+
+        self.assertIs(first, second)
+        self.parser._conn.repo_list.assert_called_once_with("PRJ", limit=1000)
+
+    def test_projects_are_listed_separately(self):
+        self.parser._get_repos("PRJ")
+        self.parser._get_repos("OTHER")
+
+        self.assertEqual(self.parser._conn.repo_list.call_count, 2)
+
+    def test_repositories_keep_only_the_used_fields(self):
+        repo = self.parser._get_repos("PRJ")[0]
+
+        self.assertEqual(set(repo), {"id", "slug", "public", "project", "links"})
+        self.assertEqual(repo["project"], {"id": 7})
+        self.assertEqual(len(repo["links"]["clone"]), 1)
+
+    def test_failed_listing_is_retried(self):
+        self.parser._conn.repo_list.side_effect = [RuntimeError("boom"), iter([make_repo(1)])]
+
+        with self.assertRaises(RuntimeError):
+            self.parser._get_repos("PRJ")
+        self.assertEqual([repo["id"] for repo in self.parser._get_repos("PRJ")], [1])
+
+
+class BitbucketFastInventoryTest(unittest.TestCase):
+    def setUp(self):
+        self.parser = BitbucketParser.__new__(BitbucketParser)
+        self.parser.instance = mock.Mock(id=1, url="https://bitbucket.invalid")
+        self.parser.workers_count = 1
+        self.parser._conn = mock.Mock()
+        self.parser._conn.get.return_value = {'values': [make_repo(1), make_repo(2), make_repo(3)],
+                                              'isLastPage': True}
+        self.parser._conn.project_list.return_value = iter([{'id': 7, 'public': False, 'links': {
+            'self': [{'href': "https://bitbucket.invalid/projects/PRJ"}]}}, {'id': 8, 'public': True, 'links': {
+                'self': [{'href': "https://bitbucket.invalid/projects/NEW"}]}}])
+        self.scheduler = mock.Mock()
+        scheduler_class = mock.MagicMock()
+        scheduler_class.return_value.__enter__.return_value = self.scheduler
+
+        patches = {
+            'get_inventoried_projects_with_parents': mock.Mock(return_value=([1, 2], {
+                1: {'path': "projects/PRJ/repos/repo-1/browse"}, 2: {'path': "projects/OLD/repos/repo-2/browse"}})),
+            'fetch_groups': mock.Mock(return_value=[mock.Mock(vcs_id=7)]),
+            'insert_groups': mock.DEFAULT,
+            'flush_write_buffers': mock.DEFAULT,
+            'FairScheduler': scheduler_class,
+            'last_crawls': {},
+        }
+        for name, value in patches.items():
+            patcher = mock.patch.object(bitbucket_parser, name, value)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def submitted(self):
+        return [call.args[3]['id'] for call in self.scheduler.submit.call_args_list]
+
+    def test_new_and_moved_repositories_are_processed(self):
+        self.parser.process_new_projects(1)
+
+        self.assertEqual(self.submitted(), [2, 3])
+        self.assertEqual(self.scheduler.submit.call_args.args[:3], ("PRJ", self.parser._process_repository, "PRJ"))
+
+    def test_new_projects_are_inserted(self):
+        self.parser.process_new_groups(1)
+
+        self.assertEqual(list(self.insert_groups.call_args.args[0]), [8])
+
+    def test_listings_are_skipped_within_the_interval(self):
+        self.parser.process_new_groups(1)
+        self.parser.process_new_projects(1)
+        self.parser.process_new_groups(1)
+        self.parser.process_new_projects(1)
+
+        self.parser._conn.project_list.assert_called_once()
+        self.parser._conn.get.assert_called_once()
+        self.assertEqual(self.submitted(), [2, 3])
+
+        with mock.patch.object(bitbucket_parser, 'BITBUCKET_FAST_INVENTORY_INTERVAL', 0):
+            self.parser.process_new_projects(1)
+        self.assertEqual(self.parser._conn.get.call_count, 2)
+
+    def test_listings_of_other_instances_are_not_skipped(self):
+        self.parser.process_new_projects(1)
+        self.parser.process_new_projects(2)
+
+        self.assertEqual(self.parser._conn.get.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+from unittest import mock
+
+from utils.checkpoint import ListingCheckpoint
+
+
+class ListingCheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        for name in ('flush_write_buffers', 'save_inventory_checkpoint'):
+            patcher = mock.patch(f'utils.checkpoint.{name}',
+                                 side_effect=lambda *args, name=name, **kwargs: self.calls.append((name, args)))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def saved(self):
+        return [args for name, args in self.calls if name == 'save_inventory_checkpoint']
+
+    def test_resumes_before_stored_cursor(self):
+        checkpoint = ListingCheckpoint(1, 'projects', cursor=100, interval=60)
+
+        self.assertEqual(checkpoint.list_filters(), {'id_before': 100})
+        self.assertTrue(checkpoint.is_done(100))
+        self.assertFalse(checkpoint.is_done(99))
+        self.assertEqual(ListingCheckpoint(1, 'projects', interval=60).list_filters(), {})
+
+    def test_cursor_stays_above_unfinished_items(self):
+        checkpoint = ListingCheckpoint(1, 'projects', interval=60)
+        for item_id in (100, 90, 80):
+            checkpoint.add(item_id)
+
+        checkpoint.done(90)
+        checkpoint.save()
+        checkpoint.done(100)
+        checkpoint.save()
+        checkpoint.done(80)
+        checkpoint.save(is_completed=True)
+
+        self.assertEqual(self.saved(), [(1, 'projects', 101, False), (1, 'projects', 81, False),
+                                        (1, 'projects', 80, True)])
+
+    def test_item_is_unfinished_until_its_last_task_is_done(self):
+        checkpoint = ListingCheckpoint(1, 'projects', interval=60)
+        checkpoint.add(100)
+        checkpoint.add(100)
+        checkpoint.add(90)
+
+        checkpoint.done(100)
+        checkpoint.done(90)
+        checkpoint.save()
+        checkpoint.done(100)
+        checkpoint.save()
+
+        self.assertEqual(self.saved(), [(1, 'projects', 101, False), (1, 'projects', 90, False)])
+
+    def test_buffers_are_flushed_before_cursor_is_stored(self):
+        checkpoint = ListingCheckpoint(1, 'projects', interval=60)
+        checkpoint.add(100)
+        checkpoint.done(100)
+        checkpoint.save()
+
+        self.assertEqual([name for name, _ in self.calls], ['flush_write_buffers', 'save_inventory_checkpoint'])
+
+    def test_unchanged_cursor_is_not_stored_again(self):
+        checkpoint = ListingCheckpoint(1, 'projects', interval=60)
+        checkpoint.add(100)
+        checkpoint.done(100)
+        checkpoint.save()
+        checkpoint.save()
+
+        self.assertEqual(len(self.saved()), 1)
+
+    def test_cursor_is_stored_once_interval_passed(self):
+        checkpoint = ListingCheckpoint(1, 'projects', interval=0)
+        checkpoint.add(100)
+        checkpoint.add(90)
+        checkpoint.done(100)
+
+        self.assertEqual(self.saved(), [(1, 'projects', 91, False)])
+
+
+if __name__ == '__main__':
+    unittest.main()
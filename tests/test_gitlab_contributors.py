@@ -0,0 +1,146 @@
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import peewee
+
+import db.db_utils as db_utils
+from db.db_utils import store_repository_contributors
+from db.models import VCSInstance, Contributor, ContributorsState, database_proxy
+from parsers.gitlab_parser import GitLabParser
+from utils.memo import Memo
+from utils.metrics import Metrics
+
+LAST_ACTIVITY_AT = '2024-01-02T00:00:00.000Z'
+
+
+def make_project(head_sha='abc', last_activity_at=LAST_ACTIVITY_AT):
+    project = mock.Mock(id=5, last_activity_at=last_activity_at)
+    project.commits.list.return_value = [mock.Mock(id=head_sha, committed_date=last_activity_at)]
+    project.repository_contributors.return_value = [
+        {'email': 'dev@example.com', 'commits': 3, 'additions': 0, 'deletions': 0}]
+    return project
+
+
+class GitLabContributorsTest(unittest.TestCase):
+    def setUp(self):
+        self.parser = GitLabParser.__new__(GitLabParser)
+        self.parser.instance = mock.Mock(id=1)
+        self.parser.metrics = Metrics("test")
+        self.parser._head_commits = Memo()
+        self.parser._contributors_states = None
+        self.parser._contributors_states_lock = threading.Lock()
+
+        self.states = {}
+        for name, target in (('fetch_contributors_states', lambda instance_id: self.states),
+                             ('store_repository_contributors', mock.DEFAULT),
+                             ('insert_contributors_states', mock.DEFAULT)):
+            patcher = mock.patch(f'parsers.gitlab_parser.{name}',
+                                 side_effect=None if target is mock.DEFAULT else target)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        for name, value in (('CACHE_CONTRIBUTORS', True), ('LEAN_PROJECT_ENRICHMENT', False)):
+            patcher = mock.patch(f'parsers.gitlab_parser.{name}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def stored_state(self):
+        if self.store_repository_contributors.called:
+            return self.store_repository_contributors.call_args.args[1]
+        return self.insert_contributors_states.call_args.args[0][5]
+
+    def test_new_repository_contributors_are_computed(self):
+        project = make_project()
+        self.parser._process_project_contributors(project, 1)
+
+        project.repository_contributors.assert_called_once()
+        self.insert_contributors_states.assert_not_called()
+        contributors, state = self.store_repository_contributors.call_args.args
+        self.assertEqual(contributors, {'5dev@example.com': {
+            'email': 'dev@example.com', 'commits': 3, 'additions': 0, 'deletions': 0, 'vcs_instance_id': 1,
+            'repo_id': 5}})
+        self.assertEqual(state['head_sha'], 'abc')
+        self.assertFalse(self.store_repository_contributors.call_args.kwargs['increment'])
+
+    def test_contributors_are_skipped_while_head_is_unchanged(self):
+        self.states[5] = {'head_sha': 'abc', 'last_activity_at': datetime(2024, 1, 1)}
+        project = make_project()
+        self.parser._process_project_contributors(project, 1)
+
+        project.repository_contributors.assert_not_called()
+        self.store_repository_contributors.assert_not_called()
+        self.assertEqual(self.parser.metrics.get("contributors_skipped"), 1)
+        self.assertEqual(self.stored_state()['last_activity_at'], datetime(2024, 1, 2))
+
+    def test_contributors_are_recomputed_once_head_moved(self):
+        self.states[5] = {'head_sha': 'old', 'last_activity_at': datetime(2024, 1, 1)}
+        project = make_project()
+        self.parser._process_project_contributors(project, 1)
+
+        project.repository_contributors.assert_called_once()
+        self.assertEqual(self.stored_state()['head_sha'], 'abc')
+
+    def test_inactive_repository_is_skipped_without_requesting_head(self):
+        self.states[5] = {'head_sha': 'old', 'last_activity_at': datetime(2024, 1, 2)}
+        project = make_project()
+        with mock.patch('parsers.gitlab_parser.LEAN_PROJECT_ENRICHMENT', True):
+            self.parser._process_project_contributors(project, 1)
+
+        project.commits.list.assert_not_called()
+        project.repository_contributors.assert_not_called()
+        self.insert_contributors_states.assert_not_called()
+
+    def test_cache_can_be_disabled(self):
+        self.states[5] = {'head_sha': 'abc', 'last_activity_at': datetime(2024, 1, 2)}
+        project = make_project()
+        with mock.patch('parsers.gitlab_parser.CACHE_CONTRIBUTORS', False):
+            self.parser._process_project_contributors(project, 1)
+
+        project.repository_contributors.assert_called_once()
+
+
+class StoreRepositoryContributorsTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        self.database = peewee.SqliteDatabase(self.path)
+        patcher = mock.patch.object(db_utils, 'database', self.database)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(os.remove, self.path)
+        db_utils.init_db(self.database, [VCSInstance, Contributor, ContributorsState])
+        self.addCleanup(database_proxy.initialize, None)
+        with self.database:
+            self.instance = VCSInstance.create(url="https://gitlab.example.com", type='gitlab', mnemonic='gitlab')
+
+    def store(self, head_sha, commits, additions, increment):
+        contributor = {'email': 'dev@example.com', 'commits': commits, 'additions': additions, 'deletions': 1,
+                       'vcs_instance_id': self.instance.id, 'repo_id': 5}
+        state = {'vcs_instance_id': self.instance.id, 'repo_id': 5, 'head_sha': head_sha, 'last_activity_at': None,
+                 'computed_at': datetime.now()}
+        store_repository_contributors({'5dev@example.com': contributor}, state, increment)
+
+    def stored(self):
+        with self.database:
+            contributor = Contributor.get()
+            return (contributor.commits, contributor.additions, contributor.deletions,
+                    ContributorsState.get().head_sha)
+
+    def test_counts_are_replaced_with_the_state(self):
+        self.store('abc', 3, 10, increment=False)
+        self.store('def', 4, 12, increment=False)
+
+        self.assertEqual(self.stored(), (4, 12, 1, 'def'))
+
+    def test_counts_are_incremented_with_the_state(self):
+        self.store('abc', 3, 10, increment=False)
+        self.store('def', 2, 5, increment=True)
+
+        self.assertEqual(self.stored(), (5, 15, 2, 'def'))
+
+
+if __name__ == '__main__':
+    unittest.main()
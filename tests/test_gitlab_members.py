@@ -0,0 +1,100 @@
+import unittest
+from unittest import mock
+
+from parsers.gitlab_parser import GitLabParser
+from utils.group_tree import GroupTree
+from utils.memo import Memo
+from utils.metrics import Metrics
+
+GUEST, REPORTER, DEVELOPER, MAINTAINER, OWNER = 10, 20, 30, 40, 50
+
+
+def member(user_id, access_level):
+    return {'id': user_id, 'username': f"user-{user_id}", 'access_level': access_level}
+
+
+class MergeMembersTest(unittest.TestCase):
+    def test_highest_access_level_is_kept(self):
+        members = {}
+        GitLabParser._merge_members(members, [member(1, DEVELOPER), member(2, MAINTAINER)])
+        GitLabParser._merge_members(members, [member(1, MAINTAINER), member(2, REPORTER)])
+
+        self.assertEqual({user_id: user['access_level'] for user_id, user in members.items()},
+                         {1: MAINTAINER, 2: MAINTAINER})
+
+    def test_access_level_is_capped_by_the_share(self):
+        members = {1: member(1, REPORTER)}
+        GitLabParser._merge_members(members, [member(1, OWNER), member(2, GUEST)], max_access_level=DEVELOPER)
+
+        self.assertEqual(members, {1: member(1, DEVELOPER), 2: member(2, GUEST)})
+
+
+class ResolveProjectMembersTest(unittest.TestCase):
+    """
+    Group tree: 1 (root) > 2 (namespace of the project), 3 and 4 are root groups shared with the project and with
+    group 1 respectively.
+    """
+
+    def setUp(self):
+        self.parser = GitLabParser.__new__(GitLabParser)
+        self.parser.metrics = Metrics("test")
+        self.parser.group_tree = GroupTree()
+        for group_id, parent_id in ((1, None), (2, 1), (3, None), (4, None)):
+            self.parser.group_tree.add(group_id, parent_id, f"group-{group_id}")
+        self.parser._group_direct_members = Memo()
+        self.parser._group_shares = Memo()
+        self.parser._group_members = Memo()
+        self.parser._count_api_call = mock.Mock()
+
+        self.direct_members = {1: [member(1, OWNER), member(2, REPORTER)], 2: [member(3, DEVELOPER)],
+                               3: [member(4, OWNER)], 4: [member(5, MAINTAINER), member(2, OWNER)]}
+        self.shares = {1: [(4, DEVELOPER)], 2: [], 3: [], 4: []}
+        self.parser._fetch_group_direct_members = mock.Mock(side_effect=lambda group_id: self.direct_members[group_id])
+        self.parser._fetch_group_shares = mock.Mock(side_effect=lambda group_id: self.shares[group_id])
+
+    def make_project(self, members, namespace_id=2, shared_with_groups=({'group_id': 3, 'group_access_level': GUEST},)):
+        project = mock.Mock(path="group-1/group-2/project", namespace={'kind': 'group', 'id': namespace_id},
+                            shared_with_groups=list(shared_with_groups))
+        project.attributes = {'shared_with_groups': project.shared_with_groups}
+        project.members.list.return_value = [mock.Mock(attributes=project_member) for project_member in members]
+        return project
+
+    def resolve(self, project):
+        members = self.parser._resolve_project_members(project)
+        return None if members is None else {user['id']: user['access_level'] for user in members}
+
+    def test_members_are_inherited_from_ancestors_and_shared_groups(self):
+        self.assertEqual(self.resolve(self.make_project([member(6, REPORTER)])), {
+            1: OWNER,  # root group
+            2: DEVELOPER,  # reporter in the root group, owner of group 4 shared with the root group as developer
+            3: DEVELOPER,  # namespace group
+            4: GUEST,  # group 3 shared with the project as guest
+            5: DEVELOPER,  # group 4 shared with the root group as developer
+            6: REPORTER,  # direct member of the project
+        })
+
+    def test_direct_membership_raises_inherited_access(self):
+        members = self.resolve(self.make_project([member(3, MAINTAINER), member(1, GUEST)]))
+
+        self.assertEqual((members[3], members[1]), (MAINTAINER, OWNER))
+
+    def test_group_members_are_requested_once(self):
+        self.resolve(self.make_project([]))
+        self.resolve(self.make_project([], namespace_id=1, shared_with_groups=()))
+
+        self.assertEqual(sorted(call.args[0] for call in self.parser._fetch_group_direct_members.call_args_list),
+                         [1, 2, 3, 4])
+        self.assertEqual(sorted(call.args[0] for call in self.parser._fetch_group_shares.call_args_list), [1, 2])
+
+    def test_unresolvable_projects_fall_back_to_all_members(self):
+        self.assertIsNone(self.resolve(self.make_project([], namespace_id=99)))
+        self.assertIsNone(self.resolve(self.make_project([], shared_with_groups=(
+            {'group_id': 99, 'group_access_level': GUEST},))))
+
+        user_project = self.make_project([])
+        user_project.namespace = {'kind': 'user', 'id': 7}
+        self.assertIsNone(self.resolve(user_project))
+
+
+if __name__ == '__main__':
+    unittest.main()
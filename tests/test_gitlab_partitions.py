@@ -0,0 +1,80 @@
+import unittest
+from unittest import mock
+
+from parsers.gitlab_parser import GitLabParser
+
+
+class SplitIdSpaceTest(unittest.TestCase):
+    def assert_covers(self, last_id, count):
+        ranges = GitLabParser._split_id_space(last_id, count)
+        filters = [GitLabParser._get_range_filters(lower_bound, upper_bound) for lower_bound, upper_bound in ranges]
+
+        self.assertEqual(len(ranges), count)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertIsNone(ranges[-1][1])
+        # every ID, including the ones created after the split, is listed by exactly one range
+        for project_id in range(1, last_id + count + 100):
+            matching = [range_filters for range_filters in filters if range_filters['id_after'] < project_id and
+                        project_id < range_filters.get('id_before', float('inf'))]
+            self.assertEqual(len(matching), 1, f"id {project_id} of {ranges}")
+
+    def test_ranges_cover_the_id_space(self):
+        for last_id, count in ((1000, 4), (1001, 4), (999, 3), (7, 7), (1, 1), (1000, 1)):
+            with self.subTest(last_id=last_id, count=count):
+                self.assert_covers(last_id, count)
+
+    def test_more_ranges_than_ids(self):
+        self.assert_covers(3, 8)
+        self.assertEqual(GitLabParser._split_id_space(3, 8)[:2], [(0, 1), (1, 2)])
+
+    def test_empty_instance(self):
+        self.assert_covers(0, 4)
+        self.assertEqual(GitLabParser._split_id_space(0, 2), [(0, 1), (1, None)])
+
+    def test_range_filters(self):
+        self.assertEqual(GitLabParser._get_range_filters(0, 250), {'id_after': 0, 'id_before': 251})
+        self.assertEqual(GitLabParser._get_range_filters(250, None), {'id_after': 250})
+
+
+class ProjectPartitionsTest(unittest.TestCase):
+    def setUp(self):
+        self.parser = GitLabParser.__new__(GitLabParser)
+        self.run = mock.Mock(id=3)
+        patcher = mock.patch('parsers.gitlab_parser.save_inventory_checkpoint')
+        self.save_inventory_checkpoint = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_partitions(self, checkpoints, workers_count=4, last_project_id=99):
+        with mock.patch('parsers.gitlab_parser.LISTING_WORKERS_COUNT', workers_count):
+            partitions = self.parser._get_project_partitions(self.run, checkpoints, last_project_id)
+        return [(checkpoint.stage, checkpoint.resumed_from, range_filters) for checkpoint, range_filters in partitions]
+
+    def test_new_run_is_split_into_ranges(self):
+        self.assertEqual(self.get_partitions({}), [
+            ('projects.0', None, {'id_after': 0, 'id_before': 26}),
+            ('projects.25', None, {'id_after': 25, 'id_before': 51}),
+            ('projects.50', None, {'id_after': 50, 'id_before': 76}),
+            ('projects.75', None, {'id_after': 75}),
+        ])
+        self.assertEqual([call.args for call in self.save_inventory_checkpoint.call_args_list],
+                         [(3, 'projects.0', None), (3, 'projects.25', None), (3, 'projects.50', None),
+                          (3, 'projects.75', None)])
+
+    def test_resumed_run_keeps_its_ranges(self):
+        checkpoints = {'groups': {'is_completed': True}, 'projects.0': {'cursor': 20},
+                       'projects.30': {'is_completed': True}, 'projects.60': {}}
+
+        partitions = self.get_partitions(checkpoints, last_project_id=500)
+
+        self.assertEqual(partitions, [('projects.0', 20, {'id_after': 0, 'id_before': 31}),
+                                      ('projects.60', None, {'id_after': 60})])
+        self.save_inventory_checkpoint.assert_not_called()
+
+    def test_single_listing(self):
+        self.assertEqual(self.get_partitions({}, workers_count=1), [('projects', None, {})])
+        self.assertEqual(self.get_partitions({'projects': {'cursor': 40}}), [('projects', 40, {})])
+        self.assertEqual(self.get_partitions({'projects': {'is_completed': True}}), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
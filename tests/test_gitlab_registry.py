@@ -0,0 +1,77 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from parsers.gitlab_parser import GitLabParser
+from utils.metrics import Metrics
+
+LOCATION = "registry.example.com/group/project:latest"
+
+
+def make_indexed_tag(digest="sha256:1", image=LOCATION, checked_ago=timedelta(days=1)):
+    return {'digest': digest, 'image': image, 'last_time_checked': datetime.now() - checked_ago}
+
+
+class TagNeedsDetailsTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch('parsers.gitlab_parser.FULL_UPDATE_DAY', (datetime.now().isoweekday() % 7) + 1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def needs_details(self, tag_attrs, indexed_tag):
+        return GitLabParser._tag_needs_details(tag_attrs, indexed_tag)
+
+    def test_new_tag_and_tag_without_digest_are_fetched(self):
+        self.assertTrue(self.needs_details({'location': LOCATION}, None))
+        self.assertTrue(self.needs_details({'location': LOCATION}, make_indexed_tag(digest=None)))
+
+    def test_moved_tag_is_fetched(self):
+        self.assertTrue(self.needs_details({'location': "registry.example.com/other/project:latest"},
+                                           make_indexed_tag()))
+
+    def test_retagged_image_is_fetched_when_listing_has_digest(self):
+        self.assertTrue(self.needs_details({'location': LOCATION, 'digest': "sha256:2"}, make_indexed_tag()))
+        self.assertFalse(self.needs_details({'location': LOCATION, 'digest': "sha256:1"}, make_indexed_tag()))
+
+    def test_unchanged_tag_is_skipped_until_full_update_day(self):
+        indexed_tag = make_indexed_tag(checked_ago=timedelta(days=30))
+        self.assertFalse(self.needs_details({'location': LOCATION}, indexed_tag))
+
+        with mock.patch('parsers.gitlab_parser.FULL_UPDATE_DAY', datetime.now().isoweekday()):
+            self.assertTrue(self.needs_details({'location': LOCATION}, indexed_tag))
+            self.assertFalse(self.needs_details({'location': LOCATION}, make_indexed_tag()))
+
+
+class ProcessRegistryTagsTest(unittest.TestCase):
+    def setUp(self):
+        self.parser = GitLabParser.__new__(GitLabParser)
+        self.parser.metrics = Metrics("test")
+        self.parser._count_api_call = mock.Mock()
+        self.parser._create_image_tag_dict = lambda tag, instance_id: {'image': tag.location}
+        for name in ('fetch_tags', 'touch_images', 'insert_images'):
+            patcher = mock.patch(f'parsers.gitlab_parser.{name}')
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def test_only_changed_tags_are_fetched(self):
+        tags = [mock.Mock(path=f"project:{name}", location=f"registry.example.com/project:{name}",
+                          attributes={'location': f"registry.example.com/project:{name}", 'digest': "sha256:1"})
+                for name in ("old", "new", "broken")]
+        for tag in tags:
+            tag.name = tag.path.split(":")[1]
+        self.fetch_tags.return_value = {"project:old": make_indexed_tag(image="registry.example.com/project:old")}
+        registry = mock.Mock()
+        registry.tags.list.return_value = iter(tags)
+        registry.tags.get.side_effect = [tags[1], Exception("500 Server Error")]
+
+        self.parser._process_registry_tags(registry, 1)
+
+        self.assertEqual([call.args[2] for call in self.touch_images.call_args_list],
+                         [["project:old"], ["project:broken"]])
+        self.insert_images.assert_called_once_with({"registry.example.com/project:new": {
+            'image': "registry.example.com/project:new"}})
+        self.assertEqual(self.parser.metrics.get("registry_tags_skipped"), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
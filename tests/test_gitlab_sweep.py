@@ -0,0 +1,69 @@
+import unittest
+from unittest import mock
+
+from parsers.gitlab_parser import GitLabParser
+from utils.checkpoint import ListingCheckpoint
+from utils.metrics import Metrics
+
+
+class GitLabSweepTest(unittest.TestCase):
+    def setUp(self):
+        self.parser = GitLabParser.__new__(GitLabParser)
+        self.parser.instance = mock.Mock(id=1)
+        self.parser.metrics = Metrics("test")
+        self.parser.workers_count = 1
+        self.parser.gl = mock.Mock()
+        self.parser._submit_project = mock.Mock()
+        self.checkpoint = ListingCheckpoint(1, 'sweep', cursor=100, interval=60)
+
+        self.touched = []
+        patches = {
+            'get_inventoried_projects_with_parents': mock.Mock(return_value=(
+                [30, 10], {30: {'path': 'group/thirty'}, 10: {'path': 'group/ten'}})),
+            'touch_repositories': mock.Mock(side_effect=lambda instance_id, ids: self.touched.append(
+                (list(ids), self.checkpoint._cursor()))),
+            'PROCESS_USERS': False,
+        }
+        for name, value in patches.items():
+            patcher = mock.patch(f'parsers.gitlab_parser.{name}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for name in ('flush_write_buffers', 'save_inventory_checkpoint'):
+            patcher = mock.patch(f'utils.checkpoint.{name}')
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def list_projects(self, *projects):
+        self.parser.gl.projects.list.return_value = iter(
+            [mock.Mock(id=project_id, path_with_namespace=path) for project_id, path in projects])
+        self.parser.gl.projects.get.side_effect = lambda project_id: mock.Mock(id=project_id)
+
+    def test_sweep_resumes_with_keyset_pagination(self):
+        self.list_projects()
+
+        self.parser._sweep_projects(self.parser.instance, set(), self.checkpoint)
+
+        self.parser.gl.projects.list.assert_called_once_with(order_by='id', sort='desc', pagination='keyset',
+                                                             iterator=True, simple=True, id_before=100)
+
+    def test_cursor_does_not_pass_unchanged_projects_before_they_are_touched(self):
+        self.list_projects((30, 'group/thirty'), (20, 'group/twenty'), (10, 'group/ten'))
+
+        self.parser._sweep_projects(self.parser.instance, set(), self.checkpoint)
+
+        self.assertEqual(self.touched, [([30, 10], 31)])
+        self.assertEqual([call.args[1].id for call in self.parser._submit_project.call_args_list], [20])
+        self.assertEqual(self.checkpoint._cursor(), 10)
+
+    def test_moved_project_is_processed(self):
+        self.list_projects((30, 'other/thirty'))
+
+        self.parser._sweep_projects(self.parser.instance, set(), self.checkpoint)
+
+        self.parser.gl.projects.get.assert_called_once_with(30)
+        self.parser._submit_project.assert_called_once()
+        self.assertEqual(self.touched, [([], 100)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+import peewee
+
+import db.db_utils as db_utils
+from db.db_utils import claim_inventory_task, enqueue_inventory_tasks, finish_inventory_run_if_done, \
+    finish_inventory_task
+from db.models import VCSInstance, InventoryRun, InventoryTask, database_proxy
+
+MODELS = [VCSInstance, InventoryRun, InventoryTask]
+
+
+class InventoryTasksTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        self.database = peewee.SqliteDatabase(self.path)
+        patcher = mock.patch.object(db_utils, 'database', self.database)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(os.remove, self.path)
+        db_utils.init_db(self.database, MODELS)
+        self.addCleanup(database_proxy.initialize, None)
+
+        with self.database:
+            instance = VCSInstance.create(url="https://gitlab.example.com", type='gitlab', mnemonic='gitlab')
+            self.run = InventoryRun.create(vcs_instance_id=instance.id, started_at=datetime.now())
+        self.instance_id = instance.id
+
+    def enqueue(self, *stages):
+        enqueue_inventory_tasks(self.run.id, self.instance_id, [{'stage': stage} for stage in stages])
+
+    def claim(self, worker_id="worker-1", lease_seconds=60, max_attempts=3):
+        return claim_inventory_task(worker_id, lease_seconds, max_attempts)
+
+    def get_task(self, stage):
+        with self.database:
+            return InventoryTask.get(InventoryTask.run_id == self.run.id, InventoryTask.stage == stage)
+
+    def expire_lease(self, stage):
+        with self.database:
+            InventoryTask.update(lease_expires_at=datetime.now() - timedelta(seconds=1)).where(
+                InventoryTask.run_id == self.run.id, InventoryTask.stage == stage).execute()
+
+    def test_tasks_are_leased_once_in_order(self):
+        self.enqueue('groups', 'projects.0')
+
+        first = self.claim("worker-1")
+        second = self.claim("worker-2")
+
+        self.assertEqual((first.stage, second.stage), ('groups', 'projects.0'))
+        self.assertIsNone(self.claim("worker-3"))
+        task = self.get_task('groups')
+        self.assertEqual((task.status, task.leased_by, task.attempts), ('leased', "worker-1", 1))
+
+    def test_expired_lease_is_claimed_again(self):
+        self.enqueue('groups')
+        self.claim("worker-1")
+        self.expire_lease('groups')
+
+        task = self.claim("worker-2")
+
+        self.assertEqual((task.stage, task.leased_by, task.attempts), ('groups', "worker-2", 2))
+        finish_inventory_task(task, "worker-1", 'done')
+        self.assertEqual(self.get_task('groups').status, 'leased')
+
+    def test_task_fails_after_max_attempts(self):
+        self.enqueue('groups')
+        self.claim(max_attempts=1)
+        self.expire_lease('groups')
+
+        self.assertIsNone(self.claim(max_attempts=1))
+        task = self.get_task('groups')
+        self.assertEqual((task.status, task.error), ('failed', 'lease expired'))
+
+    def test_sweep_waits_for_the_other_tasks(self):
+        self.enqueue('projects.0', 'sweep', 'projects.100')
+
+        first = self.claim("worker-1")
+        second = self.claim("worker-2")
+        self.assertEqual((first.stage, second.stage), ('projects.0', 'projects.100'))
+        self.assertIsNone(self.claim("worker-3"))
+
+        finish_inventory_task(first, "worker-1", 'done')
+        self.assertIsNone(self.claim("worker-3"))
+        finish_inventory_task(second, "worker-2", 'failed', "error")
+        self.assertEqual(self.claim("worker-3").stage, 'sweep')
+
+    def test_run_is_finished_once_all_tasks_are_done(self):
+        self.enqueue('groups', 'sweep')
+        groups = self.claim("worker-1")
+        self.assertIsNone(finish_inventory_run_if_done(self.run.id))
+
+        finish_inventory_task(groups, "worker-1", 'done')
+        sweep = self.claim("worker-1")
+        self.assertIsNone(finish_inventory_run_if_done(self.run.id))
+
+        finish_inventory_task(sweep, "worker-1", 'done')
+        self.assertEqual(finish_inventory_run_if_done(self.run.id), 'completed')
+        self.assertIsNone(finish_inventory_run_if_done(self.run.id))
+        with self.database:
+            self.assertEqual(InventoryRun.get_by_id(self.run.id).status, 'completed')
+
+    def test_run_fails_if_a_task_failed(self):
+        self.enqueue('groups')
+        finish_inventory_task(self.claim("worker-1"), "worker-1", 'failed', "error")
+
+        self.assertEqual(finish_inventory_run_if_done(self.run.id), 'failed')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import threading
+import unittest
+
+from utils.memo import Memo
+
+
+class MemoTest(unittest.TestCase):
+    def test_computes_each_key_once(self):
+        memo = Memo()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return "value"
+
+        self.assertEqual(memo.get("key", compute), "value")
+        self.assertEqual(memo.get("key", compute), "value")
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(memo), 1)
+
+    def test_concurrent_callers_wait_for_the_first_computation(self):
+        memo = Memo()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 42
+
+        first = threading.Thread(target=lambda: results.append(memo.get("key", compute)))
+        first.start()
+        self.assertTrue(started.wait(5))
+        second = threading.Thread(target=lambda: results.append(memo.get("key", compute)))
+        second.start()
+        release.set()
+        first.join(5)
+        second.join(5)
+
+        self.assertEqual(results, [42, 42])
+        self.assertEqual(len(calls), 1)
+
+    def test_failures_are_not_memoized(self):
+        memo = Memo()
+        attempts = []
+
+        def compute():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise ConnectionError("temporary failure")
+            return "value"
+
+        with self.assertRaises(ConnectionError):
+            memo.get("key", compute)
+        self.assertEqual(len(memo), 0)
+        self.assertEqual(memo.get("key", compute), "value")
+        self.assertEqual(memo.get("key", compute), "value")
+        self.assertEqual(len(attempts), 2)
+
+    def test_waiting_callers_get_the_failure(self):
+        memo = Memo()
+        started = threading.Event()
+        release = threading.Event()
+        errors = []
+
+        def compute():
+            started.set()
+            release.wait(5)
+            raise ValueError("failed")
+
+        def get():
+            try:
+                memo.get("key", compute)
+            except ValueError as err:
+                errors.append(err)
+
+        first = threading.Thread(target=get)
+        first.start()
+        self.assertTrue(started.wait(5))
+        second = threading.Thread(target=get)
+        second.start()
+        release.set()
+        first.join(5)
+        second.join(5)
+
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(len(memo), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import threading
+import unittest
+
+from utils.pipeline import BoundedExecutor, FairScheduler
+
+TIMEOUT = 5
+
+
+class BoundedExecutorTest(unittest.TestCase):
+    def test_returns_results(self):
+        with BoundedExecutor(2, 2, "test") as executor:
+            futures = [executor.submit(pow, value, 2) for value in range(10)]
+        self.assertEqual([future.result() for future in futures], [value ** 2 for value in range(10)])
+        self.assertEqual(executor.metrics.get("submitted"), 10)
+
+    def test_submit_blocks_while_queue_is_full(self):
+        release = threading.Event()
+        executor = BoundedExecutor(1, 1, "test")
+        executor.submit(release.wait, TIMEOUT)
+        executor.submit(release.wait, TIMEOUT)
+
+        submitted = threading.Event()
+        submitter = threading.Thread(target=lambda: (executor.submit(lambda: None), submitted.set()))
+        submitter.start()
+        self.assertFalse(submitted.wait(0.2))
+
+        release.set()
+        self.assertTrue(submitted.wait(TIMEOUT))
+        submitter.join(TIMEOUT)
+        executor.shutdown()
+        self.assertGreater(executor.metrics.get("backpressure_seconds"), 0)
+
+    def test_failed_task_releases_its_slot(self):
+        def fail():
+            raise ValueError("failed")
+
+        with BoundedExecutor(1, 0, "test") as executor:
+            failed = executor.submit(fail)
+            succeeded = executor.submit(lambda: "done")
+        self.assertIsInstance(failed.exception(TIMEOUT), ValueError)
+        self.assertEqual(succeeded.result(TIMEOUT), "done")
+
+
+class FairSchedulerTest(unittest.TestCase):
+    def test_tasks_of_keys_run_in_round_robin(self):
+        order = []
+        release = threading.Event()
+        scheduler = FairScheduler(1, "test")
+        scheduler.submit("gate", release.wait, TIMEOUT)
+        for key, count in (("a", 3), ("b", 1), ("c", 2)):
+            for num in range(count):
+                scheduler.submit(key, order.append, f"{key}{num}")
+        release.set()
+        scheduler.join()
+
+        self.assertEqual(order, ["a0", "b0", "c0", "a1", "c1", "a2"])
+
+    def test_join_waits_for_nested_tasks(self):
+        results = []
+        scheduler = FairScheduler(2, "test")
+
+        def parent(num):
+            for child in range(3):
+                scheduler.submit(num, results.append, (num, child))
+
+        for num in range(4):
+            scheduler.submit(num, parent, num)
+        scheduler.join()
+
+        self.assertEqual(sorted(results), [(num, child) for num in range(4) for child in range(3)])
+        self.assertEqual(scheduler.metrics.get("submitted"), 16)
+
+    def test_failed_task_does_not_stop_the_workers(self):
+        results = []
+
+        def fail():
+            raise ValueError("failed")
+
+        with FairScheduler(1, "test") as scheduler:
+            scheduler.submit("a", fail)
+            scheduler.submit("a", results.append, "done")
+        self.assertEqual(results, ["done"])
+
+    def test_submit_after_join_is_rejected(self):
+        scheduler = FairScheduler(1, "test")
+        scheduler.join()
+        with self.assertRaises(RuntimeError):
+            scheduler.submit("a", print)
+
+
+if __name__ == '__main__':
+    unittest.main()
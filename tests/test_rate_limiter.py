@@ -0,0 +1,88 @@
+import unittest
+from unittest import mock
+
+import utils.rate_limiter as rate_limiter
+from utils.rate_limiter import AdaptiveRateLimiter, get_rate_limiter
+
+
+class AdaptiveRateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        for name in ('monotonic', 'time'):
+            patcher = mock.patch.object(rate_limiter, name, side_effect=lambda: self.now)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.limiter = AdaptiveRateLimiter("gitlab.example.com", max_rate=10, min_rate=1)
+
+    def drain(self):
+        for _ in range(10):
+            self.assertEqual(self.limiter.reserve(), 0)
+
+    def test_bucket_is_refilled_at_the_rate(self):
+        self.drain()
+        self.assertAlmostEqual(self.limiter.reserve(), 0.1)
+        self.assertAlmostEqual(self.limiter.reserve(), 0.2)
+
+        self.now += 0.5
+        for _ in range(3):
+            self.assertEqual(self.limiter.reserve(), 0)
+        self.assertAlmostEqual(self.limiter.reserve(), 0.1)
+        self.assertEqual(self.limiter.metrics.get("throttled_requests"), 3)
+
+    def test_bucket_does_not_exceed_one_second_of_requests(self):
+        self.now += 60
+        self.drain()
+        self.assertGreater(self.limiter.reserve(), 0)
+
+    def test_requests_are_paused_and_slowed_down_on_429(self):
+        self.limiter.update(429, {'Retry-After': "5"})
+
+        self.assertEqual(self.limiter.rate, 5)
+        self.assertAlmostEqual(self.limiter.reserve(), 5)
+        self.now += 5
+        self.assertEqual(self.limiter.reserve(), 0)
+        self.assertEqual(self.limiter.metrics.get("rejected_requests"), 1)
+
+    def test_rate_does_not_drop_below_min_rate(self):
+        for _ in range(10):
+            self.limiter.update(429, {})
+
+        self.assertEqual(self.limiter.rate, 1)
+        self.assertAlmostEqual(self.limiter.reserve(), 1)
+
+    def test_rate_recovers_toward_max_rate(self):
+        self.limiter.update(429, {'Retry-After': "0"})
+        for _ in range(49):
+            self.limiter.update(200, {})
+        self.assertAlmostEqual(self.limiter.rate, 9.9)
+
+        for _ in range(10):
+            self.limiter.update(200, {})
+        self.assertEqual(self.limiter.rate, 10)
+
+    def test_rate_follows_rate_limit_headers(self):
+        self.limiter.update(200, {'RateLimit-Remaining': "30", 'RateLimit-Reset': str(self.now + 10)})
+        self.assertEqual(self.limiter.rate, 3)
+
+        self.limiter.update(200, {'RateLimit-Remaining': "0", 'RateLimit-Reset': str(self.now + 20)})
+        self.assertEqual(self.limiter.rate, 1)
+        self.assertAlmostEqual(self.limiter.reserve(), 20)
+
+
+class GetRateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(rate_limiter, 'rate_limiters', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_limiter_is_shared_by_host_and_limits(self):
+        limiter = get_rate_limiter("gitlab.example.com", 10, 1)
+
+        self.assertIs(get_rate_limiter("gitlab.example.com", 10, 1), limiter)
+        self.assertIsNot(get_rate_limiter("bitbucket.example.com", 10, 1), limiter)
+        self.assertIsNot(get_rate_limiter("gitlab.example.com", 20, 1), limiter)
+        self.assertIsNot(get_rate_limiter("gitlab.example.com", 10, 2), limiter)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import peewee
+
+import db.db_utils as db_utils
+from db.db_utils import bulk_load, write_data_to_db
+from db.models import Repository, database_proxy
+from db.staging import StagingLoader
+
+CONFLICT_TARGET = [Repository.vcs_instance_id, Repository.vcs_id]
+UPDATE = {Repository.path: peewee.EXCLUDED.path, Repository.deleted_at: None}
+
+
+def make_repo(vcs_id, instance_id=1, **fields):
+    return {'vcs_instance_id': instance_id, 'vcs_id': vcs_id, 'path': f"group/repo-{vcs_id}", 'group_id': 7,
+            'web_url': "", 'git_url': "", 'last_time_checked': datetime(2024, 1, 2, 3, 4, 5), **fields}
+
+
+class StagingLoaderTest(unittest.TestCase):
+    def setUp(self):
+        self.db = peewee.PostgresqlDatabase(None)
+        database_proxy.initialize(self.db)
+        self.addCleanup(database_proxy.initialize, None)
+        self.loader = StagingLoader(self.db, 24)
+        self.cursor = mock.Mock()
+        self.cursor.fetchone.return_value = (3, 1, 2)
+        for name, value in (('atomic', mock.MagicMock()), ('execute_sql', mock.Mock(return_value=self.cursor)),
+                            ('cursor', mock.Mock(return_value=self.cursor))):
+            patcher = mock.patch.object(self.db, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(self.loader, '_get_table', return_value='"repository_staging"')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rows_are_copied_with_the_loader_id(self):
+        staged = self.loader.copy(Repository, {1: make_repo(1, path="group/repo\t1\n", is_archived=True)},
+                                  CONFLICT_TARGET, UPDATE)
+
+        sql, buffer = self.cursor.copy_expert.call_args.args
+        self.assertEqual(staged, 1)
+        self.assertTrue(sql.startswith('COPY "repository_staging" ("vcs_instance_id", "vcs_id", "path", '))
+        self.assertTrue(sql.endswith('"_loader", "_seq", "_loaded_at") FROM STDIN'))
+        values = dict(zip([field.name for field in StagingLoader._get_fields(Repository)] + ['_loader', '_seq'],
+                          buffer.getvalue().rstrip("\n").split("\t")))
+        self.assertEqual((values['vcs_id'], values['path'], values['is_archived'], values['parents']),
+                         ("1", "group/repo\\t1\\n", "t", "\\N"))
+        self.assertEqual((values['last_time_checked'], values['_loader'], values['_seq']),
+                         ("2024-01-02T03:04:05", self.loader.loader_id, "0"))
+        self.assertEqual(self.loader.staged_models(), [Repository])
+
+    def test_arrays_are_encoded(self):
+        self.assertEqual(StagingLoader._encode([1, None, 'a"b']), '{"1",NULL,"a\\\\"b"}')
+
+    def test_staged_rows_are_merged_with_one_upsert(self):
+        self.loader.copy(Repository, {1: make_repo(1)}, CONFLICT_TARGET, UPDATE)
+
+        result = self.loader.merge(Repository, lambda update: Repository.path != peewee.EXCLUDED.path)
+
+        sql, params = self.db.execute_sql.call_args.args
+        self.assertEqual(result, (3, 1, 2))
+        self.assertIn('WITH "moved" AS (DELETE FROM "repository_staging" WHERE "_loader" = %s RETURNING *)', sql)
+        self.assertIn('SELECT DISTINCT ON ("vcs_instance_id", "vcs_id")', sql)
+        self.assertIn('ORDER BY "vcs_instance_id", "vcs_id", "_seq" DESC', sql)
+        self.assertIn('"merged" AS (INSERT INTO "repository" ("vcs_instance_id", "vcs_id", "path", ', sql)
+        self.assertIn('SELECT * FROM "rows" ON CONFLICT ("vcs_instance_id", "vcs_id") DO UPDATE SET '
+                      '"path" = EXCLUDED."path", "deleted_at" = %s WHERE ("repository"."path" != EXCLUDED."path") '
+                      'RETURNING xmax = 0 AS inserted) SELECT', sql)
+        self.assertEqual(params, [self.loader.loader_id, None])
+        self.assertEqual(self.loader.merge(Repository), (0, 0, 0))
+
+    def test_failed_merge_is_retried(self):
+        self.loader.copy(Repository, {1: make_repo(1)}, CONFLICT_TARGET, UPDATE)
+        self.db.execute_sql.side_effect = peewee.OperationalError("connection lost")
+
+        with self.assertRaises(peewee.OperationalError):
+            self.loader.merge(Repository)
+        self.assertEqual(self.loader.staged_models(), [Repository])
+
+
+class WriteDataToDbTest(unittest.TestCase):
+    def setUp(self):
+        for name in ('insert_data_to_db', 'copy_data_to_staging', 'flush_write_buffers'):
+            patcher = mock.patch.object(db_utils, name, return_value=[])
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def test_rows_are_upserted_without_a_staging_loader(self):
+        data = {1: make_repo(1)}
+        with mock.patch.object(db_utils, 'staging_loader', None):
+            with bulk_load(1):
+                write_data_to_db(Repository, data, CONFLICT_TARGET, UPDATE)
+
+        self.insert_data_to_db.assert_called_once_with(Repository, data, CONFLICT_TARGET, UPDATE)
+        self.copy_data_to_staging.assert_not_called()
+        self.flush_write_buffers.assert_not_called()
+
+    def test_only_rows_of_bulk_loaded_instances_are_staged(self):
+        loader = StagingLoader(mock.Mock(), 24)
+        with mock.patch.object(db_utils, 'staging_loader', loader):
+            with bulk_load(1):
+                write_data_to_db(Repository, {1: make_repo(1), 2: make_repo(2, instance_id=2)}, CONFLICT_TARGET,
+                                 UPDATE)
+            self.assertFalse(loader.is_active(1))
+
+        self.assertEqual(list(self.copy_data_to_staging.call_args.args[1]), [1])
+        self.assertEqual(list(self.insert_data_to_db.call_args.args[1]), [2])
+        self.flush_write_buffers.assert_called_once_with(log_stats=False)
+
+    def test_disabled_bulk_load_is_not_staged(self):
+        loader = StagingLoader(mock.Mock(), 24)
+        with mock.patch.object(db_utils, 'staging_loader', loader):
+            with bulk_load(1, enabled=False):
+                self.assertEqual(loader.active_instances(), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+import peewee
+from requests.exceptions import HTTPError
+
+import db.db_utils as db_utils
+from db.db_utils import sweep_unseen_rows, insert_repositories
+from db.models import VCSInstance, Repository, Group, Registry, Image, RepositoryUser, Contributor, ContributorsState, \
+    database_proxy
+from parsers.bitbucket_parser import BitbucketParser
+from utils.memo import Memo
+
+MODELS = [VCSInstance, Repository, Group, Registry, Image, RepositoryUser, Contributor, ContributorsState]
+
+
+class SweepTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        self.database = peewee.SqliteDatabase(self.path)
+        for name, value in (('database', self.database), ('LAST_SEEN_RESOLUTION_HOURS', 0),
+                            ('SWEEP_MAX_FRACTION', 1), ('SWEEP_DELETE_AFTER_DAYS', 0)):
+            patcher = mock.patch.object(db_utils, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(os.remove, self.path)
+        db_utils.init_db(self.database, MODELS)
+        self.addCleanup(database_proxy.initialize, None)
+
+        self.now = datetime.now()
+        with self.database:
+            self.instance = VCSInstance.create(url="https://bitbucket.example.com", type='bitbucket',
+                                               mnemonic='bitbucket')
+
+    def create_repository(self, vcs_id, group_id=7, checked_ago=timedelta(days=2), deleted_ago=None):
+        with self.database:
+            Repository.create(vcs_instance_id=self.instance.id, vcs_id=vcs_id, path=f"repo-{vcs_id}", group_id=group_id,
+                              web_url="", git_url="", last_time_checked=self.now - checked_ago,
+                              last_activity_repo=self.now, deleted_at=self.now - deleted_ago if deleted_ago else None)
+
+    def create_registry(self, repo_id, checked_ago=timedelta(days=2), deleted_ago=None):
+        with self.database:
+            Registry.create(vcs_instance_id=self.instance.id, vcs_id=str(repo_id), repo_id=repo_id,
+                            path=f"repo-{repo_id}", name=f"repo-{repo_id}", web_url="", created_at=self.now,
+                            last_time_checked=self.now - checked_ago,
+                            deleted_at=self.now - deleted_ago if deleted_ago else None)
+
+    def create_image(self, repo_id, tag, seen_ago=timedelta(days=2), deleted_ago=None):
+        with self.database:
+            Image.create(vcs_instance_id=self.instance.id, repo_id=repo_id, registry_id=repo_id,
+                         path=f"repo-{repo_id}:{tag}", tag=tag, image=f"registry/repo-{repo_id}:{tag}",
+                         digest="sha256:0", revision="", total_size=0, last_time_checked=self.now - timedelta(days=30),
+                         last_time_seen=self.now - seen_ago, deleted_at=self.now - deleted_ago if deleted_ago else None)
+
+    def tombstoned(self, model):
+        with self.database:
+            return sorted(row.vcs_id if model is not Image else row.path for row in
+                          model.select().where(model.deleted_at.is_null(False)))
+
+    def sweep(self, **kwargs):
+        return sweep_unseen_rows(self.instance.id, self.now - timedelta(minutes=1),
+                                 **{'groups': False, 'repositories': True, 'registries': False, **kwargs})
+
+
+class SweepUnseenRowsTest(SweepTestCase):
+    def test_rows_not_seen_by_the_run_are_tombstoned(self):
+        self.create_repository(1)
+        self.create_repository(2, checked_ago=timedelta(0))
+        self.create_registry(2)
+        self.create_registry(3, checked_ago=timedelta(0))
+        self.create_image(3, "old")
+        self.create_image(3, "seen", seen_ago=timedelta(0))
+
+        stats = self.sweep(registries=True)
+
+        self.assertEqual(self.tombstoned(Repository), [1])
+        self.assertEqual(self.tombstoned(Registry), ["2"])
+        self.assertEqual(self.tombstoned(Image), ["repo-3:old"])
+        self.assertEqual((stats['Repository.tombstoned'], stats['Registry.tombstoned'], stats['Image.tombstoned']),
+                         (1, 1, 1))
+
+    def test_nothing_is_tombstoned_above_max_fraction(self):
+        self.create_repository(1)
+        self.create_repository(2)
+        self.create_repository(3, checked_ago=timedelta(0))
+
+        with mock.patch.object(db_utils, 'SWEEP_MAX_FRACTION', 0.5):
+            stats = self.sweep()
+        self.assertEqual((stats['Repository.tombstoned'], self.tombstoned(Repository)), (0, []))
+
+        with mock.patch.object(db_utils, 'SWEEP_MAX_FRACTION', 0.7):
+            stats = self.sweep()
+        self.assertEqual((stats['Repository.tombstoned'], self.tombstoned(Repository)), (2, [1, 2]))
+
+    def test_registries_and_images_are_tombstoned_with_their_repository(self):
+        self.create_repository(1)
+        self.create_repository(2, checked_ago=timedelta(0))
+        for repo_id in (1, 2):
+            self.create_registry(repo_id, checked_ago=timedelta(0))
+            self.create_image(repo_id, "latest", seen_ago=timedelta(0))
+
+        stats = self.sweep()
+
+        self.assertEqual(self.tombstoned(Registry), ["1"])
+        self.assertEqual(self.tombstoned(Image), ["repo-1:latest"])
+        self.assertEqual((stats['Registry.tombstoned'], stats['Image.tombstoned']), (1, 1))
+
+    def test_tombstoned_repository_is_revived_by_an_upsert(self):
+        self.create_repository(1, deleted_ago=timedelta(days=1))
+        with self.database:
+            repo = {field: value for field, value in Repository.get(Repository.vcs_id == 1).__data__.items()
+                    if field != 'id'}
+        repo['deleted_at'] = None
+
+        with mock.patch.object(db_utils, 'WRITE_BUFFER_ENABLED', False):
+            insert_repositories({1: repo})
+
+        self.assertEqual(self.tombstoned(Repository), [])
+
+    def test_rows_tombstoned_long_ago_are_deleted(self):
+        for repo_id, deleted_ago in ((1, timedelta(days=10)), (2, timedelta(days=1))):
+            self.create_repository(repo_id, deleted_ago=deleted_ago)
+            self.create_registry(repo_id, deleted_ago=deleted_ago)
+            self.create_image(repo_id, "latest", deleted_ago=deleted_ago)
+            with self.database:
+                RepositoryUser.create(vcs_instance_id=self.instance.id, repo_id=repo_id, user_id=1,
+                                      access_level='developer')
+                Contributor.create(vcs_instance_id=self.instance.id, repo_id=repo_id, email="dev@example.com",
+                                   commits=1, additions=0, deletions=0)
+                ContributorsState.create(vcs_instance_id=self.instance.id, repo_id=repo_id, head_sha="abc",
+                                         computed_at=self.now)
+
+        with mock.patch.object(db_utils, 'SWEEP_DELETE_AFTER_DAYS', 7):
+            stats = self.sweep()
+
+        with self.database:
+            for model in (Repository, Registry, Image, RepositoryUser, Contributor, ContributorsState):
+                self.assertEqual([row.repo_id if model is not Repository else row.vcs_id for row in model.select()],
+                                 [2], model.__name__)
+        self.assertEqual((stats['Repository.deleted'], stats['Image.deleted'], stats['RepositoryUser.deleted']),
+                         (1, 1, 1))
+
+    def test_rows_are_kept_without_delete_after_days(self):
+        self.create_repository(1, deleted_ago=timedelta(days=365))
+
+        stats = self.sweep()
+
+        self.assertNotIn('Repository.deleted', stats)
+        self.assertEqual(self.tombstoned(Repository), [1])
+
+
+class BitbucketSweepTest(SweepTestCase):
+    def setUp(self):
+        super().setUp()
+        self.parser = BitbucketParser.__new__(BitbucketParser)
+        self.parser.instance = self.instance
+        self.parser._conn = mock.Mock()
+        self.parser._repos = Memo()
+        self.scheduler = mock.Mock()
+
+    def test_failed_project_listing_does_not_tombstone_its_repositories(self):
+        self.create_repository(1)
+        self.create_repository(2)
+        self.create_repository(3, group_id=8)
+        self.parser._conn.repo_list.side_effect = HTTPError("500 Server Error")
+
+        self.parser._process_project(self.scheduler, {'key': 'PRJ', 'id': 7})
+        stats = self.sweep()
+
+        self.scheduler.submit.assert_not_called()
+        self.assertEqual(self.tombstoned(Repository), [3])
+        self.assertEqual(stats['Repository.tombstoned'], 1)
+
+    def test_listed_repositories_are_processed(self):
+        self.parser._conn.repo_list.return_value = iter([{
+            "id": 1, "slug": "repo-1", "public": False, "project": {"id": 7},
+            "links": {"self": [{"href": "https://bitbucket.example.com/projects/PRJ/repos/repo-1/browse"}],
+                      "clone": [{"href": "https://bitbucket.example.com/scm/prj/repo-1.git"}]}}])
+
+        self.parser._process_project(self.scheduler, {'key': 'PRJ', 'id': 7})
+
+        self.assertEqual(self.scheduler.submit.call_count, 1)
+        self.assertEqual(self.scheduler.submit.call_args.args[:3], ('PRJ', self.parser._process_repository, 'PRJ'))
+
+
+if __name__ == '__main__':
+    unittest.main()
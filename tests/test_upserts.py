@@ -0,0 +1,110 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+import peewee
+
+import db.db_utils as db_utils
+from db.db_utils import insert_repositories, touch_repositories, sweep_unseen_rows
+from db.models import VCSInstance, Repository, Registry, Image, database_proxy
+from utils.metrics import Metrics
+
+MODELS = [VCSInstance, Repository, Registry, Image]
+
+
+class SkipUnchangedRowsTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        self.database = peewee.SqliteDatabase(self.path)
+        for name, value in (('database', self.database), ('LAST_SEEN_RESOLUTION_HOURS', 24),
+                            ('SKIP_UNCHANGED_ROWS', True), ('WRITE_BUFFER_ENABLED', False),
+                            ('SWEEP_MAX_FRACTION', 1), ('SWEEP_DELETE_AFTER_DAYS', 0), ('upsert_metrics', {})):
+            patcher = mock.patch.object(db_utils, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(os.remove, self.path)
+        db_utils.init_db(self.database, MODELS)
+        self.addCleanup(database_proxy.initialize, None)
+
+        self.now = datetime.now()
+        with self.database:
+            self.instance = VCSInstance.create(url="https://gitlab.example.com", type='gitlab', mnemonic='gitlab')
+
+    def make_repo(self, vcs_id, checked_ago, **fields):
+        return {'vcs_instance_id': self.instance.id, 'vcs_id': vcs_id, 'path': f"group/repo-{vcs_id}", 'group_id': 7,
+                'web_url': "", 'git_url': "", 'last_time_checked': self.now - checked_ago,
+                'last_activity_repo': datetime(2024, 1, 1), **fields}
+
+    def create_repository(self, vcs_id, checked_ago):
+        with self.database:
+            Repository.create(**self.make_repo(vcs_id, checked_ago))
+
+    def stored(self, vcs_id):
+        with self.database:
+            return Repository.get(Repository.vcs_id == vcs_id)
+
+    def test_condition_compares_content_and_check_age(self):
+        where = db_utils._changed_rows_condition({Repository.path: peewee.EXCLUDED.path,
+                                                  Repository.last_time_checked: peewee.EXCLUDED.last_time_checked})
+
+        sql, params = Repository.select().where(where).sql()
+        self.assertIn('("t1"."path" IS NOT EXCLUDED."path")', sql)
+        self.assertIn('("t1"."last_time_checked" IS NULL)', sql)
+        self.assertIn('("t1"."last_time_checked" < ?)', sql)
+        self.assertAlmostEqual(params[0], self.now - timedelta(hours=24), delta=timedelta(minutes=1))
+        self.assertIsNone(db_utils._changed_rows_condition({}))
+
+    def test_only_changed_or_stale_rows_are_rewritten(self):
+        self.create_repository(1, timedelta(hours=1))
+        self.create_repository(2, timedelta(hours=1))
+        self.create_repository(3, timedelta(hours=30))
+
+        insert_repositories({
+            1: self.make_repo(1, timedelta(0)),
+            2: self.make_repo(2, timedelta(0), path="group/moved-2"),
+            3: self.make_repo(3, timedelta(0)),
+            4: self.make_repo(4, timedelta(0)),
+        })
+
+        self.assertEqual(self.stored(1).last_time_checked, self.now - timedelta(hours=1))
+        self.assertEqual((self.stored(2).path, self.stored(2).last_time_checked), ("group/moved-2", self.now))
+        self.assertEqual(self.stored(3).last_time_checked, self.now)
+        metrics = db_utils.upsert_metrics[Repository]
+        self.assertEqual((metrics.get("written"), metrics.get("unchanged")), (3, 1))
+
+    def test_rows_written_into_postgres_are_split_into_inserted_and_updated(self):
+        model = mock.Mock()
+        model.insert_many.return_value.on_conflict.return_value.returning.return_value.tuples.return_value \
+            .execute.return_value = [(True,), (False,), (False,)]
+        metrics = Metrics("test")
+
+        with mock.patch.object(db_utils, 'database', mock.Mock()):
+            db_utils._upsert_chunk(model, [{}] * 5, [], {}, None, metrics)
+
+        returning = model.insert_many.return_value.on_conflict.return_value.returning
+        self.assertEqual(str(returning.call_args.args[0].sql), 'xmax = 0')
+        self.assertEqual((metrics.get("inserted"), metrics.get("updated"), metrics.get("unchanged")), (1, 2, 2))
+
+    def test_rows_checked_within_the_window_are_neither_touched_nor_swept(self):
+        run_started_at = self.now - timedelta(minutes=1)
+        self.create_repository(1, timedelta(hours=1))
+        self.create_repository(2, timedelta(hours=30))
+        self.create_repository(3, timedelta(hours=30))
+
+        touch_repositories(self.instance.id, [1, 2])
+        with self.assertLogs(level='INFO') as logs:
+            stats = sweep_unseen_rows(self.instance.id, run_started_at, groups=False, repositories=True,
+                                      registries=False)
+
+        self.assertEqual(self.stored(1).last_time_checked, self.now - timedelta(hours=1))
+        self.assertGreater(self.stored(2).last_time_checked, run_started_at)
+        self.assertEqual([self.stored(vcs_id).deleted_at is not None for vcs_id in (1, 2, 3)], [False, False, True])
+        self.assertEqual(stats['Repository.tombstoned'], 1)
+        self.assertIn(f"not seen since {run_started_at - timedelta(hours=24):%Y-%m-%d %H:%M:%S}", logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+from unittest import mock
+
+import db.db_utils as db_utils
+from db.db_utils import insert_users, reset_users_cache
+from parsers.bitbucket_parser import BitbucketParser
+from utils.memo import Memo
+
+
+def make_user(vcs_id, instance_id=1, state="active"):
+    return {'vcs_instance_id': instance_id, 'vcs_id': vcs_id, 'username': f"user-{vcs_id}", 'name': "User",
+            'state': state, 'locked': False, 'web_url': ""}
+
+
+class UsersCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.written = []
+        self.fail_writes = False
+
+        def write_data_to_db(model, data, conflict_target, update):
+            if self.fail_writes:
+                return []
+            self.written += [row['vcs_id'] for row in data.values()]
+            return list(data.values())
+
+        for name, value in (('WRITE_BUFFER_ENABLED', False), ('write_data_to_db', write_data_to_db),
+                            ('users_caches', {})):
+            patcher = mock.patch.object(db_utils, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        reset_users_cache()
+
+    def insert(self, *users):
+        insert_users({(user['vcs_instance_id'], user['vcs_id']): user for user in users})
+
+    def test_unchanged_users_are_written_once(self):
+        self.insert(make_user(1), make_user(2))
+        self.insert(make_user(1), make_user(2, state="blocked"))
+        self.insert(make_user(1, instance_id=2))
+
+        self.assertEqual(self.written, [1, 2, 2, 1])
+        self.assertEqual((db_utils.users_cache_metrics.get("hits"), db_utils.users_cache_metrics.get("writes")),
+                         (1, 4))
+
+    def test_users_are_remembered_once_written(self):
+        self.fail_writes = True
+        self.insert(make_user(1))
+        self.fail_writes = False
+        self.insert(make_user(1))
+
+        self.assertEqual(self.written, [1])
+
+    def test_cache_is_reset_by_instance(self):
+        self.insert(make_user(1), make_user(1, instance_id=2))
+
+        reset_users_cache(2)
+        self.insert(make_user(1), make_user(1, instance_id=2))
+        self.assertEqual(self.written, [1, 1, 1])
+        self.assertEqual(db_utils.users_cache_metrics.get("hits"), 1)
+
+        reset_users_cache()
+        self.insert(make_user(1))
+        self.assertEqual(self.written, [1, 1, 1, 1])
+        self.assertEqual(db_utils.users_cache_metrics.get("hits"), 0)
+
+
+class BitbucketUsersTest(unittest.TestCase):
+    def setUp(self):
+        self.parser = BitbucketParser.__new__(BitbucketParser)
+        self.parser.instance = mock.Mock(id=1)
+        self.parser._conn = mock.Mock()
+        self.parser._conn.project_users.return_value = iter([
+            {'user': {'id': 10, 'name': "dev", 'displayName': "Dev", 'active': True, 'links': {
+                'self': [{'href': "https://bitbucket.invalid/users/dev"}]}}, 'permission': "PROJECT_WRITE"},
+            {'user': {'id': 11, 'name': "admin", 'displayName': "Admin", 'active': True, 'links': {
+                'self': [{'href': "https://bitbucket.invalid/users/admin"}]}}, 'permission': "PROJECT_ADMIN"}])
+        self.parser._repos = Memo()
+        self.parser._get_repos = mock.Mock(return_value=[{'id': 1, 'project': {'id': 7}},
+                                                         {'id': 2, 'project': {'id': 7}}])
+        for name in ('insert_users', 'insert_repository_users'):
+            patcher = mock.patch(f'parsers.bitbucket_parser.{name}')
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def test_access_is_stored_per_repository_and_user(self):
+        self.parser._process_user("PRJ")
+
+        repository_users = self.insert_repository_users.call_args.args[0]
+        self.assertEqual(sorted((row['repo_id'], row['user_id'], row['access_level'])
+                                for row in repository_users.values()),
+                         [(1, 10, "PROJECT_WRITE"), (1, 11, "PROJECT_ADMIN"),
+                          (2, 10, "PROJECT_WRITE"), (2, 11, "PROJECT_ADMIN")])
+        self.assertEqual(list(self.insert_users.call_args.args[0]), [10, 11])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+from unittest import mock
+
+from db.models import Repository
+from db.write_buffer import WriteBehindBuffer
+
+CONFLICT_TARGET = [Repository.vcs_instance_id, Repository.vcs_id]
+
+
+def make_row(vcs_id, path):
+    return {'vcs_instance_id': 1, 'vcs_id': vcs_id, 'path': path}
+
+
+class WriteBehindBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.writes = []
+
+    def writer(self, model, rows, conflict_target, update):
+        self.writes.append(list(rows.values()))
+        return list(rows.values())
+
+    def make_buffer(self, max_rows=10, max_age=60.0, **kwargs):
+        return WriteBehindBuffer(Repository, CONFLICT_TARGET, {}, self.writer, max_rows=max_rows, max_age=max_age,
+                                 **kwargs)
+
+    def test_rows_are_deduplicated_by_conflict_target(self):
+        buffer = self.make_buffer()
+        buffer.add({1: make_row(1, 'old'), 2: make_row(2, 'other')})
+        buffer.add({1: make_row(1, 'new')})
+
+        self.assertEqual(buffer.pending(), 2)
+        buffer.flush()
+        self.assertEqual(self.writes, [[make_row(1, 'new'), make_row(2, 'other')]])
+        self.assertEqual(buffer.pending(), 0)
+
+    def test_flushes_once_max_rows_are_buffered(self):
+        buffer = self.make_buffer(max_rows=3)
+        buffer.add({1: make_row(1, 'a'), 2: make_row(2, 'b')})
+        self.assertEqual(self.writes, [])
+
+        buffer.add({3: make_row(3, 'c')})
+        self.assertEqual(len(self.writes), 1)
+        self.assertEqual(len(self.writes[0]), 3)
+        self.assertEqual(buffer.metrics.get("batches"), 1)
+        self.assertEqual(buffer.metrics.get("rows"), 3)
+
+    def test_flushes_once_oldest_row_is_max_age_old(self):
+        buffer = self.make_buffer(max_age=5)
+        with mock.patch('db.write_buffer.monotonic', return_value=100.0):
+            buffer.add({1: make_row(1, 'a')})
+        with mock.patch('db.write_buffer.monotonic', return_value=104.0):
+            buffer.add({2: make_row(2, 'b')})
+        self.assertEqual(self.writes, [])
+
+        with mock.patch('db.write_buffer.monotonic', return_value=105.0):
+            buffer.add({3: make_row(3, 'c')})
+        self.assertEqual(len(self.writes), 1)
+        self.assertEqual(len(self.writes[0]), 3)
+
+    def test_empty_buffer_is_not_written(self):
+        buffer = self.make_buffer()
+        buffer.flush()
+        self.assertEqual(self.writes, [])
+
+    def test_written_rows_are_reported(self):
+        written = []
+        buffer = self.make_buffer(on_written=written.extend)
+        buffer.add({1: make_row(1, 'a'), 2: make_row(2, 'b')})
+        buffer.flush()
+        self.assertEqual(written, [make_row(1, 'a'), make_row(2, 'b')])
+
+    def test_dropped_rows_are_not_reported(self):
+        written = []
+        buffer = WriteBehindBuffer(Repository, CONFLICT_TARGET, {}, lambda *args: [], max_rows=10, max_age=60,
+                                   on_written=written.extend)
+        buffer.add({1: make_row(1, 'a')})
+        buffer.flush()
+        self.assertEqual(written, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
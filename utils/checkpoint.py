@@ -0,0 +1,107 @@
+import threading
+from time import monotonic
+from typing import Optional
+
+from db.db_utils import flush_write_buffers, save_inventory_checkpoint
+from settings.config import CHECKPOINT_INTERVAL
+from settings.logger import logger
+
+
+class ListingCheckpoint:
+    """
+    Resumable position of a listing sorted by descending ID, whose items are processed concurrently.
+
+    The cursor is the `id_before` value the listing is resumed from: every listed item with a greater ID has all its
+    tasks finished. The rows the finished tasks left in the write-behind buffers are flushed before the cursor is
+    stored, so a resumed run never skips an item whose rows were lost.
+    """
+
+    def __init__(self, run_id: int, stage: str, cursor: Optional[int] = None, interval: int = CHECKPOINT_INTERVAL):
+        self.run_id = run_id
+        self.stage = stage
+        self.resumed_from = cursor
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._in_flight = {}
+        self._last_listed = cursor
+        self._saved = cursor
+        self._saved_at = monotonic()
+
+    def list_filters(self) -> dict:
+        """
+        @return: Filters resuming the listing after the stored position.
+        """
+        if self.resumed_from:
+            logger.info(f"- Resuming stage '{self.stage}' before id {self.resumed_from}")
+            return {'id_before': self.resumed_from}
+        return {}
+
+    def is_done(self, item_id: int) -> bool:
+        """
+        @return: Whether the item has been processed before the run was interrupted.
+        """
+        return bool(self.resumed_from) and item_id >= self.resumed_from
+
+    def add(self, item_id: int) -> None:
+        """
+        Register a task of a listed item.
+
+        @param item_id: ID of the item.
+
+        @return: None.
+        """
+        with self._lock:
+            self._in_flight[item_id] = self._in_flight.get(item_id, 0) + 1
+            if self._last_listed is None or item_id < self._last_listed:
+                self._last_listed = item_id
+
+    def done(self, item_id: int, autosave: bool = True) -> None:
+        """
+        Register a finished task of a listed item.
+
+        @param item_id: ID of the item.
+        @param autosave: Whether to store the position if it was not stored for the interval.
+
+        @return: None.
+        """
+        with self._lock:
+            self._in_flight[item_id] -= 1
+            if not self._in_flight[item_id]:
+                del self._in_flight[item_id]
+        if autosave and self.is_due():
+            self.save()
+
+    def is_due(self) -> bool:
+        """
+        @return: Whether the position was not stored for the interval.
+        """
+        return monotonic() - self._saved_at >= self._interval
+
+    def _cursor(self) -> Optional[int]:
+        with self._lock:
+            return max(self._in_flight) + 1 if self._in_flight else self._last_listed
+
+    def save(self, is_completed: bool = False) -> None:
+        """
+        Flush the write-behind buffers and store the position.
+
+        @param is_completed: Whether the listing and all the tasks have been finished.
+
+        @return: None.
+        """
+        if not self._save_lock.acquire(blocking=is_completed):
+            return
+        try:
+            cursor = self._cursor()
+            self._saved_at = monotonic()
+            if cursor == self._saved and not is_completed:
+                return
+            flush_write_buffers(log_stats=False)
+            save_inventory_checkpoint(self.run_id, self.stage, cursor, is_completed)
+            self._saved = cursor
+            logger.debug(f"- Checkpoint of stage '{self.stage}' saved at id {cursor}")
+        except Exception as err:
+            logger.error(f"Error on saving checkpoint of stage '{self.stage}': {err}")
+        finally:
+            self._save_lock.release()
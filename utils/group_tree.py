@@ -0,0 +1,45 @@
+import threading
+from typing import Optional
+
+
+class GroupTree:
+    """Thread-safe in-memory tree of VCS groups, used to resolve ancestors of a namespace without API calls"""
+
+    def __init__(self):
+        self._parents = {}
+        self._ids_by_path = {}
+        self._lock = threading.Lock()
+
+    def add(self, group_id: int, parent_id: Optional[int], full_path: str) -> None:
+        with self._lock:
+            self._parents[group_id] = parent_id
+            self._ids_by_path[full_path] = group_id
+
+    def get_id(self, full_path: str) -> Optional[int]:
+        with self._lock:
+            return self._ids_by_path.get(full_path)
+
+    def ancestors(self, group_id: int) -> Optional[list[int]]:
+        """
+        Resolves the chain of groups from the given group up to its root group.
+
+        @param group_id: ID of the group to start from.
+
+        @return: List of group IDs starting with `group_id` itself, or None if any group of the chain is unknown.
+        """
+        chain = []
+        with self._lock:
+            while group_id is not None:
+                if group_id not in self._parents or group_id in chain:
+                    return None
+                chain.append(group_id)
+                group_id = self._parents[group_id]
+        return chain
+
+    def __contains__(self, group_id: int) -> bool:
+        with self._lock:
+            return group_id in self._parents
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._parents)
@@ -0,0 +1,44 @@
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable
+
+
+class Memo:
+    """
+    Thread-safe memoization of values computed at most once per key.
+
+    Threads asking for a key which is being computed wait for the result instead of computing it again. Failures are not
+    memoized: the callers waiting for the key get the error, and the next call computes the value again.
+    """
+
+    def __init__(self):
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Return the value of the key, computing it on the first call.
+
+        @param key: Key of the value.
+        @param compute: Function computing the value.
+
+        @return: The value of the key. Errors raised by `compute` are raised for all callers waiting for the key.
+        """
+        with self._lock:
+            future = self._futures.get(key)
+            is_computed = future is not None
+            if not is_computed:
+                future = self._futures[key] = Future()
+        if not is_computed:
+            try:
+                future.set_result(compute())
+            except Exception as err:
+                with self._lock:
+                    if self._futures.get(key) is future:
+                        del self._futures[key]
+                future.set_exception(err)
+        return future.result()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._futures)
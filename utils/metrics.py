@@ -0,0 +1,40 @@
+import threading
+from collections import defaultdict
+
+
+class Metrics:
+    """Thread-safe set of named counters, used to expose tuning statistics of inventory components"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._values = defaultdict(float)
+
+    def incr(self, key: str, value: float = 1) -> None:
+        with self._lock:
+            self._values[key] += value
+
+    def set(self, key: str, value: float) -> None:
+        with self._lock:
+            self._values[key] = value
+
+    def set_max(self, key: str, value: float) -> None:
+        with self._lock:
+            if value > self._values[key]:
+                self._values[key] = value
+
+    def get(self, key: str) -> float:
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def __str__(self) -> str:
+        values = ", ".join(f"{key}={round(value, 3)}" for key, value in sorted(self.snapshot().items()))
+        return f"{self.name}: {values}"
@@ -0,0 +1,179 @@
+import itertools
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from time import monotonic
+from typing import Hashable
+
+from settings.logger import logger
+from utils.metrics import Metrics
+
+
+class BoundedExecutor:
+    """
+    Thread pool accepting at most `queue_size` tasks waiting for a worker.
+
+    `submit` blocks while the queue is full, which applies backpressure to the listing iterator feeding the pool, so
+    the memory used by pending tasks stays flat regardless of the instance size.
+    """
+
+    def __init__(self, max_workers: int, queue_size: int, name: str):
+        self.max_workers = max_workers
+        self.metrics = Metrics(f"work_queue.{name}")
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._slots = threading.BoundedSemaphore(max_workers + queue_size)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._busy = 0
+        self._started_at = monotonic()
+        self._is_shut_down = False
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        waiting_since = monotonic()
+        self._slots.acquire()
+        self.metrics.incr("backpressure_seconds", monotonic() - waiting_since)
+        with self._lock:
+            self._queued += 1
+            self.metrics.incr("submitted")
+            self.metrics.set("queue_depth", self._queued)
+            self.metrics.set_max("max_queue_depth", self._queued)
+        try:
+            return self._executor.submit(self._run, fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _run(self, fn, *args, **kwargs):
+        with self._lock:
+            self._queued -= 1
+            self._busy += 1
+            self.metrics.set("queue_depth", self._queued)
+            self.metrics.set_max("max_busy_workers", self._busy)
+        started_at = monotonic()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.metrics.incr("busy_seconds", monotonic() - started_at)
+            with self._lock:
+                self._busy -= 1
+            self._slots.release()
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False) -> None:
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+        if wait and not self._is_shut_down:
+            self._is_shut_down = True
+            elapsed = monotonic() - self._started_at
+            if elapsed:
+                self.metrics.set("utilisation", self.metrics.get("busy_seconds") / (elapsed * self.max_workers))
+            logger.info(str(self.metrics))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(wait=True)
+        return False
+
+
+class FairScheduler:
+    """
+    Fixed pool of threads running tasks queued by key (e.g. a project) in round-robin order between the keys.
+
+    A key with thousands of tasks does not delay the tasks of the other keys, and tasks may submit further tasks, so
+    nested work (e.g. repositories of a project) shares the same concurrency limit instead of spawning its own pool.
+    """
+
+    _counter = itertools.count()
+
+    def __init__(self, max_workers: int, name: str):
+        self.max_workers = max_workers
+        self.metrics = Metrics(f"scheduler.{name}")
+        self._queues = OrderedDict()
+        self._lock = threading.Lock()
+        self._has_tasks = threading.Condition(self._lock)
+        self._is_idle = threading.Condition(self._lock)
+        self._pending = 0
+        self._busy = 0
+        self._is_closed = False
+        self._started_at = monotonic()
+        scheduler_num = next(self._counter)
+        self._threads = [threading.Thread(target=self._work, name=f"FairScheduler-{scheduler_num}_{num}", daemon=True)
+                         for num in range(max_workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, key: Hashable, fn, *args, **kwargs) -> None:
+        """
+        Queue a task.
+
+        @param key: Key the task is queued under, tasks of the same key run in submission order.
+        @param fn: Function to run.
+
+        @return: None.
+        """
+        with self._lock:
+            if self._is_closed:
+                raise RuntimeError("cannot submit tasks after join")
+            self._queues.setdefault(key, deque()).append((fn, args, kwargs))
+            self._pending += 1
+            self.metrics.incr("submitted")
+            self.metrics.set_max("max_pending", self._pending)
+            self.metrics.set_max("max_keys", len(self._queues))
+            self._has_tasks.notify()
+
+    def _next_task(self) -> tuple:
+        key, queue = self._queues.popitem(last=False)
+        task = queue.popleft()
+        if queue:
+            self._queues[key] = queue
+        return task
+
+    def _work(self) -> None:
+        while True:
+            with self._lock:
+                while not self._queues and not self._is_closed:
+                    self._has_tasks.wait()
+                if not self._queues:
+                    return
+                fn, args, kwargs = self._next_task()
+                self._busy += 1
+                self.metrics.set_max("max_busy_workers", self._busy)
+            started_at = monotonic()
+            try:
+                fn(*args, **kwargs)
+            except BaseException as err:
+                logger.error(f"Unexpected error in scheduled task {getattr(fn, '__name__', fn)}: {err!r}")
+            finally:
+                self.metrics.incr("busy_seconds", monotonic() - started_at)
+                with self._lock:
+                    self._busy -= 1
+                    self._pending -= 1
+                    if not self._pending:
+                        self._is_idle.notify_all()
+
+    def join(self) -> None:
+        """
+        Wait for all tasks, including the tasks submitted by running tasks, then stop the threads.
+
+        @return: None.
+        """
+        with self._lock:
+            while self._pending:
+                self._is_idle.wait()
+            if self._is_closed:
+                return
+            self._is_closed = True
+            self._has_tasks.notify_all()
+        for thread in self._threads:
+            thread.join()
+        elapsed = monotonic() - self._started_at
+        if elapsed:
+            self.metrics.set("utilisation", self.metrics.get("busy_seconds") / (elapsed * self.max_workers))
+        logger.info(str(self.metrics))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.join()
+        return False
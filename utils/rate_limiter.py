@@ -0,0 +1,140 @@
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+from time import monotonic, sleep, time
+from typing import Mapping, Optional
+from urllib.parse import urlparse
+
+import requests
+
+from utils.metrics import Metrics
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket shared by all the workers of a VCS instance.
+
+    The rate adapts to the `RateLimit-Remaining` / `RateLimit-Reset` headers of the responses, all requests are paused
+    for `Retry-After` seconds when the instance answers 429, and the rate slowly grows back while no limit headers are
+    received.
+    """
+
+    def __init__(self, name: str, max_rate: float, min_rate: float):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.rate = max_rate
+        self.metrics = Metrics(f"rate_limiter.{name}")
+        self._tokens = max_rate
+        self._updated_at = monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.rate, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def reserve(self) -> float:
+        """
+        Take a token from the bucket.
+
+        @return: Time in seconds the caller has to wait before sending its request.
+        """
+        with self._lock:
+            now = monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            delay = max(self._paused_until - now, -self._tokens / self.rate, 0)
+        self.metrics.incr("requests")
+        if delay:
+            self.metrics.incr("throttled_requests")
+            self.metrics.incr("throttled_seconds", delay)
+        return delay
+
+    def acquire(self) -> None:
+        delay = self.reserve()
+        if delay:
+            sleep(delay)
+
+    async def acquire_async(self) -> None:
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _parse_retry_after(value: Optional[str]) -> float:
+        if not value:
+            return 1
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            try:
+                return max(parsedate_to_datetime(value).timestamp() - time(), 0)
+            except (TypeError, ValueError):
+                return 1
+
+    def update(self, status: int, headers: Mapping) -> None:
+        """
+        Adapt the rate to the response of the instance.
+
+        @param status: HTTP status code of the response.
+        @param headers: Headers of the response.
+
+        @return: None.
+        """
+        remaining = headers.get('RateLimit-Remaining')
+        reset = headers.get('RateLimit-Reset')
+        with self._lock:
+            now = monotonic()
+            if status == 429:
+                self._paused_until = max(self._paused_until, now + self._parse_retry_after(headers.get('Retry-After')))
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.metrics.incr("rejected_requests")
+            if remaining is not None and reset is not None:
+                try:
+                    remaining, window = float(remaining), max(float(reset) - time(), 1)
+                except ValueError:
+                    pass
+                else:
+                    self.rate = min(self.max_rate, max(self.min_rate, remaining / window))
+                    if remaining <= 0:
+                        self._paused_until = max(self._paused_until, now + window)
+            elif status != 429:
+                self.rate = min(self.max_rate, self.rate + self.min_rate / 10)
+            self.metrics.set("rate", self.rate)
+
+
+rate_limiters = {}
+rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(host: str, max_rate: float, min_rate: float) -> AdaptiveRateLimiter:
+    """
+    Return the rate limiter shared by the clients of a host configured with the same limits.
+
+    @param host: Host of the requests.
+    @param max_rate: Maximum rate of the requests, per second.
+    @param min_rate: Minimum rate of the requests, per second.
+
+    @return: The rate limiter.
+    """
+    key = (host, max_rate, min_rate)
+    with rate_limiters_lock:
+        if key not in rate_limiters:
+            rate_limiters[key] = AdaptiveRateLimiter(host, max_rate, min_rate)
+        return rate_limiters[key]
+
+
+class RateLimitedSession(requests.Session):
+    """requests session sending every request through the rate limiter of the requested host"""
+
+    def __init__(self, max_rate: float, min_rate: float):
+        super().__init__()
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+
+    def send(self, request, **kwargs):
+        rate_limiter = get_rate_limiter(urlparse(request.url).netloc, self.max_rate, self.min_rate)
+        rate_limiter.acquire()
+        response = super().send(request, **kwargs)
+        rate_limiter.update(response.status_code, response.headers)
+        return response
@@ -1,4 +1,8 @@
+from datetime import datetime, timezone
 from threading import current_thread
+from typing import Any, Optional
+
+import dateutil.parser
 
 
 def get_thread_num() -> int:
@@ -6,3 +10,13 @@ def get_thread_num() -> int:
         return 0
     else:
         return int(current_thread().name.split('-')[1].split('_')[1])
+
+
+def to_naive_utc(value: Any) -> Optional[datetime]:
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = dateutil.parser.isoparse(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value